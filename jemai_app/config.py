@@ -1,16 +1,96 @@
 ﻿import os
+import json
+import logging
 import platform
 from pathlib import Path
 from dotenv import load_dotenv
 
 load_dotenv()
 
+def _env_json(name):
+    """JSON object from an environment variable; a malformed value is logged and ignored so the defaults stay."""
+    try:
+        value = json.loads(os.getenv(name) or "{}")
+        if not isinstance(value, dict): raise ValueError("expected a JSON object")
+        return value
+    except ValueError as e:
+        logging.warning(f"CONFIG: Ignoring {name}: {e}")
+        return {}
+
 IS_WINDOWS = platform.system() == "Windows"
 OS_NAME = platform.system()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") # None = api.openai.com, or any OpenAI-compatible server
+LLM_POOL_SIZE = int(os.getenv("JEMAI_LLM_POOL_SIZE", 16)) # keep-alive connections per endpoint, shared by all threads
+LLM_KEEPALIVE = float(os.getenv("JEMAI_LLM_KEEPALIVE", 60)) # seconds an idle connection is kept open
+LLM_TIMEOUT = float(os.getenv("JEMAI_LLM_TIMEOUT", 120)) # seconds for a whole completion
+LLM_CONNECT_TIMEOUT = float(os.getenv("JEMAI_LLM_CONNECT_TIMEOUT", 5))
+LLM_MAX_RETRIES = int(os.getenv("JEMAI_LLM_MAX_RETRIES", 2))
+LLM_CACHE = os.getenv("JEMAI_LLM_CACHE", "true").lower() in ['true', '1', 't'] # exact-match response cache; calls can opt out with cache=False
+LLM_CACHE_TTL = int(os.getenv("JEMAI_LLM_CACHE_TTL", 7 * 86400)) # seconds, 0 = no expiry
+LLM_CACHE_MAX_MB = float(os.getenv("JEMAI_LLM_CACHE_MAX_MB", 64))
+LLM_SEMANTIC_CACHE = os.getenv("JEMAI_LLM_SEMANTIC_CACHE", "false").lower() in ['true', '1', 't'] # reuse answers to reworded questions
+LLM_SEMANTIC_THRESHOLD = float(os.getenv("JEMAI_LLM_SEMANTIC_THRESHOLD", 0.92)) # cosine similarity of the questions' embeddings
+LLM_SEMANTIC_MAX_ENTRIES = int(os.getenv("JEMAI_LLM_SEMANTIC_MAX_ENTRIES", 2000)) # most recent questions compared
+# LLM backends by name: kind (openai | ollama | mock), base_url, models (glob patterns of the model names it serves) and
+# optional api_key, timeout, cooldown_s; JSON in JEMAI_LLM_PROVIDERS adds or replaces entries (see core/llm_providers.py).
+LLM_PROVIDERS = {"openai": {"kind": "openai", "base_url": OPENAI_BASE_URL, "models": ["gpt-*", "chatgpt-*", "o1*", "o3*", "o4*"]},
+                 "ollama": {"kind": "ollama", "base_url": os.getenv("OLLAMA_HOST", "http://localhost:11434"),
+                            "models": ["llama*", "codellama*", "qwen*", "mistral*", "mixtral*", "phi*", "gemma*", "deepseek*"]}}
+LLM_PROVIDERS.update(_env_json("JEMAI_LLM_PROVIDERS"))
+LLM_DEFAULT_PROVIDER = os.getenv("JEMAI_LLM_DEFAULT_PROVIDER", "openai") # serves model names no provider claims
+LLM_FALLBACK = [r.strip() for r in os.getenv("JEMAI_LLM_FALLBACK", "").split(",") if r.strip()] # provider:model routes tried after a failure
+LLM_SMALL_MODEL = os.getenv("JEMAI_LLM_SMALL_MODEL", "") # provider:model tried first for short prompts, e.g. ollama:llama3:latest
+LLM_SMALL_PROMPT_TOKENS = int(os.getenv("JEMAI_LLM_SMALL_PROMPT_TOKENS", 300))
+LLM_PROVIDER_COOLDOWN = float(os.getenv("JEMAI_LLM_PROVIDER_COOLDOWN", 30)) # seconds a failed provider goes last, doubling per failure in a row
+LLM_STREAM = os.getenv("JEMAI_LLM_STREAM", "false").lower() in ['true', '1', 't'] # chat default when a message doesn't set "stream"
 JEMAI_PORT = int(os.getenv("JEMAI_PORT", 8181))
 FLASK_DEBUG = os.getenv("FLASK_DEBUG", "false").lower() in ['true', '1', 't']
 TRIGGER_PREFIX = "j::"
+RAG_BATCH_SIZE = int(os.getenv("JEMAI_RAG_BATCH_SIZE", 64))
+RAG_CHUNK_TOKENS = int(os.getenv("JEMAI_RAG_CHUNK_TOKENS", 200))
+RAG_CHUNK_OVERLAP = int(os.getenv("JEMAI_RAG_CHUNK_OVERLAP", 30))
+RAG_BACKEND = os.getenv("JEMAI_RAG_BACKEND", "auto").lower() # auto | chroma | numpy
+RAG_EMBEDDER = os.getenv("JEMAI_RAG_EMBEDDER", "all-MiniLM-L6-v2") # sentence-transformers model name, or "hashing"
+RAG_QUERY_CACHE_SIZE = int(os.getenv("JEMAI_RAG_QUERY_CACHE_SIZE", 512))
+RAG_RESULT_CACHE_SIZE = int(os.getenv("JEMAI_RAG_RESULT_CACHE_SIZE", 256))
+RAG_HYBRID = os.getenv("JEMAI_RAG_HYBRID", "true").lower() in ['true', '1', 't']
+RAG_RRF_K = int(os.getenv("JEMAI_RAG_RRF_K", 60))
+RAG_KEYWORD_SHORTCUT_RATIO = float(os.getenv("JEMAI_RAG_KEYWORD_SHORTCUT_RATIO", 1.5))
+RAG_ANN = os.getenv("JEMAI_RAG_ANN", "none").lower() # none | ivf (NumPy backend; Chroma uses its own HNSW)
+RAG_ANN_NLIST = int(os.getenv("JEMAI_RAG_ANN_NLIST", 0)) # 0 = sqrt(rows)
+RAG_ANN_NPROBE = int(os.getenv("JEMAI_RAG_ANN_NPROBE", 8))
+RAG_ANN_MIN_ROWS = int(os.getenv("JEMAI_RAG_ANN_MIN_ROWS", 5000))
+RAG_QUANTIZATION = os.getenv("JEMAI_RAG_QUANTIZATION", "none").lower() # none | int8 (4x smaller) | binary (32x smaller)
+RAG_RERANK_FACTOR = int(os.getenv("JEMAI_RAG_RERANK_FACTOR", 4)) # exact re-scoring of k * factor candidates
+RAG_SHARDS = int(os.getenv("JEMAI_RAG_SHARDS", 0)) # worker processes for exact NumPy-store scans; 0/1 = scan in-process
+RAG_SHARD_MIN_ROWS = int(os.getenv("JEMAI_RAG_SHARD_MIN_ROWS", 50000))
+RAG_CONTEXT_TOKENS = int(os.getenv("JEMAI_RAG_CONTEXT_TOKENS", 1200)) # prompt budget for retrieved context
+RAG_CONTEXT_CANDIDATES = int(os.getenv("JEMAI_RAG_CONTEXT_CANDIDATES", 12))
+RAG_CONTEXT_MIN_SCORE = float(os.getenv("JEMAI_RAG_CONTEXT_MIN_SCORE", 0.2)) # cosine similarity a candidate needs to enter the context
+RAG_MMR_LAMBDA = float(os.getenv("JEMAI_RAG_MMR_LAMBDA", 0.7)) # 1.0 = pure relevance, lower = more diversity
+RAG_CHAT_MEMORY = os.getenv("JEMAI_RAG_CHAT_MEMORY", "false").lower() in ['true', '1', 't'] # store finished chat turns in the "chat" namespace
+RAG_INGEST_WORKERS = int(os.getenv("JEMAI_RAG_INGEST_WORKERS", 2))
+RAG_CRAWL_CONCURRENCY = int(os.getenv("JEMAI_RAG_CRAWL_CONCURRENCY", 16))
+RAG_CRAWL_PER_HOST = int(os.getenv("JEMAI_RAG_CRAWL_PER_HOST", 4))
+RAG_CRAWL_MAX_BYTES = int(os.getenv("JEMAI_RAG_CRAWL_MAX_BYTES", 5 * 2**20))
+RAG_CRAWL_TIMEOUT = float(os.getenv("JEMAI_RAG_CRAWL_TIMEOUT", 15))
+RAG_CRAWL_MAX_PAGES = int(os.getenv("JEMAI_RAG_CRAWL_MAX_PAGES", 200))
+RAG_HTML_EXTRACTOR = os.getenv("JEMAI_RAG_HTML_EXTRACTOR", "auto") # auto (lxml if installed, else stdlib) | lxml | stdlib | bs4
+RAG_DEDUP = os.getenv("JEMAI_RAG_DEDUP", "skip").lower() # off | skip (don't store near-duplicates) | collapse (newest replaces the stored one)
+RAG_DEDUP_THRESHOLD = float(os.getenv("JEMAI_RAG_DEDUP_THRESHOLD", 0.9)) # estimated Jaccard similarity of word 5-gram sets
+RAG_DEDUP_NAMESPACES = [ns.strip() for ns in os.getenv("JEMAI_RAG_DEDUP_NAMESPACES", "code,web,chat,imports").split(",") if ns.strip()]
+# Retention per namespace: ttl_days, max_docs, max_bytes and evict ("lfu" or "age"); JSON in JEMAI_RAG_RETENTION overrides.
+# "code" has no policy since ingest_codebase's manifest already keeps it in step with the files.
+RAG_RETENTION = {"web": {"ttl_days": 90, "max_docs": 50000}, "chat": {"ttl_days": 365, "max_docs": 20000}}
+RAG_RETENTION.update(_env_json("JEMAI_RAG_RETENTION"))
+RAG_COMPACT_INTERVAL = int(os.getenv("JEMAI_RAG_COMPACT_INTERVAL", 3600)) # seconds between compaction passes, 0 = only on demand
+RAG_REINDEX_CPU_SHARE = float(os.getenv("JEMAI_RAG_REINDEX_CPU_SHARE", 0.5)) # fraction of time a re-index may spend embedding; it sleeps the rest
+RAG_SERVER = os.getenv("JEMAI_RAG_SERVER", "") # "" = in-process | socket path or host:port of `python -m jemai_app.core.rag_server serve`
+RAG_SERVER_TIMEOUT = float(os.getenv("JEMAI_RAG_SERVER_TIMEOUT", 120))
+RAG_SERVER_BATCH = int(os.getenv("JEMAI_RAG_SERVER_BATCH", 64)) # texts per coalesced embedding call in the server
+RAG_SERVER_BATCH_WAIT_MS = float(os.getenv("JEMAI_RAG_SERVER_BATCH_WAIT_MS", 5))
+RAG_WARMUP = os.getenv("JEMAI_RAG_WARMUP", "true").lower() in ['true', '1', 't']
 
 SYSTEM_PROMPT = "" # Dynamically populated by main.py
 
@@ -18,8 +98,15 @@ JEMAI_HUB = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 PLUGINS_DIR = os.path.join(JEMAI_HUB, "plugins")
 VERSIONS_DIR = os.path.join(JEMAI_HUB, "versions")
 CHROMA_PATH = os.path.join(JEMAI_HUB, "chroma_db")
+CHROMA_COLLECTION = "jemai_rag_memory"
+RAG_STORE_PATH = os.path.join(JEMAI_HUB, "rag_store")
+RAG_GENERATIONS_PATH = os.path.join(JEMAI_HUB, "rag_generations.json")
+# Where `rag_server serve` listens by default; Windows builds of Python have no Unix domain sockets.
+RAG_SERVER_ADDRESS = RAG_SERVER or ("127.0.0.1:8182" if IS_WINDOWS else os.path.join(JEMAI_HUB, "rag.sock"))
+LLM_CACHE_PATH = os.path.join(JEMAI_HUB, "llm_cache.sqlite3")
+LLM_SEMANTIC_AUDIT_PATH = os.path.join(JEMAI_HUB, "llm_semantic_audit.jsonl")
 TEMPLATES_DIR = os.path.join(JEMAI_HUB, "templates")
 MISSION_BRIEF_PATH = os.path.join(JEMAI_HUB, "mission_brief.md")
 
-for d in [PLUGINS_DIR, VERSIONS_DIR, CHROMA_PATH, TEMPLATES_DIR]:
+for d in [PLUGINS_DIR, VERSIONS_DIR, CHROMA_PATH, RAG_STORE_PATH, TEMPLATES_DIR]:
     os.makedirs(d, exist_ok=True)
@@ -1,34 +1,139 @@
+import time
 import logging
-import openai
-from ..config import OPENAI_API_KEY, SYSTEM_PROMPT
-
-# Check for OpenAI library during import
-try:
-    import openai
-    HAS_OPENAI = True
-    if OPENAI_API_KEY and OPENAI_API_KEY != "sk-...":
-        openai.api_key = OPENAI_API_KEY
-    else:
-        logging.warning("OpenAI API key not found in .env file.")
-        HAS_OPENAI = False
-except ImportError:
-    HAS_OPENAI = False
-
-def call_llm(messages, model="gpt-4o"):
-    if not HAS_OPENAI:
-        return "OpenAI library not installed or API key not configured."
-
-    client = openai.OpenAI(api_key=OPENAI_API_KEY)
+import threading
+from collections import deque
+from ..config import (LLM_CACHE, LLM_CACHE_PATH, LLM_CACHE_TTL, LLM_CACHE_MAX_MB, LLM_SEMANTIC_CACHE, LLM_SEMANTIC_THRESHOLD,
+                      LLM_SEMANTIC_MAX_ENTRIES, LLM_SEMANTIC_AUDIT_PATH)
+from .llm_cache import ResponseCache, SemanticCache, cache_key
+from .llm_providers import ROUTER
+
+
+class LatencyStats:
+    """Rolling time-to-first-token and total latency samples per call mode; a blocking call's first token is its whole reply."""
+
+    def __init__(self, maxlen=500):
+        self.maxlen = maxlen
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def record(self, mode, ttft_ms, total_ms):
+        with self.lock:
+            self.samples.setdefault(mode, deque(maxlen=self.maxlen)).append((ttft_ms, total_ms))
+
+    @staticmethod
+    def _summary(values):
+        values = sorted(values)
+        pick = lambda q: round(values[min(int(q * len(values)), len(values) - 1)], 1)
+        return {"p50": pick(0.5), "p95": pick(0.95), "mean": round(sum(values) / len(values), 1)}
+
+    def stats(self):
+        with self.lock:
+            samples = {mode: list(values) for mode, values in self.samples.items()}
+        return {mode: {"calls": len(values), "ttft_ms": self._summary([v[0] for v in values]),
+                       "total_ms": self._summary([v[1] for v in values])} for mode, values in samples.items() if values}
+
+
+LLM_TIMINGS = LatencyStats()
+# Exact-match responses shared by call_llm and stream_llm; the database is opened on first use.
+RESPONSE_CACHE = ResponseCache(LLM_CACHE_PATH, ttl_s=LLM_CACHE_TTL, max_bytes=int(LLM_CACHE_MAX_MB * 2**20))
+# Behind it, answers to reworded questions; only calls that pass their bare question use it.
+SEMANTIC_CACHE = SemanticCache(LLM_CACHE_PATH, threshold=LLM_SEMANTIC_THRESHOLD, max_entries=LLM_SEMANTIC_MAX_ENTRIES, ttl_s=LLM_CACHE_TTL,
+                               audit_path=LLM_SEMANTIC_AUDIT_PATH)
+# Completion parameters sent with every call; part of the cache key.
+COMPLETION_PARAMS = {"max_tokens": 2048}
+
+def _semantic_probe(model, messages, question):
+    """
+    (context hash, embedder, question embedding, question) for the semantic
+    cache, or None when it doesn't apply, including while the RAG is still
+    loading. The context hash covers the system prompt and earlier turns,
+    which must match exactly.
+    """
+    if not (LLM_SEMANTIC_CACHE and question and messages): return None
+    try:
+        from .rag import rag_query_embedding
+        embedded = rag_query_embedding(question)
+    except Exception as e:
+        logging.warning(f"LLM CACHE: Could not embed the question: {e}")
+        return None
+    if not embedded: return None
+    return cache_key(model, messages[:-1], COMPLETION_PARAMS), embedded["embedder"], embedded["vector"], question
+
+def _cache_lookup(model, messages, cache, question=None):
+    """
+    (key, semantic probe, cached response) for a call: the exact cache
+    first, then the semantic one. Key and probe are None when caching is
+    off for the call; cache failures only cost the lookup.
+    """
+    if not (cache and LLM_CACHE): return None, None, None
+    key, probe = cache_key(model, messages, COMPLETION_PARAMS), None
+    try:
+        cached = RESPONSE_CACHE.get(key)
+        if cached is not None:
+            logging.info(f"LLM: Cache hit for {model} with {len(messages)} messages.")
+        else:
+            probe = _semantic_probe(model, messages, question)
+            if probe: cached = SEMANTIC_CACHE.get(model, *probe)
+    except Exception as e:
+        logging.warning(f"LLM CACHE: Lookup failed, calling uncached: {e}")
+        return None, None, None
+    return key, probe, cached
+
+def _cache_store(key, probe, model, response_text, cost_ms):
+    if key is None or not response_text: return
+    try:
+        RESPONSE_CACHE.put(key, model, response_text, cost_ms=cost_ms)
+        if probe: SEMANTIC_CACHE.put(model, *probe, response_text, cost_ms=cost_ms)
+    except Exception as e:
+        logging.warning(f"LLM CACHE: Store failed: {e}")
+
+def call_llm(messages, model="gpt-4o", cache=True, question=None):
+    """
+    Returns the completion text, or an error message. The provider is
+    picked by llm_providers.ROUTER, which falls back to the next route on
+    errors. Pass cache=False for calls whose answer must not be reused, and
+    the bare user question (without retrieved context) to let a reworded
+    repeat hit the semantic cache.
+    """
+    key, probe, cached = _cache_lookup(model, messages, cache, question)
+    if cached is not None: return cached
     try:
         logging.info(f"LLM: Calling {model} with {len(messages)} messages.")
-        completion = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            max_tokens=2048
-        )
-        response_text = completion.choices[0].message.content
-        logging.info("LLM: Received response.")
+        started = time.perf_counter()
+        response_text, route = ROUTER.complete(messages, model, COMPLETION_PARAMS)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        LLM_TIMINGS.record("blocking", elapsed_ms, elapsed_ms)
+        logging.info(f"LLM: Received response from {route}.")
+        _cache_store(key, probe, model, response_text, elapsed_ms)
         return response_text
     except Exception as e:
         logging.error(f"LLM: API call failed: {e}")
-        return f"Error connecting to OpenAI: {e}"
+        return f"Error connecting to the LLM: {e}"
+
+def stream_llm(messages, model="gpt-4o", cache=True, question=None):
+    """
+    Streaming variant of call_llm: yields the reply as text deltas as they
+    arrive. Failures are yielded as the same error text call_llm returns.
+    Time to first token and total time land in LLM_TIMINGS. A cached
+    response comes back as a single delta.
+    """
+    key, probe, cached = _cache_lookup(model, messages, cache, question)
+    if cached is not None:
+        yield cached
+        return
+    started, first, parts = time.perf_counter(), None, []
+    try:
+        logging.info(f"LLM: Streaming {model} with {len(messages)} messages.")
+        for delta in ROUTER.stream(messages, model, COMPLETION_PARAMS):
+            if first is None: first = time.perf_counter()
+            parts.append(delta)
+            yield delta
+    except Exception as e:
+        logging.error(f"LLM: API call failed: {e}")
+        yield f"Error connecting to the LLM: {e}"
+        return
+    finished = time.perf_counter()
+    ttft_ms = ((first or finished) - started) * 1000
+    LLM_TIMINGS.record("streaming", ttft_ms, (finished - started) * 1000)
+    logging.info(f"LLM: Streamed response, first token after {ttft_ms:.0f} ms.")
+    _cache_store(key, probe, model, "".join(parts), (finished - started) * 1000)
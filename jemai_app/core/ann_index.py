@@ -0,0 +1,133 @@
+import os
+import time
+import logging
+import numpy as np
+
+
+def _top_k(scores, k):
+    k = min(k, scores.shape[0])
+    if k <= 0: return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class IVFIndex:
+    """
+    Inverted-file ANN index over a row-addressed matrix of normalized vectors.
+
+    Rows are clustered with spherical k-means into `nlist` centroids; a query
+    scores only the rows of its `nprobe` closest clusters. The index stores
+    just the centroids and one cluster assignment per row, so it follows the
+    owning store's row layout: `add` assigns new rows, `move` mirrors a row
+    relocation and `truncate` drops trailing rows. More probes mean higher
+    recall and higher latency; `evaluate` measures the trade-off.
+    """
+
+    def __init__(self, nlist=0, nprobe=8):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self.assign = np.empty(0, dtype=np.int32)
+        self.trained_rows = 0
+        self.version = None
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def train(self, matrix, iters=10, sample=20000, seed=0):
+        """Runs k-means on (a sample of) `matrix` and assigns every row to a cluster."""
+        started = time.perf_counter()
+        rng = np.random.default_rng(seed)
+        n = matrix.shape[0]
+        nlist = self.nlist or max(1, int(np.sqrt(n)))
+        data = np.asarray(matrix[rng.choice(n, size=min(sample, n), replace=False)] if n > sample else matrix[:n], dtype=np.float32)
+        nlist = min(nlist, data.shape[0])
+        centroids = data[rng.choice(data.shape[0], size=nlist, replace=False)].copy()
+        for _ in range(iters):
+            labels = np.argmax(data @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, data)
+            counts = np.bincount(labels, minlength=nlist)
+            empty = counts == 0
+            # Re-seed empty clusters with random points so no centroid goes to waste.
+            sums[empty] = data[rng.choice(data.shape[0], size=int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = sums / norms
+        self.centroids = centroids.astype(np.float32)
+        self.assign = np.empty(0, dtype=np.int32)
+        self.add(matrix[:n])
+        self.trained_rows = n
+        logging.info(f"RAG: IVF index trained ({nlist} lists, {n} rows) in {(time.perf_counter() - started) * 1000:.0f} ms.")
+
+    def _nearest(self, vectors, batch=8192):
+        labels = np.empty(vectors.shape[0], dtype=np.int32)
+        for start in range(0, vectors.shape[0], batch):
+            labels[start:start + batch] = np.argmax(np.asarray(vectors[start:start + batch]) @ self.centroids.T, axis=1)
+        return labels
+
+    def add(self, vectors):
+        """Assigns rows appended to the store, in order, to their nearest cluster."""
+        if not self.trained or not len(vectors): return
+        self.assign = np.concatenate([self.assign, self._nearest(vectors)])
+
+    def move(self, src, dst):
+        self.assign[dst] = self.assign[src]
+
+    def truncate(self, count):
+        self.assign = self.assign[:count]
+
+    def candidates(self, query, nprobe=None):
+        nprobe = min(nprobe or self.nprobe, self.centroids.shape[0])
+        lists = _top_k(self.centroids @ query, nprobe)
+        return np.flatnonzero(np.isin(self.assign, lists))
+
+    def search(self, matrix, query, k, nprobe=None):
+        """Returns (rows, scores) of the approximate top `k` rows of `matrix` for one normalized query."""
+        rows = self.candidates(query, nprobe)
+        if not rows.size: return rows, np.empty(0, dtype=np.float32)
+        scores = matrix[rows] @ query
+        top = _top_k(scores, k)
+        return rows[top], scores[top]
+
+    def evaluate(self, matrix, queries, k=10, nprobes=(1, 2, 4, 8, 16, 32)):
+        """Recall@k against exact search and mean latency for each nprobe setting."""
+        matrix = np.asarray(matrix)
+        exact, exact_ms = [], 0.0
+        for q in queries:
+            t0 = time.perf_counter()
+            exact.append(set(_top_k(matrix @ q, k).tolist()))
+            exact_ms += (time.perf_counter() - t0) * 1000
+        report = {"k": k, "queries": len(queries), "rows": int(matrix.shape[0]), "exact_ms": round(exact_ms / max(len(queries), 1), 3), "settings": []}
+        for nprobe in nprobes:
+            if nprobe > self.centroids.shape[0]: break
+            hits, elapsed = 0, 0.0
+            for q, truth in zip(queries, exact):
+                t0 = time.perf_counter()
+                rows, _ = self.search(matrix, q, k, nprobe)
+                elapsed += (time.perf_counter() - t0) * 1000
+                hits += len(truth & set(rows.tolist()))
+            report["settings"].append({
+                "nprobe": nprobe,
+                "recall": round(hits / max(sum(len(t) for t in exact), 1), 4),
+                "ms": round(elapsed / max(len(queries), 1), 3),
+            })
+        return report
+
+    def save(self, path, version=None):
+        """Writes the index; `version` (the owner's, if given) comes back from load() as the `version` attribute."""
+        tmp_path = path + ".tmp.npz"
+        extra = {} if version is None else {"version": np.int64(version)}
+        np.savez(tmp_path, centroids=self.centroids, assign=self.assign,
+                 params=np.array([self.nlist, self.nprobe, self.trained_rows], dtype=np.int64), **extra)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        nlist, nprobe, trained_rows = (int(v) for v in data["params"])
+        index = cls(nlist, nprobe)
+        index.centroids, index.assign, index.trained_rows = data["centroids"], data["assign"], trained_rows
+        index.version = int(data["version"]) if "version" in data.files else None
+        return index
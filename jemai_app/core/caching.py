@@ -0,0 +1,53 @@
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Thread-safe bounded LRU cache with hit/miss accounting. Each entry can
+    record what it cost to compute (`cost_ms`); every hit adds that cost to
+    `saved_ms`, so the stats show how much work the cache avoided.
+    """
+
+    def __init__(self, maxsize=256, name="cache"):
+        self.maxsize = maxsize
+        self.name = name
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+        self.hits = self.misses = 0
+        self.saved_ms = 0.0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            self.saved_ms += entry[1]
+            return entry[0]
+
+    def put(self, key, value, cost_ms=0.0):
+        if self.maxsize <= 0: return
+        with self.lock:
+            self.data[key] = (value, cost_ms)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name, "size": len(self.data), "maxsize": self.maxsize,
+                "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "saved_ms": round(self.saved_ms, 1),
+            }
@@ -0,0 +1,144 @@
+import os
+import re
+import ast
+from ..config import RAG_CHUNK_TOKENS, RAG_CHUNK_OVERLAP
+
+TOKEN_RE = re.compile(r"\S+")
+MD_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*)")
+HTML_HEADING_RE = re.compile(r"<h([1-6])[^>]*>(.*?)</h\1>", re.IGNORECASE | re.DOTALL)
+HTML_TAG_RE = re.compile(r"<[^>]+>")
+
+
+def count_tokens(text):
+    """Cheap whitespace token estimate; close enough to bound embedding model input."""
+    return len(TOKEN_RE.findall(text))
+
+def _chunk(lines, start_line, kind, name=""):
+    return {"text": "\n".join(lines), "start_line": start_line, "end_line": start_line + len(lines) - 1, "kind": kind, "name": name}
+
+def chunk_windows(lines, start_line=1, kind="text", name="", max_tokens=None, overlap=None):
+    """Splits lines into windows of at most `max_tokens`, each overlapping the previous by ~`overlap` tokens."""
+    max_tokens = max_tokens or RAG_CHUNK_TOKENS
+    overlap = RAG_CHUNK_OVERLAP if overlap is None else overlap
+    counts = [count_tokens(line) for line in lines]
+    chunks, i = [], 0
+    while i < len(lines):
+        j, total = i, 0
+        while j < len(lines) and (j == i or total + counts[j] <= max_tokens):
+            total += counts[j]
+            j += 1
+        if counts[i] > max_tokens and j == i + 1:
+            # A single line longer than the budget is split on words.
+            words = lines[i].split()
+            step = max(max_tokens - overlap, 1)
+            for w in range(0, len(words), step):
+                chunks.append(_chunk([" ".join(words[w:w + max_tokens])], start_line + i, kind, name))
+                if w + max_tokens >= len(words): break
+        else:
+            chunks.append(_chunk(lines[i:j], start_line + i, kind, name))
+        if j >= len(lines): break
+        # Step back far enough to carry `overlap` tokens into the next window.
+        back, carried = j, 0
+        while back - 1 > i and carried + counts[back - 1] <= overlap:
+            back -= 1
+            carried += counts[back]
+        i = back
+    return [c for c in chunks if c["text"].strip()]
+
+def _bounded(lines, start_line, kind, name):
+    if count_tokens("\n".join(lines)) <= RAG_CHUNK_TOKENS:
+        return [_chunk(lines, start_line, kind, name)]
+    return chunk_windows(lines, start_line, kind, name)
+
+def chunk_python(source):
+    """Splits Python source on module/class/function boundaries; methods of large classes become their own chunks."""
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return chunk_windows(source.splitlines())
+    lines = source.splitlines()
+    chunks, pending_start = [], 1
+
+    def flush_module(end):
+        if end >= pending_start:
+            segment = lines[pending_start - 1:end]
+            if "\n".join(segment).strip():
+                chunks.extend(_bounded(segment, pending_start, "module", ""))
+
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        start = min([node.lineno] + [d.lineno for d in node.decorator_list])
+        end = node.end_lineno
+        flush_module(start - 1)
+        pending_start = end + 1
+        body = lines[start - 1:end]
+        if isinstance(node, ast.ClassDef) and count_tokens("\n".join(body)) > RAG_CHUNK_TOKENS:
+            methods = [n for n in node.body if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))]
+            cursor = start
+            for method in methods:
+                m_start = min([method.lineno] + [d.lineno for d in method.decorator_list])
+                if m_start > cursor:
+                    chunks.extend(_bounded(lines[cursor - 1:m_start - 1], cursor, "class", node.name))
+                chunks.extend(_bounded(lines[m_start - 1:method.end_lineno], m_start, "function", f"{node.name}.{method.name}"))
+                cursor = method.end_lineno + 1
+            if cursor <= end:
+                chunks.extend(_bounded(lines[cursor - 1:end], cursor, "class", node.name))
+        else:
+            kind = "class" if isinstance(node, ast.ClassDef) else "function"
+            chunks.extend(_bounded(body, start, kind, node.name))
+    flush_module(len(lines))
+    return [c for c in chunks if c["text"].strip()]
+
+def _chunk_sections(lines, heading_at):
+    """Splits lines into sections at every line for which `heading_at` returns a heading title."""
+    chunks, start, title = [], 0, ""
+    for idx, line in enumerate(lines + [None]):
+        heading = heading_at(line) if line is not None else None
+        if line is None or (heading is not None and idx > start):
+            segment = lines[start:idx]
+            if "\n".join(segment).strip():
+                chunks.extend(_bounded(segment, start + 1, "section", title))
+            start = idx
+        if heading is not None:
+            title = heading
+    return chunks
+
+def _md_heading(line):
+    match = MD_HEADING_RE.match(line)
+    return match.group(2).strip() if match else None
+
+def _html_heading(line):
+    match = HTML_HEADING_RE.search(line)
+    return HTML_TAG_RE.sub("", match.group(2)).strip() if match else None
+
+def chunk_markdown(text):
+    return _chunk_sections(text.splitlines(), _md_heading)
+
+def chunk_html_source(text):
+    return _chunk_sections(text.splitlines(), _html_heading)
+
+
+FORMATS = {".py": "python", ".md": "markdown", ".markdown": "markdown", ".html": "html", ".htm": "html"}
+
+def chunk_document(text, path, fmt=None):
+    """
+    Splits a document into retrieval-sized chunks based on its format
+    (guessed from `path` unless given). Each chunk is a dict with 'text' and
+    'metadata' (path, start/end line, kind, name); the text starts with a
+    '[path:Lstart-end]' locator line.
+    """
+    fmt = fmt or FORMATS.get(os.path.splitext(path)[1].lower(), "text")
+    if fmt == "python": chunks = chunk_python(text)
+    elif fmt == "markdown": chunks = chunk_markdown(text)
+    elif fmt == "html": chunks = chunk_html_source(text)
+    else: chunks = chunk_windows(text.splitlines())
+
+    result = []
+    for c in chunks:
+        locator = f"[{path}:L{c['start_line']}-{c['end_line']}]" + (f" {c['name']}" if c["name"] else "")
+        result.append({
+            "text": f"{locator}\n{c['text']}",
+            "metadata": {"path": path, "start_line": c["start_line"], "end_line": c["end_line"], "kind": c["kind"], "name": c["name"]},
+        })
+    return result
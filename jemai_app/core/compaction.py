@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from ..config import RAG_RETENTION, RAG_COMPACT_INTERVAL
+from .rag_server import served, forwarding, CLIENT
+
+DAY = 86400
+
+
+class AccessTracker:
+    """Per-document retrieval counts and last access times, used to pick eviction victims; persisted as JSON."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.path = None
+
+    def record(self, doc_ids):
+        now = int(time.time())
+        with self.lock:
+            for doc_id in doc_ids:
+                entry = self.entries.setdefault(doc_id, [0, 0])
+                entry[0] += 1
+                entry[1] = now
+
+    def get(self, doc_id):
+        """(hits, last_access) for a document; (0, 0) if it was never retrieved."""
+        return tuple(self.entries.get(doc_id, (0, 0)))
+
+    def retain(self, doc_ids):
+        with self.lock:
+            self.entries = {doc_id: entry for doc_id, entry in self.entries.items() if doc_id in doc_ids}
+
+    def load(self, path):
+        self.path = path
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    def save(self):
+        if self.path is None: return
+        with self.lock:
+            snapshot = dict(self.entries)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.path)
+
+
+def _victims(rows, policy, now):
+    """
+    Picks documents to evict from one namespace. `rows` are
+    (doc_id, bytes, ingested_at, hits, last_access). Documents not retrieved
+    nor ingested within `ttl_days` expire first; then, while the namespace
+    is over `max_docs` or `max_bytes`, the least valuable ones go: fewest
+    hits then least recently used ("lfu", the default), or oldest ("age").
+    Returns {doc_id: reason}.
+    """
+    victims = {}
+    ttl_days = policy.get("ttl_days")
+    if ttl_days:
+        cutoff = now - ttl_days * DAY
+        victims.update((row[0], "ttl") for row in rows if max(row[2], row[4]) < cutoff)
+    remaining = [row for row in rows if row[0] not in victims]
+    max_docs, max_bytes = policy.get("max_docs"), policy.get("max_bytes")
+    if not (max_docs or max_bytes): return victims
+    if policy.get("evict", "lfu") == "age":
+        remaining.sort(key=lambda row: row[2])
+    else:
+        remaining.sort(key=lambda row: (row[3], max(row[2], row[4])))
+    docs, size = len(remaining), sum(row[1] for row in remaining)
+    for row in remaining:
+        if (not max_docs or docs <= max_docs) and (not max_bytes or size <= max_bytes): break
+        victims[row[0]] = "quota"
+        docs, size = docs - 1, size - row[1]
+    return victims
+
+def vacuum_sqlite(path):
+    """Runs VACUUM on Chroma's SQLite file; returns (bytes_before, bytes_after). Fails harmlessly if the database is busy."""
+    before = os.path.getsize(path)
+    connection = sqlite3.connect(path, timeout=30)
+    try:
+        connection.execute("VACUUM")
+    finally:
+        connection.close()
+    return before, os.path.getsize(path)
+
+
+class Compactor:
+    """
+    Enforces per-namespace retention policies (JEMAI_RAG_RETENTION): TTL,
+    max documents and max bytes. A pass evicts expired and over-quota
+    documents, then, when anything was removed, vacuums the store and
+    rebuilds the in-memory indexes. Passes run as ingestion jobs, so one
+    started from the API never overlaps with the periodic one.
+    """
+
+    def __init__(self, policies=None, interval=RAG_COMPACT_INTERVAL):
+        self.policies = policies if policies is not None else RAG_RETENTION
+        self.interval = interval
+        self.last_report = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def compact(self, dry_run=False, progress=None, should_cancel=None):
+        if forwarding(): return CLIENT.call("compact", kwargs={"dry_run": dry_run}, timeout=None)
+        from . import rag
+        progress = progress or (lambda processed, total, phase: None)
+        should_cancel = should_cancel or (lambda: False)
+        started = time.perf_counter()
+        report = {"namespaces": {}, "evicted": 0, "vacuum": None, "dry_run": dry_run, "cancelled": False}
+        if not rag.ensure_rag():
+            return dict(report, error="RAG system unavailable.")
+        now = int(time.time())
+        namespaces = list(rag.NAMESPACES)
+        for done, namespace in enumerate(namespaces, start=1):
+            if should_cancel():
+                report["cancelled"] = True
+                break
+            stored = rag.RAG_COLLECTION.get(where={"namespace": namespace}, include=["documents", "metadatas"])
+            metadatas = stored.get("metadatas") or [None] * len(stored["ids"])
+            rows = []
+            for doc_id, document, metadata in zip(stored["ids"], stored["documents"], metadatas):
+                hits, last_access = rag.ACCESS_STATS.get(doc_id)
+                rows.append((doc_id, len((document or "").encode("utf-8")), (metadata or {}).get("ingested_at", 0), hits, last_access))
+            policy = self.policies.get(namespace) or {}
+            victims = _victims(rows, policy, now) if policy else {}
+            evicted_bytes = sum(row[1] for row in rows if row[0] in victims)
+            report["namespaces"][namespace] = {
+                "policy": policy, "documents": len(rows), "bytes": sum(row[1] for row in rows),
+                "accessed": sum(1 for row in rows if row[3]),
+                "evicted_ttl": sum(1 for reason in victims.values() if reason == "ttl"),
+                "evicted_quota": sum(1 for reason in victims.values() if reason == "quota"),
+                "evicted_bytes": evicted_bytes,
+            }
+            if victims and not dry_run:
+                # Evicting an original evicts its skipped near-duplicates too, or the namespace would never shrink.
+                report["evicted"] += rag.rag_delete(ids=list(victims), restore=False)
+            progress(done, len(namespaces), "evicting")
+
+        if report["evicted"] and not report["cancelled"]:
+            progress(len(namespaces), len(namespaces), "vacuuming")
+            report["vacuum"] = rag.rag_vacuum()
+        if not dry_run: rag.ACCESS_STATS.save()
+        report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        report["finished_at"] = int(time.time())
+        if not dry_run: self.last_report = report
+        logging.info(f"RAG COMPACTOR: Evicted {report['evicted']} documents in {report['elapsed_ms']} ms{' (dry run)' if dry_run else ''}.")
+        return report
+
+    def submit(self, dry_run=False):
+        """Starts a compaction pass as an ingestion job; returns (job, created)."""
+        from .ingest_jobs import INGEST_JOBS
+        return INGEST_JOBS.submit(
+            "compaction", lambda job: self.compact(dry_run, progress=job.progress, should_cancel=job.cancel_requested),
+            description="RAG compaction" + (" (dry run)" if dry_run else ""))
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.submit()
+            except Exception as e:
+                logging.error(f"RAG COMPACTOR: Could not start a compaction pass: {e}")
+
+    def start(self):
+        """Runs a compaction pass every `interval` seconds in a daemon thread."""
+        if self.interval <= 0 or (self.thread and self.thread.is_alive()): return
+        self.thread = threading.Thread(target=self._loop, daemon=True, name="RAGCompactor")
+        self.thread.start()
+        logging.info(f"RAG COMPACTOR: Running every {self.interval} s with policies {self.policies}.")
+
+
+COMPACTOR = Compactor()
+
+def start_compactor():
+    if forwarding():
+        logging.info("RAG COMPACTOR: Left to the RAG server process.")
+        return
+    COMPACTOR.start()
+
+@served()
+def rag_stats():
+    """Sizes per namespace, cache and near-duplicate hit rates, retrieval coverage and the last compaction report."""
+    from . import rag
+    status = rag.rag_status()
+    stats = {"status": status, "caches": rag.rag_cache_stats(), "dedup": rag.rag_dedup_stats(), "policies": COMPACTOR.policies,
+             "compaction_interval_s": COMPACTOR.interval, "last_compaction": COMPACTOR.last_report}
+    if status["state"] == "ready":
+        path = rag.rag_data_path()
+        stats["disk_bytes"] = sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+        stats["namespaces"] = {namespace: {"documents": count} for namespace, count in status.get("namespaces", {}).items()}
+        with rag.ACCESS_STATS.lock:
+            entries = list(rag.ACCESS_STATS.entries.items())
+        for namespace, counts in stats["namespaces"].items():
+            ids = rag.METADATA_INDEX.match({"namespace": namespace})
+            accessed = [entry for doc_id, entry in entries if doc_id in ids]
+            counts["retrievals"] = sum(entry[0] for entry in accessed)
+            counts["accessed_fraction"] = round(len(accessed) / counts["documents"], 4) if counts["documents"] else None
+    return stats
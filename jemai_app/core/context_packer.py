@@ -0,0 +1,90 @@
+import numpy as np
+from .chunking import count_tokens
+from .keyword_index import tokenize_code
+
+LOCATOR_PREFIX = "["
+
+
+def mmr_order(query_vector, vectors, lambda_=0.7, limit=None):
+    """
+    Maximal marginal relevance: repeatedly picks the candidate that best
+    balances similarity to the query against similarity to what is already
+    picked. Returns candidate indexes in selection order.
+    """
+    if not len(vectors): return []
+    vectors = np.asarray(vectors, dtype=np.float32)
+    relevance = vectors @ query_vector
+    pairwise = vectors @ vectors.T
+    limit = min(limit or len(vectors), len(vectors))
+    selected, redundancy = [], np.full(len(vectors), -np.inf, dtype=np.float32)
+    remaining = np.ones(len(vectors), dtype=bool)
+    while len(selected) < limit:
+        penalty = np.where(np.isfinite(redundancy), redundancy, 0.0)
+        scores = np.where(remaining, lambda_ * relevance - (1 - lambda_) * penalty, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        remaining[best] = False
+        redundancy = np.maximum(redundancy, pairwise[best])
+    return selected
+
+def best_window(lines, terms, max_tokens):
+    """The contiguous run of lines within `max_tokens` that mentions the query terms most; returns (start, end) indexes."""
+    counts = [count_tokens(line) for line in lines]
+    weights = [sum(1 for t in set(tokenize_code(line)) if t in terms) for line in lines]
+    best, best_score, start, tokens, score = (0, 0), -1, 0, 0, 0
+    for end in range(len(lines)):
+        tokens += counts[end]
+        score += weights[end]
+        while tokens > max_tokens and start <= end:
+            tokens -= counts[start]
+            score -= weights[start]
+            start += 1
+        if start <= end and score > best_score:
+            best, best_score = (start, end + 1), score
+    return best
+
+def _trim(document, metadata, terms, max_tokens):
+    """Cuts a chunk down to its most relevant window, keeping and updating the '[path:Lx-y]' locator line."""
+    lines = document.split("\n")
+    locator = lines[0] if lines and lines[0].startswith(LOCATOR_PREFIX) else None
+    body = lines[1:] if locator is not None else lines
+    budget = max_tokens - (count_tokens(locator) if locator else 0)
+    if count_tokens("\n".join(body)) <= budget:
+        return document, metadata.get("start_line"), metadata.get("end_line")
+    start, end = best_window(body, terms, max(budget, 1))
+    first_line = metadata.get("start_line")
+    if first_line is None:
+        return "\n".join(([locator] if locator else []) + body[start:end]), None, None
+    new_start, new_end = first_line + start, first_line + end - 1
+    if locator:
+        locator = f"[{metadata.get('path')}:L{new_start}-{new_end}]" + (f" {metadata['name']}" if metadata.get("name") else "")
+    return "\n".join(([locator] if locator else []) + body[start:end]), new_start, new_end
+
+def pack_context(query, hits, query_vector, hit_vectors, token_budget, lambda_=0.7, max_chunk_tokens=None, min_score=None):
+    """
+    Builds a prompt context from retrieval hits within `token_budget`.
+    Hits whose cosine similarity to the query is below `min_score` are
+    dropped, so a poor retrieval yields less context rather than filler.
+    The rest are taken in MMR order, each trimmed to its most query-relevant
+    window, until the budget is spent. Returns (context, citations).
+    """
+    terms = {t for t in tokenize_code(query) if len(t) > 2}
+    max_chunk_tokens = max_chunk_tokens or max(token_budget // 2, 1)
+    hit_vectors = np.asarray(hit_vectors, dtype=np.float32)
+    relevance = hit_vectors @ query_vector if len(hit_vectors) else np.empty(0, dtype=np.float32)
+    kept = [i for i in range(len(hits)) if min_score is None or relevance[i] >= min_score]
+    parts, citations, used = [], [], 0
+    for index in (kept[i] for i in mmr_order(query_vector, hit_vectors[kept], lambda_)):
+        remaining = token_budget - used
+        if remaining < 20: break
+        hit = hits[index]
+        if not hit["document"]: continue
+        metadata = hit.get("metadata") or {}
+        text, start_line, end_line = _trim(hit["document"], metadata, terms, min(max_chunk_tokens, remaining))
+        tokens = count_tokens(text)
+        if tokens > remaining: continue
+        parts.append(text)
+        used += tokens
+        citations.append({"id": hit["id"], "path": metadata.get("path"), "start_line": start_line, "end_line": end_line,
+                          "score": round(float(relevance[index]), 4)})
+    return "\n---\n".join(parts), citations
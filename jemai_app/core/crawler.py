@@ -0,0 +1,262 @@
+"""
+Concurrent web crawler feeding the RAG "web" namespace.
+
+Pages are fetched over one pooled aiohttp session with a global and a
+per-host connection limit, bodies are capped at RAG_CRAWL_MAX_BYTES, and
+re-crawls send If-None-Match / If-Modified-Since from a small cache kept
+next to the store so unchanged pages cost a 304 and no re-embedding.
+Cache entries of pages whose chunks have since been deleted or evicted
+are dropped before a crawl, so those pages are fetched in full again.
+Extracted text is chunked and streamed into rag_add_texts in batches while
+fetching continues. The ingest/delete/stored callables and cache path are
+injectable, so a crawl can be pointed at a local fixture server:
+
+    python -m jemai_app.core.crawler http://127.0.0.1:8000/ --depth 2 --dry-run
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import argparse
+from urllib.parse import urljoin, urldefrag, urlparse
+from ..config import (RAG_BATCH_SIZE, RAG_CRAWL_CONCURRENCY, RAG_CRAWL_PER_HOST, RAG_CRAWL_MAX_BYTES,
+                      RAG_CRAWL_TIMEOUT, RAG_CRAWL_MAX_PAGES)
+from .chunking import chunk_document
+from .html_extract import extract_html
+
+try:
+    import aiohttp
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+HTML_TYPES = {"text/html", "application/xhtml+xml"}
+TEXT_TYPES = HTML_TYPES | {"text/plain", "text/markdown"}
+CACHE_FILENAME = "crawl_cache.json"
+
+
+def normalize_url(url, base=None):
+    """Absolute http(s) URL without its fragment, or None for mailto:, javascript: and the like."""
+    url = urldefrag(urljoin(base, url.strip()) if base else url.strip())[0]
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.netloc: return None
+    return url if parsed.path else url + "/"
+
+def page_documents(url, text):
+    """Chunks one page's text into RAG documents whose IDs and `path` metadata carry the URL."""
+    return [{"text": chunk["text"], "id": f"url_{url}#{chunk['metadata']['start_line']}-{chunk['metadata']['end_line']}",
+             "metadata": dict(chunk["metadata"], source=url)}
+            for chunk in chunk_document(text, url, fmt="markdown")]
+
+
+class Crawler:
+    """
+    Breadth-first crawler over seed URLs. `crawl` runs its own event loop,
+    so it is called from a worker thread (an ingestion job or a request
+    handler) and returns a report dict once every page is fetched and
+    ingested.
+    """
+
+    def __init__(self, concurrency=RAG_CRAWL_CONCURRENCY, per_host=RAG_CRAWL_PER_HOST, max_bytes=RAG_CRAWL_MAX_BYTES,
+                 timeout=RAG_CRAWL_TIMEOUT, max_pages=RAG_CRAWL_MAX_PAGES, batch_size=RAG_BATCH_SIZE,
+                 extractor=None, ingest=None, delete=None, stored=None, cache_path=None):
+        if not HAS_AIOHTTP:
+            raise RuntimeError("aiohttp is not installed; web crawling is unavailable.")
+        self.concurrency, self.per_host = concurrency, per_host
+        self.max_bytes, self.timeout, self.max_pages, self.batch_size = max_bytes, timeout, max_pages, batch_size
+        self.extractor = extractor
+        if ingest is None or delete is None or stored is None or cache_path is None:
+            from .rag import rag_add_texts, rag_delete, rag_stored_paths, rag_data_path
+            ingest = ingest or rag_add_texts
+            delete = delete or rag_delete
+            stored = stored or rag_stored_paths
+            cache_path = cache_path or os.path.join(rag_data_path(), CACHE_FILENAME)
+        self.ingest, self.delete, self.stored, self.cache_path = ingest, delete, stored, cache_path
+
+    def _load_cache(self):
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                cache = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        # Validators only stand for stored chunks; a page whose chunks are gone must be fetched and ingested again.
+        indexed = [url for url, entry in cache.items() if entry.get("chunks")]
+        present = self.stored(indexed) if indexed else []
+        if present is None: return {}
+        missing = set(indexed) - set(present)
+        if missing: logging.info(f"CRAWLER: {len(missing)} cached pages are no longer stored and will be fetched again.")
+        return {url: entry for url, entry in cache.items() if url not in missing}
+
+    def _save_cache(self, cache):
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def crawl(self, urls, depth=0, same_host=True, progress=None, should_cancel=None, dry_run=False):
+        """
+        Fetches `urls` and, up to `depth` links away, the pages they link to
+        (on the seeds' hosts only when `same_host`), never more than
+        `max_pages`. `progress(fetched, scheduled, phase)` and
+        `should_cancel()` follow the ingestion job protocol. With `dry_run`
+        pages are fetched and chunked but nothing is stored.
+        """
+        seeds = list(dict.fromkeys(u for u in (normalize_url(url) for url in urls) if u))
+        report = {"pages": 0, "not_modified": 0, "unchanged": 0, "chunks_added": 0, "bytes": 0, "failed": [],
+                  "skipped": [], "cancelled": False, "dry_run": dry_run}
+        if not seeds: return dict(report, elapsed_ms=0.0)
+        started = time.perf_counter()
+        cache = self._load_cache()
+        asyncio.run(self._crawl(seeds, depth, same_host, cache, report, progress or (lambda *a: None),
+                                should_cancel or (lambda: False), dry_run))
+        if not dry_run: self._save_cache(cache)
+        report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        logging.info(f"CRAWLER: {report['pages']} pages ingested ({report['chunks_added']} chunks), "
+                     f"{report['not_modified'] + report['unchanged']} unchanged, {len(report['failed'])} failed "
+                     f"in {report['elapsed_ms']} ms{' (cancelled)' if report['cancelled'] else ''}.")
+        return report
+
+    async def _crawl(self, seeds, depth, same_host, cache, report, progress, should_cancel, dry_run):
+        hosts = {urlparse(url).netloc for url in seeds}
+        seen = set(seeds)
+        pages = asyncio.Queue()
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers={"User-Agent": USER_AGENT}) as session:
+            ingester = asyncio.create_task(self._ingest_pages(pages, cache, report, dry_run))
+            pending = {asyncio.create_task(self._fetch(session, url, 0, cache)) for url in seeds}
+            fetched = 0
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    page = task.result()
+                    fetched += 1
+                    self._record(page, cache, report)
+                    if page.get("docs") is not None: await pages.put(page)
+                    if page["depth"] >= depth: continue
+                    for link in page.get("links", []):
+                        if link in seen or len(seen) >= self.max_pages: continue
+                        if same_host and urlparse(link).netloc not in hosts: continue
+                        seen.add(link)
+                        pending.add(asyncio.create_task(self._fetch(session, link, page["depth"] + 1, cache)))
+                progress(fetched, len(seen), "crawling")
+                if pending and should_cancel():
+                    for task in pending: task.cancel()
+                    await asyncio.gather(*pending, return_exceptions=True)
+                    report["cancelled"] = True
+                    break
+            await pages.put(None)
+            await ingester
+
+    async def _fetch(self, session, url, depth, cache):
+        """Never raises: failures come back as a page dict with an 'error'."""
+        page = {"url": url, "depth": depth}
+        entry = cache.get(url, {})
+        headers = {}
+        if entry.get("etag"): headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"): headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304:
+                    return dict(page, status="not_modified", links=entry.get("links", []))
+                response.raise_for_status()
+                if response.content_type not in TEXT_TYPES:
+                    return dict(page, status="skipped", error=f"unsupported content type {response.content_type}")
+                if response.content_length and response.content_length > self.max_bytes:
+                    return dict(page, status="skipped", error=f"larger than {self.max_bytes} bytes")
+                body = bytearray()
+                async for block in response.content.iter_chunked(65536):
+                    body.extend(block)
+                    if len(body) > self.max_bytes:
+                        return dict(page, status="skipped", error=f"larger than {self.max_bytes} bytes")
+                validators = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+                final_url, content_type, charset = str(response.url), response.content_type, response.charset
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            return dict(page, status="failed", error=str(e) or type(e).__name__)
+
+        page.update(validators, bytes=len(body))
+        raw = bytes(body).decode(charset or "utf-8", errors="replace")
+        digest = hashlib.sha256(body).hexdigest()
+        if entry.get("sha256") == digest:
+            return dict(page, status="unchanged", sha256=digest, links=entry.get("links", []))
+        # Parsing and chunking are CPU-bound; keep them off the event loop so fetches stay in flight.
+        loop = asyncio.get_running_loop()
+        links, docs = await loop.run_in_executor(None, self._parse, url, final_url, raw, content_type)
+        return dict(page, status="fetched", sha256=digest, links=links, docs=docs)
+
+    def _parse(self, url, final_url, raw, content_type):
+        if content_type not in HTML_TYPES:
+            return [], page_documents(url, raw)
+        text, hrefs = extract_html(raw, self.extractor)
+        links = list(dict.fromkeys(link for link in (normalize_url(href, final_url) for href in hrefs) if link))
+        return links, page_documents(url, text)
+
+    def _record(self, page, cache, report):
+        status = page["status"]
+        report["bytes"] += page.get("bytes", 0)
+        if status in ("not_modified", "unchanged"):
+            report[status] += 1
+            entry = cache.get(page["url"])
+            if entry is not None:
+                entry["checked_at"] = int(time.time())
+                if page.get("etag"): entry["etag"] = page["etag"]
+                if page.get("last_modified"): entry["last_modified"] = page["last_modified"]
+        elif status in ("failed", "skipped"):
+            report[status].append({"url": page["url"], "error": page["error"]})
+
+    async def _ingest_pages(self, pages, cache, report, dry_run):
+        """Consumes fetched pages and embeds their chunks in batches while the crawl continues."""
+        loop = asyncio.get_running_loop()
+        batch = []
+        while True:
+            page = await pages.get()
+            if page is not None: batch.append(page)
+            if batch and (page is None or sum(len(p["docs"]) for p in batch) >= self.batch_size):
+                await loop.run_in_executor(None, self._ingest_batch, batch, cache, report, dry_run)
+                batch = []
+            if page is None: return
+
+    def _ingest_batch(self, batch, cache, report, dry_run):
+        docs = [doc for page in batch for doc in page["docs"]]
+        failed_urls = set()
+        if dry_run:
+            report["chunks_added"] += len(docs)
+        else:
+            for page in batch:
+                self.delete(where={"path": page["url"]})
+            stats = self.ingest(docs, namespace="web", source="crawler")
+            report["chunks_added"] += stats["added"]
+            # A page with any failed chunk is left out of the cache so the next crawl fetches it in full.
+            failed_urls = {doc_id[len("url_"):].rsplit("#", 1)[0] for doc_id in stats["failed_ids"]}
+        for page in batch:
+            if page["url"] in failed_urls:
+                cache.pop(page["url"], None)
+                report["failed"].append({"url": page["url"], "error": "embedding failed"})
+                continue
+            report["pages"] += 1
+            cache[page["url"]] = {"etag": page.get("etag"), "last_modified": page.get("last_modified"), "sha256": page["sha256"],
+                                  "links": page["links"], "chunks": len(page["docs"]), "checked_at": int(time.time())}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crawl URLs into the RAG web namespace.")
+    parser.add_argument("urls", nargs="+")
+    parser.add_argument("--extractor", help="HTML extractor (default: JEMAI_RAG_HTML_EXTRACTOR)")
+    parser.add_argument("--depth", type=int, default=0)
+    parser.add_argument("--max-pages", type=int, default=RAG_CRAWL_MAX_PAGES)
+    parser.add_argument("--any-host", action="store_true", help="follow links to other hosts")
+    parser.add_argument("--dry-run", action="store_true", help="fetch and chunk without storing anything")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    kwargs = {"ingest": lambda docs, **_: {"added": 0, "failed_ids": []}, "delete": lambda **_: 0, "stored": lambda urls: urls,
+              "cache_path": os.devnull} if args.dry_run else {}
+    report = Crawler(max_pages=args.max_pages, extractor=args.extractor, **kwargs).crawl(args.urls, args.depth, not args.any_host, dry_run=args.dry_run)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
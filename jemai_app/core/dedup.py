@@ -0,0 +1,233 @@
+import os
+import re
+import json
+import time
+import zlib
+import logging
+import threading
+import numpy as np
+
+# Modulus of the MinHash permutations; a prime just below 2**32 keeps (a * x + b) exact in uint64.
+PRIME = np.uint64(4294967291)
+TOKEN_RE = re.compile(r"\w+")
+# Shorter documents (greetings, one-line notes) are too small for shingle overlap to mean anything.
+MIN_TOKENS = 20
+
+
+class DedupIndex:
+    """
+    MinHash signatures of stored documents with an LSH band table for
+    near-duplicate lookup. A signature is `num_perm` minimums over hashed
+    word `shingle`-grams; two documents become candidates when all rows of
+    any band agree, and are duplicates when the estimated Jaccard similarity
+    of their shingle sets reaches `threshold`. Matching is per namespace.
+    """
+
+    def __init__(self, num_perm=128, bands=16, threshold=0.9, shingle=5, seed=1):
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, int(PRIME), num_perm, dtype=np.int64).astype(np.uint64)
+        self.b = rng.randint(0, int(PRIME), num_perm, dtype=np.int64).astype(np.uint64)
+        self.num_perm, self.bands, self.rows = num_perm, bands, num_perm // bands
+        self.threshold, self.shingle = threshold, shingle
+        self.lock = threading.Lock()
+        self.signatures = {}
+        self.buckets = {}
+        self.counters = {"checked": 0, "duplicates": 0, "collapsed": 0, "embed_ms_saved": 0.0}
+        self.embed_ms_per_doc = None
+        self.path = None
+        self.dirty = False
+        self.saved_at = 0.0
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def signature(self, text):
+        """MinHash signature of `text`, or None when it has fewer than MIN_TOKENS words."""
+        tokens = TOKEN_RE.findall(text.lower())
+        if len(tokens) < MIN_TOKENS: return None
+        shingles = {" ".join(tokens[i:i + self.shingle]) for i in range(len(tokens) - self.shingle + 1)}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        return ((np.outer(hashes, self.a) + self.b) % PRIME).min(axis=0).astype(np.uint32)
+
+    def _keys(self, signature):
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def query(self, signature, namespace):
+        """The stored document most similar to `signature` at or above the threshold, as (doc_id, similarity), or None."""
+        with self.lock:
+            candidates = set()
+            for key in self._keys(signature):
+                candidates.update(self.buckets.get(key, ()))
+            best = None
+            for doc_id in candidates:
+                stored, stored_namespace = self.signatures[doc_id]
+                if stored_namespace != namespace: continue
+                similarity = float(np.count_nonzero(stored == signature)) / self.num_perm
+                if similarity >= self.threshold and (best is None or similarity > best[1]):
+                    best = (doc_id, similarity)
+            return best
+
+    def add(self, doc_id, signature, namespace):
+        with self.lock:
+            if doc_id in self.signatures: self._remove(doc_id)
+            self.signatures[doc_id] = (signature, namespace)
+            for key in self._keys(signature):
+                self.buckets.setdefault(key, set()).add(doc_id)
+            self.dirty = True
+
+    def _remove(self, doc_id):
+        entry = self.signatures.pop(doc_id, None)
+        if entry is None: return
+        for key in self._keys(entry[0]):
+            bucket = self.buckets.get(key)
+            if bucket is None: continue
+            bucket.discard(doc_id)
+            if not bucket: del self.buckets[key]
+        self.dirty = True
+
+    def remove(self, doc_ids):
+        with self.lock:
+            for doc_id in doc_ids:
+                self._remove(doc_id)
+
+    def retain(self, doc_ids):
+        """Drops signatures of documents no longer in the store."""
+        with self.lock:
+            for doc_id in [d for d in self.signatures if d not in doc_ids]:
+                self._remove(doc_id)
+
+    def record(self, duplicates=0, collapsed=0, embedded=0, embed_ms=0.0):
+        """Updates the counters; embedding time saved is estimated from the running per-document embed cost."""
+        with self.lock:
+            if embedded:
+                per_doc = embed_ms / embedded
+                self.embed_ms_per_doc = per_doc if self.embed_ms_per_doc is None else 0.8 * self.embed_ms_per_doc + 0.2 * per_doc
+            saved = duplicates * (self.embed_ms_per_doc or 0.0)
+            self.counters["checked"] += duplicates + embedded
+            self.counters["duplicates"] += duplicates
+            self.counters["collapsed"] += collapsed
+            self.counters["embed_ms_saved"] += saved
+            return round(saved, 1)
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters, embed_ms_saved=round(self.counters["embed_ms_saved"], 1))
+            return dict(counters, signatures=len(self.signatures), threshold=self.threshold, num_perm=self.num_perm, bands=self.bands,
+                        embed_ms_per_doc=None if self.embed_ms_per_doc is None else round(self.embed_ms_per_doc, 2),
+                        duplicate_rate=round(counters["duplicates"] / counters["checked"], 4) if counters["checked"] else None)
+
+    def load(self, path):
+        """Loads signatures saved at `path`; later saves go there too."""
+        self.path = path
+        if not os.path.exists(path): return
+        try:
+            data = np.load(path, allow_pickle=False)
+            if data["signatures"].shape[1:] != (self.num_perm,) or int(data["seed_check"]) != int(self.a[0]):
+                logging.warning("RAG: Near-duplicate index was built with other MinHash parameters; rebuilding it.")
+                return
+            for doc_id, signature, namespace in zip(data["ids"].tolist(), data["signatures"], data["namespaces"].tolist()):
+                self.add(doc_id, signature, namespace)
+            self.dirty = False
+        except Exception as e:
+            logging.warning(f"RAG: Could not load near-duplicate index from {path}: {e}")
+
+    def save(self, force=False, interval=30.0):
+        """Writes the signatures when changed, at most every `interval` seconds unless `force`d."""
+        if self.path is None or not self.dirty or (not force and time.time() - self.saved_at < interval): return
+        with self.lock:
+            ids = list(self.signatures)
+            signatures = np.array([self.signatures[d][0] for d in ids], dtype=np.uint32).reshape(len(ids), self.num_perm)
+            namespaces = [self.signatures[d][1] for d in ids]
+            self.dirty, self.saved_at = False, time.time()
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path, ids=np.array(ids, dtype=str), signatures=signatures, namespaces=np.array(namespaces, dtype=str),
+                 seed_check=np.int64(self.a[0]))
+        os.replace(tmp_path, self.path)
+
+
+class SkippedDuplicates:
+    """
+    Near-duplicates that skip mode did not store, each with the text,
+    metadata and ID of the stored document it duplicates. When that
+    document is deleted (a changed source file, a re-crawled page),
+    release() hands its duplicates back so they can be stored in its place;
+    drop() forgets duplicates whose own source went away. Kept as a JSON
+    file next to the signatures.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.by_original = {}
+        self.path = None
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _unlink(self, doc_id):
+        entry = self.entries.pop(doc_id, None)
+        if entry is None: return None
+        siblings = self.by_original.get(entry["duplicate_of"])
+        if siblings is not None:
+            siblings.discard(doc_id)
+            if not siblings: del self.by_original[entry["duplicate_of"]]
+        self.dirty = True
+        return entry
+
+    def add(self, doc_id, duplicate_of, text, metadata):
+        with self.lock:
+            self._unlink(doc_id)
+            self.entries[doc_id] = {"duplicate_of": duplicate_of, "text": text, "metadata": metadata}
+            self.by_original.setdefault(duplicate_of, set()).add(doc_id)
+            self.dirty = True
+
+    def drop(self, doc_ids):
+        """Forgets skipped documents by their own IDs."""
+        with self.lock:
+            for doc_id in doc_ids:
+                self._unlink(doc_id)
+
+    def match(self, where):
+        """IDs of skipped documents whose metadata matches a `where` filter (see MetadataIndex)."""
+        from .metadata_index import MetadataIndex
+        index = MetadataIndex()
+        with self.lock:
+            for doc_id, entry in self.entries.items():
+                index.add(doc_id, entry["metadata"])
+        return index.match(where)
+
+    def release(self, original_ids):
+        """Removes and returns, as {"id", "text", "metadata"} dicts, the skipped duplicates of `original_ids`."""
+        with self.lock:
+            released = []
+            for original_id in original_ids:
+                for doc_id in sorted(self.by_original.get(original_id, ())):
+                    entry = self._unlink(doc_id)
+                    released.append({"id": doc_id, "text": entry["text"], "metadata": entry["metadata"]})
+            return released
+
+    def load(self, path):
+        """Loads skipped documents saved at `path`; later saves go there too."""
+        self.path = path
+        if not os.path.exists(path): return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            with self.lock:
+                self.entries, self.by_original = {}, {}
+            for doc_id, entry in entries.items():
+                self.add(doc_id, entry["duplicate_of"], entry["text"], entry["metadata"])
+            self.dirty = False
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"RAG: Could not load skipped near-duplicates from {path}: {e}")
+
+    def save(self):
+        if self.path is None or not self.dirty: return
+        with self.lock:
+            payload = json.dumps(self.entries, ensure_ascii=False)
+            self.dirty = False
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,161 @@
+import re
+import zlib
+import logging
+import threading
+import numpy as np
+
+DEFAULT_MODEL_NAME = "all-MiniLM-L6-v2"
+WORD_RE = re.compile(r"[A-Za-z0-9]+")
+CAMEL_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+class Embedder:
+    """
+    Interface for text embedders used by the RAG. `embed` takes a list of
+    strings and returns an (n, dim) float32 array of L2-normalized rows.
+    `load` does any expensive setup and is called once, possibly from a
+    background warm-up thread.
+    """
+    name = "base"
+    dim = None
+
+    def load(self):
+        pass
+
+    def embed(self, texts):
+        raise NotImplementedError
+
+    def __call__(self, texts):
+        return self.embed(texts)
+
+
+class SentenceTransformerEmbedder(Embedder):
+    def __init__(self, model_name=DEFAULT_MODEL_NAME):
+        self.name = model_name
+        self.model = None
+
+    def load(self):
+        if self.model is not None: return
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(self.name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        self.load()
+        return np.asarray(self.model.encode(list(texts), normalize_embeddings=True), dtype=np.float32)
+
+
+class HashingEmbedder(Embedder):
+    """
+    Deterministic feature-hashing embedder with no model download. Words,
+    their snake_case/camelCase parts and character trigrams are hashed
+    (crc32, stable across processes) into signed buckets. Retrieval quality
+    is keyword-level, which is enough for offline tests and benchmarks.
+    """
+    name = "hashing"
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def _features(self, text):
+        for word in WORD_RE.findall(text):
+            lower = word.lower()
+            yield lower
+            parts = [p.lower() for piece in word.split("_") for p in CAMEL_RE.findall(piece)]
+            if len(parts) > 1: yield from parts
+            padded = f"#{lower}#"
+            for i in range(len(padded) - 2):
+                yield padded[i:i + 3]
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode("utf-8"))
+                matrix[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        return _normalize(matrix)
+
+
+class BatchingEmbedder(Embedder):
+    """
+    Coalesces concurrent `embed` calls into one call of the wrapped
+    embedder. The first caller waits up to `max_wait_ms` (less once
+    `max_batch` texts are queued), then embeds every queued caller's texts
+    together while later callers queue for the next batch. Calls with
+    `max_batch` texts or more skip the queue.
+    """
+
+    def __init__(self, inner, max_batch=64, max_wait_ms=5.0):
+        self.inner, self.name, self.dim = inner, inner.name, inner.dim
+        self.max_batch, self.max_wait = max_batch, max_wait_ms / 1000
+        self.cond = threading.Condition()
+        self.run_lock = threading.Lock()
+        self.pending, self.pending_texts = [], 0
+        self.counters = {"calls": 0, "batches": 0, "texts": 0, "largest_batch": 0}
+
+    def load(self):
+        self.inner.load()
+        self.dim = self.inner.dim
+
+    def _run(self, texts):
+        with self.run_lock:
+            return self.inner.embed(texts)
+
+    def embed(self, texts):
+        texts = list(texts)
+        if len(texts) >= self.max_batch: return self._run(texts)
+        request = {"texts": texts, "done": threading.Event(), "vectors": None, "error": None}
+        with self.cond:
+            self.pending.append(request)
+            self.pending_texts += len(texts)
+            leader = len(self.pending) == 1
+            if self.pending_texts >= self.max_batch: self.cond.notify_all()
+            if leader: self.cond.wait_for(lambda: self.pending_texts >= self.max_batch, timeout=self.max_wait)
+        if not leader:
+            request["done"].wait()
+        else:
+            with self.run_lock:
+                # Whatever queued while the previous batch was running joins this one.
+                with self.cond:
+                    batch, self.pending, self.pending_texts = self.pending, [], 0
+                try:
+                    vectors = self.inner.embed([text for queued in batch for text in queued["texts"]])
+                    start = 0
+                    for queued in batch:
+                        queued["vectors"] = vectors[start:start + len(queued["texts"])]
+                        start += len(queued["texts"])
+                except Exception as e:
+                    for queued in batch: queued["error"] = e
+                with self.cond:
+                    self.counters["calls"] += len(batch)
+                    self.counters["batches"] += 1
+                    self.counters["texts"] += sum(len(queued["texts"]) for queued in batch)
+                    self.counters["largest_batch"] = max(self.counters["largest_batch"], len(batch))
+                for queued in batch: queued["done"].set()
+        if request["error"] is not None: raise request["error"]
+        return request["vectors"]
+
+    def stats(self):
+        with self.cond:
+            counters = dict(self.counters)
+        counters["calls_per_batch"] = round(counters["calls"] / counters["batches"], 2) if counters["batches"] else None
+        return counters
+
+
+EMBEDDERS = {"hashing": HashingEmbedder}
+
+def register_embedder(name, factory):
+    EMBEDDERS[name] = factory
+
+def get_embedder(name):
+    """Returns a new embedder by registered name; any other name is treated as a sentence-transformers model."""
+    if name in EMBEDDERS:
+        return EMBEDDERS[name]()
+    logging.info(f"RAG: Using sentence-transformers model '{name}'.")
+    return SentenceTransformerEmbedder(name)
@@ -0,0 +1,318 @@
+"""
+HTML-to-text extraction for web ingestion.
+
+Extractors are pluggable (EXTRACTORS / get_extractor). The fast ones feed
+a streaming tokenizer, lxml's C parser when installed or the stdlib
+HTMLParser otherwise, into TextCollector, which never builds a tree: it
+drops scripts, navigation, headers, footers, sidebars and link-heavy
+blocks, prefers <main>/<article> content when a page has it, keeps <pre>
+blocks verbatim as fenced code and turns headings into Markdown markers
+for the chunker. A page that filters down to nothing yields its whole
+text. "bs4" is the original BeautifulSoup path, kept as the baseline for
+the benchmark (synthetic pages unless a directory is given):
+
+    python -m jemai_app.core.html_extract --pages saved_pages/
+"""
+import os
+import re
+import json
+import time
+import random
+import argparse
+import tracemalloc
+from html.parser import HTMLParser
+from ..config import RAG_HTML_EXTRACTOR
+
+try:
+    from lxml import etree
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+try:
+    from bs4 import BeautifulSoup
+    HAS_BS4 = True
+except ImportError:
+    HAS_BS4 = False
+
+SKIP_TAGS = {"script", "style", "noscript", "template", "svg", "canvas", "iframe", "head", "select", "button"}
+BOILERPLATE_TAGS = {"nav", "header", "footer", "aside", "form", "dialog", "menu"}
+MAIN_TAGS = {"main", "article"}
+# Their classes describe the page layout ("home blog has-sidebar"), never a boilerplate block.
+LAYOUT_TAGS = {"html", "body"}
+BLOCK_TAGS = {"p", "div", "section", "article", "main", "li", "ul", "ol", "dl", "dt", "dd", "table", "tr", "td", "th",
+              "blockquote", "pre", "h1", "h2", "h3", "h4", "h5", "h6", "br", "hr", "figure", "figcaption", "body", "details", "summary"}
+VOID_TAGS = {"br", "hr", "img", "input", "meta", "link", "wbr", "source", "col", "area", "base", "embed", "param", "track"}
+BOILERPLATE_RE = re.compile(r"(^|[\s_-])(nav|navbar|navigation|menu|footer|header|sidebar|contentinfo|complementary|breadcrumbs?|cookie|banner|advert|ads|share|social|related|comments?|subscribe|popup|modal)([\s_-]|$)", re.I)
+HEADING_RE = re.compile(r"^h([1-6])$")
+WHITESPACE_RE = re.compile(r"\s+")
+# Blocks whose text is mostly link text (menus, tag clouds, "related" lists) are dropped.
+MAX_LINK_DENSITY = 0.5
+# A <main>/<article> with less text than this is treated as a teaser and the whole page is kept instead.
+MIN_MAIN_CHARS = 200
+
+
+class TextCollector:
+    """
+    Builds text blocks from a stream of start/end/data events; usable as an
+    lxml parser target and driven by the stdlib adapter below. Only open
+    elements that change state are tracked, so memory stays proportional
+    to nesting depth plus the page text. Elements whose class/id/role looks
+    like boilerplate ("marked") only hide text outside main content, so a
+    layout wrapper around <main> doesn't hide the article. Hidden text is
+    kept per block as the whole-page fallback.
+    """
+
+    def __init__(self):
+        self.blocks = []
+        self.links = []
+        self.stack = []
+        self.skip = self.boilerplate = self.marked = self.main = self.pre = self.link = self.code = 0
+        self.seen_main = False
+        self._new_block()
+
+    def _new_block(self, kind="text", level=0):
+        self.current = {"kind": kind, "level": level, "parts": [], "all_parts": [], "link_chars": 0, "main": self.main > 0}
+
+    def _hidden(self):
+        return self.boilerplate or (self.marked and not self.main)
+
+    def _append(self, text):
+        if self.skip: return
+        self.current["all_parts"].append(text)
+        if not self._hidden(): self.current["parts"].append(text)
+
+    def _flush(self, kind="text", level=0):
+        block = self.current
+        join = (lambda parts: "".join(parts).strip("\n")) if block["kind"] == "pre" else (lambda parts: WHITESPACE_RE.sub(" ", "".join(parts)).strip())
+        block["text"], block["full_text"] = join(block.pop("parts")), join(block.pop("all_parts"))
+        if block["full_text"]: self.blocks.append(block)
+        self._new_block(kind, level)
+
+    def start(self, tag, attrib):
+        tag = tag.lower() if isinstance(tag, str) else ""
+        flags = []
+        if tag in SKIP_TAGS:
+            flags.append("skip")
+        elif tag in BOILERPLATE_TAGS and not self.main:
+            flags.append("boilerplate")
+        else:
+            marker = f"{attrib.get('class') or ''} {attrib.get('id') or ''} {attrib.get('role') or ''}"
+            if (marker.strip() and tag not in MAIN_TAGS and tag not in LAYOUT_TAGS and not self.main and not self.pre
+                    and attrib.get("role") != "main" and BOILERPLATE_RE.search(marker)):
+                flags.append("marked")
+        if tag in MAIN_TAGS or attrib.get("role") == "main":
+            flags.append("main")
+        if tag == "pre": flags.append("pre")
+        if tag == "a":
+            flags.append("link")
+            if attrib.get("href"): self.links.append(attrib["href"])
+        if tag == "code" and not self.pre: flags.append("code")
+
+        if tag in BLOCK_TAGS and not self.pre:
+            heading = HEADING_RE.match(tag)
+            self._flush("pre" if tag == "pre" else "heading" if heading else "item" if tag == "li" else "text",
+                        int(heading.group(1)) if heading else 0)
+        for flag in flags:
+            setattr(self, flag, getattr(self, flag) + 1)
+        if "main" in flags: self.seen_main = self.current["main"] = True
+        if tag not in VOID_TAGS:
+            self.stack.append((tag, flags))
+        if "code" in flags: self._append("`")
+
+    def end(self, tag):
+        tag = tag.lower() if isinstance(tag, str) else ""
+        if tag in VOID_TAGS: return
+        if not any(open_tag == tag for open_tag, _ in self.stack): return
+        while self.stack:
+            open_tag, flags = self.stack.pop()
+            if "code" in flags: self._append("`")
+            for flag in flags:
+                setattr(self, flag, max(getattr(self, flag) - 1, 0))
+            if open_tag in BLOCK_TAGS and (open_tag == "pre" or not self.pre):
+                self._flush()
+            if open_tag == tag: break
+
+    def data(self, data):
+        self._append(data)
+        if self.link and not self.skip and not self._hidden(): self.current["link_chars"] += len(data.strip())
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        while self.stack:
+            self.end(self.stack[-1][0])
+        self._flush()
+        return self.text(), self.links
+
+    def text(self):
+        """The filtered text, or the whole page's text when filtering leaves nothing."""
+        blocks = [b for b in self.blocks if b["text"]]
+        if self.seen_main:
+            main = [b for b in blocks if b["main"]]
+            if sum(len(b["text"]) for b in main) >= MIN_MAIN_CHARS: blocks = main
+        return self._render(blocks, "text") or self._render(self.blocks, "full_text")
+
+    @staticmethod
+    def _render(blocks, field):
+        lines = []
+        for block in blocks:
+            text, kind = block[field], block["kind"]
+            if kind == "pre":
+                lines.append(f"```\n{text}\n```")
+            elif kind == "heading":
+                lines.append("#" * block["level"] + " " + text)
+            elif field == "text" and block["link_chars"] > MAX_LINK_DENSITY * len(text):
+                continue
+            elif kind == "item":
+                lines.append("- " + text)
+            else:
+                lines.append(text)
+        return "\n".join(lines)
+
+
+class _StdlibAdapter(HTMLParser):
+    def __init__(self, collector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag, {key: value or "" for key, value in attrs})
+
+    def handle_startendtag(self, tag, attrs):
+        self.collector.start(tag, {key: value or "" for key, value in attrs})
+        if tag not in VOID_TAGS: self.collector.end(tag)
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+
+def extract_stdlib(html):
+    parser = _StdlibAdapter(TextCollector())
+    parser.feed(html)
+    parser.close()
+    return parser.collector.close()
+
+def extract_lxml(html):
+    parser = etree.HTMLParser(target=TextCollector(), remove_comments=True)
+    parser.feed(html)
+    return parser.close()
+
+def extract_bs4(html):
+    """The original BeautifulSoup path: full tree, only scripts and styles removed."""
+    soup = BeautifulSoup(html, 'html.parser')
+    links = [a["href"] for a in soup.find_all("a", href=True)]
+    for script_or_style in soup(["script", "style"]):
+        script_or_style.decompose()
+    # Keep headings as Markdown markers so the chunker can split on sections.
+    for heading in soup.find_all(re.compile(r"^h[1-6]$")):
+        heading.string = "#" * int(heading.name[1]) + " " + heading.get_text(" ", strip=True)
+    return soup.get_text(separator='\n', strip=True), links
+
+
+EXTRACTORS = {"stdlib": extract_stdlib}
+if HAS_LXML: EXTRACTORS["lxml"] = extract_lxml
+if HAS_BS4: EXTRACTORS["bs4"] = extract_bs4
+
+def register_extractor(name, func):
+    """`func(html) -> (text, hrefs)`; hrefs are raw attribute values, resolved by the caller."""
+    EXTRACTORS[name] = func
+
+def get_extractor(name=None):
+    name = name or RAG_HTML_EXTRACTOR
+    if name == "auto": name = "lxml" if HAS_LXML else "stdlib"
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown or unavailable HTML extractor '{name}', expected one of {sorted(EXTRACTORS)}.")
+    return EXTRACTORS[name]
+
+def extract_html(html, extractor=None):
+    """Returns (text, hrefs) for an HTML document."""
+    return get_extractor(extractor)(html)
+
+
+def synthetic_page(rng, paragraphs=40):
+    """A page shaped like typical docs/blog HTML: header, nav, sidebar, article with code, footer."""
+    words = ["vector", "index", "query", "latency", "embedding", "chunk", "store", "cache", "token", "model", "batch", "shard"]
+    sentence = lambda n: " ".join(rng.choice(words) for _ in range(n)).capitalize() + "."
+    nav = "".join(f'<li><a href="/section/{i}">Section {i}</a></li>' for i in range(30))
+    body = []
+    for i in range(paragraphs):
+        if i % 8 == 0: body.append(f"<h2>{sentence(4)}</h2>")
+        if i % 10 == 5: body.append(f"<pre><code>def f_{i}(x):\n    return x * {i}\n</code></pre>")
+        body.append(f"<p>{' '.join(sentence(12) for _ in range(3))} See <a href='/ref/{i}'>reference</a>.</p>")
+    return (f"<html><head><title>Page</title><style>body{{margin:0}}</style><script>var t={rng.random()};</script></head><body>"
+            f"<header><div class='logo'>Site</div><nav><ul>{nav}</ul></nav></header>"
+            f"<div class='layout'><aside class='sidebar'><ul>{nav}</ul></aside><article><h1>{sentence(5)}</h1>{''.join(body)}</article></div>"
+            f"<footer><p>Copyright. <a href='/privacy'>Privacy</a> <a href='/terms'>Terms</a></p></footer></body></html>")
+
+def load_pages(directory):
+    pages = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith((".html", ".htm")):
+            with open(os.path.join(directory, name), "r", encoding="utf-8", errors="replace") as f:
+                pages.append((name, f.read()))
+    return pages
+
+def bench(pages, extractors=None, repeat=3):
+    """Per extractor: latency percentiles per page, throughput, peak traced memory and output size relative to bs4."""
+    from .rag_bench import percentiles
+    extractors = extractors or list(EXTRACTORS)
+    total_bytes = sum(len(html.encode("utf-8")) for _, html in pages)
+    baseline_chars = None
+    results = []
+    for name in extractors:
+        func = get_extractor(name)
+        latencies = []
+        for _ in range(repeat):
+            for _, html in pages:
+                t0 = time.perf_counter()
+                func(html)
+                latencies.append((time.perf_counter() - t0) * 1000)
+        tracemalloc.start()
+        chars = sum(len(func(html)[0]) for _, html in pages)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        if name == "bs4": baseline_chars = chars
+        results.append({"extractor": name, "page_ms": percentiles(latencies), "mb_per_s": round(total_bytes * repeat / 2**20 / (sum(latencies) / 1000), 2),
+                        "peak_mem_mb": round(peak / 2**20, 2), "output_chars": chars})
+    for result in results:
+        result["output_vs_bs4"] = round(result["output_chars"] / baseline_chars, 3) if baseline_chars else None
+    return {"pages": len(pages), "bytes": total_bytes, "repeat": repeat, "results": results}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark HTML-to-text extractors on saved pages.")
+    parser.add_argument("--pages", help="directory of saved .html pages (default: synthetic pages)")
+    parser.add_argument("--synthetic", type=int, default=50, help="number of synthetic pages when --pages is not given")
+    parser.add_argument("--extractors", nargs="+", choices=list(EXTRACTORS), default=list(EXTRACTORS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--show", help="print one extractor's output for the first page and exit")
+    parser.add_argument("--out", help="write the results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    if args.pages:
+        pages = load_pages(args.pages)
+    else:
+        rng = random.Random(0)
+        pages = [(f"synthetic_{i}.html", synthetic_page(rng)) for i in range(args.synthetic)]
+    if not pages: parser.error(f"No .html pages found in {args.pages}")
+    if args.show:
+        print(get_extractor(args.show)(pages[0][1])[0])
+        return None
+
+    report = bench(pages, args.extractors, args.repeat)
+    print(f"[html_extract] {report['pages']} pages, {report['bytes'] / 2**20:.2f} MB")
+    for r in report["results"]:
+        print(f"[html_extract]   {r['extractor']:<8} p50 {r['page_ms']['p50']:>8} ms  p95 {r['page_ms']['p95']:>8} ms  "
+              f"{r['mb_per_s']:>7} MB/s  peak {r['peak_mem_mb']:>7} MB  output {r['output_chars']:>9} chars "
+              f"({r['output_vs_bs4'] if r['output_vs_bs4'] is not None else '-'} x bs4)")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+if __name__ == "__main__":
+    main()
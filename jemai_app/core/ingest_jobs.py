@@ -0,0 +1,150 @@
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .. import socketio
+from ..config import RAG_INGEST_WORKERS
+
+MAX_FINISHED_JOBS = 50
+PROGRESS_EMIT_INTERVAL = 0.5
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class IngestJob:
+    """State of one background ingestion; the worker reports through `progress` and polls `cancel_requested`."""
+
+    def __init__(self, source, description=""):
+        self.id = uuid.uuid4().hex[:12]
+        self.source = source
+        self.description = description
+        self.state = "queued"
+        self.processed = self.total = 0
+        self.phase = ""
+        self.created_at = time.time()
+        self.started_at = self.finished_at = None
+        self.result = self.error = None
+        self.future = None
+        self.cancel_event = threading.Event()
+        self._last_emit = 0.0
+
+    @property
+    def active(self):
+        return self.state in ("queued", "running")
+
+    def cancel_requested(self):
+        return self.cancel_event.is_set()
+
+    def progress(self, processed, total=None, phase=None):
+        self.processed = processed
+        if total is not None: self.total = total
+        if phase is not None: self.phase = phase
+        now = time.time()
+        if now - self._last_emit >= PROGRESS_EMIT_INTERVAL:
+            self._last_emit = now
+            emit_job(self)
+
+    def eta_s(self):
+        if self.state != "running" or not self.processed or not self.total: return None
+        elapsed = time.time() - self.started_at
+        return round(elapsed / self.processed * (self.total - self.processed), 1)
+
+    def to_dict(self):
+        return {
+            "id": self.id, "source": self.source, "description": self.description, "state": self.state,
+            "phase": self.phase, "processed": self.processed, "total": self.total, "eta_s": self.eta_s(),
+            "created_at": self.created_at, "started_at": self.started_at, "finished_at": self.finished_at,
+            "result": self.result, "error": self.error,
+        }
+
+
+def emit_job(job):
+    try:
+        socketio.emit('rag_job_progress', job.to_dict())
+    except Exception as e:
+        logging.debug(f"INGEST JOBS: Could not emit progress for job {job.id}: {e}")
+
+
+class IngestJobManager:
+    """
+    Runs ingestion jobs on a bounded worker pool with single-flight semantics
+    per source: submitting while a job for the same source is queued or
+    running returns that job instead of starting another one.
+    """
+
+    def __init__(self, max_workers=RAG_INGEST_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="RAGIngest")
+        self.lock = threading.Lock()
+        self.jobs = OrderedDict()
+        self.active_by_source = {}
+
+    def submit(self, source, func, description=""):
+        """Schedules `func(job)`; returns (job, created) where created is False if a job for `source` was already active."""
+        with self.lock:
+            existing = self.active_by_source.get(source)
+            if existing is not None and existing.active:
+                return existing, False
+            job = IngestJob(source, description)
+            self.jobs[job.id] = job
+            self.active_by_source[source] = job
+            self._prune()
+            job.future = self.executor.submit(self._run, job, func)
+        emit_job(job)
+        return job, True
+
+    def _run(self, job, func):
+        if job.cancel_requested():
+            self._finish(job, "cancelled")
+            return
+        job.state, job.started_at = "running", time.time()
+        emit_job(job)
+        logging.info(f"INGEST JOBS: Started {job.source} job {job.id}.")
+        try:
+            job.result = func(job)
+            self._finish(job, "cancelled" if job.cancel_requested() else "done")
+        except JobCancelled:
+            self._finish(job, "cancelled")
+        except Exception as e:
+            job.error = str(e)
+            logging.error(f"INGEST JOBS: {job.source} job {job.id} failed: {e}")
+            self._finish(job, "failed")
+
+    def _finish(self, job, state):
+        job.state, job.finished_at = state, time.time()
+        with self.lock:
+            if self.active_by_source.get(job.source) is job:
+                del self.active_by_source[job.source]
+        logging.info(f"INGEST JOBS: {job.source} job {job.id} {state}.")
+        emit_job(job)
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if not job.active]
+        for job_id in finished[:max(len(finished) - MAX_FINISHED_JOBS, 0)]:
+            del self.jobs[job_id]
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None or not job.active: return job
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            self._finish(job, "cancelled")
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def latest(self, source):
+        """The most recent job for `source`, active or finished."""
+        for job in reversed(self.jobs.values()):
+            if job.source == source: return job
+        return None
+
+    def list(self):
+        return [job.to_dict() for job in reversed(self.jobs.values())]
+
+
+INGEST_JOBS = IngestJobManager()
@@ -0,0 +1,98 @@
+import re
+import math
+import threading
+from collections import Counter
+
+WORD_RE = re.compile(r"[A-Za-z0-9_]+")
+CAMEL_RE = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+IDENTIFIER_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z0-9_]+)*")
+
+
+def tokenize_code(text):
+    """
+    Lowercased tokens for keyword search. Identifiers are kept whole and also
+    split on snake_case and camelCase, so `handle_director_message` matches
+    both the exact name and a query for "director message".
+    """
+    tokens = []
+    for word in WORD_RE.findall(text):
+        lower = word.lower()
+        tokens.append(lower)
+        parts = [p.lower() for piece in word.split("_") for p in CAMEL_RE.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+def query_identifiers(query):
+    """Code-like terms in a query: snake_case, camelCase or dotted names such as file names."""
+    return [t for t in IDENTIFIER_RE.findall(query)
+            if "_" in t.strip("_") or "." in t or (re.search(r"[a-z][A-Z]", t) is not None)]
+
+
+class BM25Index:
+    """In-memory inverted index scored with Okapi BM25."""
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1, self.b = k1, b
+        self.lock = threading.Lock()
+        self.postings = {}     # term -> {doc_id: term frequency}
+        self.lengths = {}      # doc_id -> document length in tokens
+        self.doc_terms = {}    # doc_id -> distinct terms, for removal
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def add(self, doc_id, text):
+        counts = Counter(tokenize_code(text))
+        with self.lock:
+            if doc_id in self.lengths: self._remove(doc_id)
+            for term, tf in counts.items():
+                self.postings.setdefault(term, {})[doc_id] = tf
+            length = sum(counts.values())
+            self.lengths[doc_id] = length
+            self.doc_terms[doc_id] = list(counts)
+            self.total_length += length
+
+    def _remove(self, doc_id):
+        for term in self.doc_terms.pop(doc_id, []):
+            docs = self.postings.get(term)
+            if docs is None: continue
+            docs.pop(doc_id, None)
+            if not docs: del self.postings[term]
+        self.total_length -= self.lengths.pop(doc_id, 0)
+
+    def remove(self, doc_id):
+        with self.lock:
+            self._remove(doc_id)
+
+    def clear(self):
+        with self.lock:
+            self.postings, self.lengths, self.doc_terms, self.total_length = {}, {}, {}, 0
+
+    def search(self, query, k=10, candidates=None):
+        """Returns up to `k` (doc_id, score) pairs, best first. `candidates` optionally restricts the doc_ids scored."""
+        terms = set(tokenize_code(query))
+        scores = Counter()
+        with self.lock:
+            n = len(self.lengths)
+            if not n or not terms: return []
+            avgdl = self.total_length / n
+            for term in terms:
+                docs = self.postings.get(term)
+                if not docs: continue
+                idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                for doc_id, tf in docs.items():
+                    if candidates is not None and doc_id not in candidates: continue
+                    norm = self.k1 * (1 - self.b + self.b * self.lengths[doc_id] / avgdl)
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores.most_common(k)
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuses several best-first lists of IDs; each ID scores sum(1 / (k + rank))."""
+    fused = Counter()
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] += 1.0 / (k + rank)
+    return [doc_id for doc_id, _ in fused.most_common()]
@@ -0,0 +1,147 @@
+"""
+LLM client micro-benchmark.
+
+Times chat completions through a client built per call (what call_llm
+used to do) and through the pooled process-wide client from
+llm_providers.get_client, against the local mock server (mock_llm_server.py) or any
+OpenAI-compatible endpoint:
+
+    python -m jemai_app.core.llm_bench --calls 300 --concurrency 1 8
+    python -m jemai_app.core.llm_bench --base-url https://api.openai.com/v1 --model gpt-4o-mini --calls 20
+    python -m jemai_app.core.llm_bench --ttft --token-ms 20
+
+The mean difference is the per-call overhead the pool saves: client
+construction plus a new connection (and TLS handshake on https). With
+--ttft it instead compares time to first token of blocking and streaming
+completions; the mock then generates at `token_ms` per word.
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import datetime
+import threading
+from ..config import JEMAI_HUB, OPENAI_API_KEY
+from .llm_providers import get_client
+from .rag_bench import percentiles, _environment
+from .mock_llm_server import MockLLMServer
+
+RESULTS_DIR = os.path.join(JEMAI_HUB, "llm_bench_results")
+MESSAGES = [{"role": "system", "content": "You are a benchmark."}, {"role": "user", "content": "Say hello."}]
+# The mock echoes the prompt, so this yields a reply of a few dozen words.
+LONG_MESSAGES = [{"role": "system", "content": "You are a benchmark."},
+                 {"role": "user", "content": "Explain, in a few sentences, how the back of house loop picks tasks from the queue, "
+                                             "runs them, records their results and decides when to sleep before looking for more work."}]
+
+
+def _per_call(base_url, api_key, model):
+    import openai
+    client = openai.OpenAI(api_key=api_key, base_url=base_url)
+    try:
+        client.chat.completions.create(model=model, messages=MESSAGES, max_tokens=16)
+    finally:
+        client.close()
+
+def _pooled(base_url, api_key, model):
+    get_client(base_url, api_key).chat.completions.create(model=model, messages=MESSAGES, max_tokens=16)
+
+def bench_mode(name, call, calls, concurrency):
+    """Runs `calls` calls spread over `concurrency` threads; returns latency percentiles and throughput."""
+    latencies, errors, lock = [], [], threading.Lock()
+
+    def worker(count):
+        for _ in range(count):
+            started = time.perf_counter()
+            try:
+                call()
+            except Exception as e:
+                with lock: errors.append(str(e))
+                continue
+            with lock: latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(calls // concurrency + (i < calls % concurrency),)) for i in range(concurrency)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    elapsed = time.perf_counter() - started
+    return {"mode": name, "concurrency": concurrency, "calls": calls, "errors": len(errors), "first_error": errors[0] if errors else None,
+            "calls_per_s": round(len(latencies) / elapsed, 1), "latency_ms": percentiles(latencies)}
+
+def bench_ttft(base_url, api_key, model, calls):
+    """Time to first token and total time of blocking vs streaming completions through the pooled client."""
+    client = get_client(base_url, api_key)
+    samples = {"blocking": [], "streaming": []}
+    for _ in range(calls):
+        started = time.perf_counter()
+        client.chat.completions.create(model=model, messages=LONG_MESSAGES, max_tokens=256)
+        elapsed = (time.perf_counter() - started) * 1000
+        samples["blocking"].append((elapsed, elapsed))
+        started, first = time.perf_counter(), None
+        for chunk in client.chat.completions.create(model=model, messages=LONG_MESSAGES, max_tokens=256, stream=True):
+            if first is None and chunk.choices and chunk.choices[0].delta.content: first = time.perf_counter()
+        finished = time.perf_counter()
+        samples["streaming"].append((((first or finished) - started) * 1000, (finished - started) * 1000))
+    results = []
+    for mode, values in samples.items():
+        results.append({"mode": mode, "calls": calls, "ttft_ms": percentiles([v[0] for v in values]), "total_ms": percentiles([v[1] for v in values])})
+        print(f"[llm_bench]   {mode:<9} ttft p50 {results[-1]['ttft_ms']['p50']:>9} ms  total p50 {results[-1]['total_ms']['p50']:>9} ms", flush=True)
+    return results
+
+def run(base_url=None, api_key=None, model="mock", calls=200, concurrency=(1,), latency_ms=0.0, ttft=False, token_ms=0.0):
+    mock = None
+    if base_url is None:
+        mock = MockLLMServer(latency_ms=latency_ms, token_ms=token_ms).start()
+        base_url, api_key = mock.base_url, api_key or "mock"
+    api_key = api_key or OPENAI_API_KEY
+    results = []
+    try:
+        if ttft:
+            results = bench_ttft(base_url, api_key, model, calls)
+            concurrency = ()
+        for threads in concurrency:
+            modes = [("per-call", lambda: _per_call(base_url, api_key, model)), ("pooled", lambda: _pooled(base_url, api_key, model))]
+            for name, call in modes:
+                call()  # warm-up: imports, and the pooled client's first connection
+                result = bench_mode(name, call, calls, threads)
+                results.append(result)
+                print(f"[llm_bench]   {name:<9} x{threads:<3} {result['calls_per_s']:>8} calls/s  "
+                      f"p50 {result['latency_ms'].get('p50')} ms  p99 {result['latency_ms'].get('p99')} ms  errors {result['errors']}", flush=True)
+            per_call, pooled = results[-2]["latency_ms"], results[-1]["latency_ms"]
+            if per_call and pooled:
+                print(f"[llm_bench]   pooling saves {round(per_call['mean'] - pooled['mean'], 3)} ms per call at concurrency {threads}", flush=True)
+    finally:
+        if mock is not None: mock.stop()
+    return {"base_url": base_url, "model": model, "mock_latency_ms": latency_ms if mock else None,
+            "mock_token_ms": token_ms if mock else None, "results": results}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark per-call vs pooled LLM clients.")
+    parser.add_argument("--base-url", help="OpenAI-compatible endpoint (default: an in-process mock server)")
+    parser.add_argument("--api-key")
+    parser.add_argument("--model", default="mock")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="mock server reply delay")
+    parser.add_argument("--ttft", action="store_true", help="compare time to first token of blocking and streaming calls")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="mock server generation delay per word")
+    parser.add_argument("--out", help="output JSON path (default: llm_bench_results/<timestamp>.json)")
+    args = parser.parse_args(argv)
+    try:
+        import openai
+    except ImportError:
+        parser.error("the openai library is not installed")
+    # One INFO line per request from the HTTP client would drown the results.
+    for name in ("httpx", "httpx2", "openai"): logging.getLogger(name).setLevel(logging.WARNING)
+
+    report = {"environment": _environment(), "run": run(args.base_url, args.api_key, args.model, args.calls, args.concurrency, args.latency_ms,
+                                                          args.ttft, args.token_ms)}
+    out = args.out or os.path.join(RESULTS_DIR, f"{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[llm_bench] Results written to {out}")
+    return report
+
+if __name__ == "__main__":
+    main()
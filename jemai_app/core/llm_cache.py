@@ -0,0 +1,279 @@
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import deque
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    response TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    cost_ms REAL NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+SEMANTIC_SCHEMA = """
+CREATE TABLE IF NOT EXISTS semantic_responses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    model TEXT NOT NULL,
+    context_hash TEXT NOT NULL,
+    embedder TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    response TEXT NOT NULL,
+    cost_ms REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+def cache_key(model, messages, params=None):
+    """SHA-256 of the canonical JSON of (model, messages, params): key order and whitespace don't matter, content does."""
+    canonical = json.dumps({"model": model, "messages": messages, "params": params or {}},
+                           sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Exact-match LLM response cache in SQLite (WAL journal, so readers in
+    other processes never block on a writer). Entries older than `ttl_s`
+    are misses and get deleted; when the stored responses exceed
+    `max_bytes` the least recently used ones are evicted. Each entry keeps
+    the latency of the call that produced it, so hits add up to time saved.
+    The database is opened on first use.
+    """
+
+    def __init__(self, path, ttl_s=7 * 86400, max_bytes=64 * 2**20):
+        self.path, self.ttl_s, self.max_bytes = path, ttl_s, max_bytes
+        self.lock = threading.Lock()
+        self.conn = None
+        self.total_bytes = 0
+        self.counters = {"hits": 0, "misses": 0, "expired": 0, "stores": 0, "evictions": 0, "saved_ms": 0.0}
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SCHEMA)
+            self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM responses").fetchone()[0]
+        return self.conn
+
+    def get(self, key):
+        """The cached response for `key`, or None."""
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            row = conn.execute("SELECT response, bytes, cost_ms, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_s and row[3] + self.ttl_s < now:
+                with conn:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.total_bytes -= row[1]
+                self.counters["expired"] += 1
+                row = None
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            with conn:
+                conn.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self.counters["hits"] += 1
+            self.counters["saved_ms"] += row[2]
+            return row[0]
+
+    def put(self, key, model, response, cost_ms=0.0):
+        size = len(response.encode("utf-8"))
+        if self.max_bytes and size > self.max_bytes: return
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                old = conn.execute("SELECT bytes FROM responses WHERE key = ?", (key,)).fetchone()
+                conn.execute("INSERT OR REPLACE INTO responses (key, model, response, bytes, cost_ms, created_at, last_used, hits) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?, 0)", (key, model, response, size, cost_ms, now, now))
+                self.total_bytes += size - (old[0] if old else 0)
+                self.counters["stores"] += 1
+                if self.max_bytes and self.total_bytes > self.max_bytes: self._evict(conn)
+
+    def _evict(self, conn):
+        """Deletes least recently used entries until the cache is back under max_bytes."""
+        victims, freed = [], 0
+        for key, size in conn.execute("SELECT key, bytes FROM responses ORDER BY last_used"):
+            if self.total_bytes - freed <= self.max_bytes: break
+            victims.append((key,))
+            freed += size
+        conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self.total_bytes -= freed
+        self.counters["evictions"] += len(victims)
+        logging.info(f"LLM CACHE: Evicted {len(victims)} least recently used responses ({freed} bytes).")
+
+    def clear(self):
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                removed = conn.execute("DELETE FROM responses").rowcount
+            self.total_bytes = 0
+            return removed
+
+    def stats(self):
+        with self.lock:
+            conn = self._connect()
+            entries = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            counters = dict(self.counters, saved_ms=round(self.counters["saved_ms"], 1))
+            lookups = counters["hits"] + counters["misses"]
+            return dict(counters, entries=entries, bytes=self.total_bytes, max_bytes=self.max_bytes, ttl_s=self.ttl_s,
+                        hit_rate=round(counters["hits"] / lookups, 4) if lookups else None)
+
+
+class SemanticCache:
+    """
+    Answers prompts that only differ in wording from a recently answered
+    one. The `max_entries` most recent prompt embeddings sit in a ring
+    buffer matrix, so a lookup is a single matrix-vector product; the best
+    match counts as a hit when its cosine similarity reaches `threshold` and
+    model, embedder and context hash (system prompt and earlier turns) are
+    the same. Entries persist in the `semantic_responses` table of the
+    response cache database. Every hit is appended to the audit log at
+    `audit_path`; report_false_hit() drops an entry that answered the wrong
+    question.
+    """
+
+    def __init__(self, path, threshold=0.92, max_entries=2000, ttl_s=7 * 86400, audit_path=None):
+        self.path, self.threshold, self.max_entries, self.ttl_s, self.audit_path = path, threshold, max_entries, ttl_s, audit_path
+        self.lock = threading.Lock()
+        self.conn = None
+        self.vectors = None
+        self.groups = np.empty(max_entries, dtype=object)
+        self.created = np.zeros(max_entries)
+        self.entries = [None] * max_entries
+        self.next = 0
+        self.audit = deque(maxlen=200)
+        self.counters = {"lookups": 0, "hits": 0, "misses": 0, "stores": 0, "false_hits": 0, "saved_ms": 0.0, "hit_similarity": 0.0}
+
+    @staticmethod
+    def _group(model, context_hash, embedder):
+        return f"{model}\0{context_hash}\0{embedder}"
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.executescript(SEMANTIC_SCHEMA)
+            rows = self.conn.execute("SELECT id, model, context_hash, embedder, prompt, embedding, response, cost_ms, created_at "
+                                     "FROM semantic_responses ORDER BY id DESC LIMIT ?", (self.max_entries,)).fetchall()
+            for row in reversed(rows):
+                self._remember(row[0], row[1], row[2], row[3], row[4], np.frombuffer(row[5], dtype=np.float32), row[6], row[7], row[8])
+            if rows: logging.info(f"LLM CACHE: Loaded {len(rows)} semantic cache entries.")
+        return self.conn
+
+    def _remember(self, entry_id, model, context_hash, embedder, prompt, vector, response, cost_ms, created_at):
+        """Writes an entry into the next ring slot; a new embedding size (another embedder) starts the ring over."""
+        if self.vectors is None or self.vectors.shape[1] != vector.shape[0]:
+            self.vectors = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+            self.groups[:] = None
+            self.entries = [None] * self.max_entries
+        slot = self.next
+        self.vectors[slot] = vector
+        self.groups[slot] = self._group(model, context_hash, embedder)
+        self.created[slot] = created_at
+        self.entries[slot] = {"id": entry_id, "model": model, "prompt": prompt, "response": response, "cost_ms": cost_ms}
+        self.next = (slot + 1) % self.max_entries
+
+    def get(self, model, context_hash, embedder, vector, prompt):
+        """The cached response for the most similar prompt above the threshold, or None."""
+        vector = np.asarray(vector, dtype=np.float32)
+        with self.lock:
+            self._connect()
+            self.counters["lookups"] += 1
+            best, similarity = None, 0.0
+            if self.vectors is not None and self.vectors.shape[1] == vector.shape[0]:
+                mask = self.groups == self._group(model, context_hash, embedder)
+                if self.ttl_s: mask &= self.created >= time.time() - self.ttl_s
+                if mask.any():
+                    scores = np.where(mask, self.vectors @ vector, -np.inf)
+                    slot = int(np.argmax(scores))
+                    if scores[slot] >= self.threshold: best, similarity = slot, float(scores[slot])
+            if best is None:
+                self.counters["misses"] += 1
+                return None
+            entry = self.entries[best]
+            self.counters["hits"] += 1
+            self.counters["saved_ms"] += entry["cost_ms"]
+            self.counters["hit_similarity"] += similarity
+            record = {"audit_id": hashlib.sha1(f"{entry['id']}:{time.time()}:{prompt}".encode("utf-8")).hexdigest()[:12],
+                      "at": time.strftime("%Y-%m-%dT%H:%M:%S"), "model": model, "similarity": round(similarity, 4),
+                      "prompt": prompt, "cached_prompt": entry["prompt"], "entry_id": entry["id"]}
+            self.audit.append(record)
+            self._write_audit(record)
+            logging.info(f"LLM CACHE: Semantic hit ({similarity:.3f}) for '{prompt[:60]}' via '{entry['prompt'][:60]}'.")
+            return entry["response"]
+
+    def put(self, model, context_hash, embedder, vector, prompt, response, cost_ms=0.0):
+        vector = np.asarray(vector, dtype=np.float32)
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            with conn:
+                entry_id = conn.execute("INSERT INTO semantic_responses (model, context_hash, embedder, prompt, embedding, response, cost_ms, created_at) "
+                                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                        (model, context_hash, embedder, prompt, vector.tobytes(), response, cost_ms, now)).lastrowid
+                conn.execute("DELETE FROM semantic_responses WHERE id <= ?", (entry_id - self.max_entries,))
+            self._remember(entry_id, model, context_hash, embedder, prompt, vector, response, cost_ms, now)
+            self.counters["stores"] += 1
+
+    def _write_audit(self, record):
+        if not self.audit_path: return
+        try:
+            with open(self.audit_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logging.warning(f"LLM CACHE: Could not write the semantic audit log: {e}")
+
+    def report_false_hit(self, audit_id, note=None):
+        """Marks an audited hit as wrong and drops the cached entry that produced it; False for an unknown audit id."""
+        with self.lock:
+            record = next((r for r in self.audit if r["audit_id"] == audit_id), None)
+            if record is None: return False
+            record["false_hit"] = True
+            for slot, entry in enumerate(self.entries):
+                if entry is not None and entry["id"] == record["entry_id"]:
+                    self.groups[slot], self.entries[slot] = None, None
+            with self._connect():
+                self.conn.execute("DELETE FROM semantic_responses WHERE id = ?", (record["entry_id"],))
+            self.counters["false_hits"] += 1
+            self._write_audit({"audit_id": audit_id, "at": time.strftime("%Y-%m-%dT%H:%M:%S"), "false_hit": True, "note": note})
+            logging.warning(f"LLM CACHE: False semantic hit {audit_id} reported; dropped entry {record['entry_id']}.")
+            return True
+
+    def clear(self):
+        with self.lock:
+            with self._connect():
+                removed = self.conn.execute("DELETE FROM semantic_responses").rowcount
+            self.vectors, self.next = None, 0
+            self.groups[:] = None
+            self.entries = [None] * self.max_entries
+            return removed
+
+    def stats(self):
+        with self.lock:
+            self._connect()
+            counters = dict(self.counters)
+            hits, lookups = counters.pop("hits"), counters["lookups"]
+            similarity = counters.pop("hit_similarity")
+            return dict(counters, hits=hits, saved_ms=round(counters["saved_ms"], 1), entries=sum(e is not None for e in self.entries),
+                        threshold=self.threshold, hit_rate=round(hits / lookups, 4) if lookups else None,
+                        false_hit_rate=round(counters["false_hits"] / hits, 4) if hits else None,
+                        mean_hit_similarity=round(similarity / hits, 4) if hits else None)
+
+    def recent_hits(self, limit=50):
+        with self.lock:
+            return list(self.audit)[-limit:][::-1]
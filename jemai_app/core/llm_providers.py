@@ -0,0 +1,342 @@
+"""
+LLM backends behind call_llm and the router that picks one per call.
+
+A provider serves the model names matching its glob patterns: "openai"
+(any OpenAI-compatible endpoint), "ollama" (/api/chat of a local Ollama)
+and "mock" (mock_llm_server.py started in-process, for offline runs and
+tests). Routes for a call, in order:
+
+  * an explicit "provider/model" (or "provider:model") name, else every
+    provider serving the model, fastest measured first;
+  * for prompts up to JEMAI_LLM_SMALL_PROMPT_TOKENS, the small model
+    (e.g. "ollama:llama3:latest") goes first unless it measures slower;
+  * the JEMAI_LLM_FALLBACK routes.
+
+A route that raises or times out puts its provider in a cooldown that
+doubles with consecutive failures, and the next route is tried.
+"""
+import time
+import json
+import atexit
+import fnmatch
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from ..config import (OPENAI_API_KEY, OPENAI_BASE_URL, LLM_POOL_SIZE, LLM_KEEPALIVE, LLM_TIMEOUT, LLM_CONNECT_TIMEOUT, LLM_MAX_RETRIES,
+                      LLM_PROVIDERS, LLM_DEFAULT_PROVIDER, LLM_FALLBACK, LLM_SMALL_MODEL, LLM_SMALL_PROMPT_TOKENS, LLM_PROVIDER_COOLDOWN)
+from .chunking import count_tokens
+
+# Check for OpenAI library during import
+try:
+    import openai
+    try:
+        import httpx
+    except ImportError:
+        # Newer openai releases are built on httpx2 instead.
+        import httpx2 as httpx
+    HAS_OPENAI = HAS_OPENAI_LIBRARY = True
+    if OPENAI_API_KEY and OPENAI_API_KEY != "sk-...":
+        openai.api_key = OPENAI_API_KEY
+    else:
+        logging.warning("OpenAI API key not found in .env file.")
+        HAS_OPENAI = False
+except ImportError:
+    HAS_OPENAI = HAS_OPENAI_LIBRARY = False
+
+# One client per (base_url, api_key), reused by every call in the process.
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url=None, api_key=None, pool_size=LLM_POOL_SIZE, timeout=LLM_TIMEOUT, connect_timeout=LLM_CONNECT_TIMEOUT):
+    """
+    Process-wide OpenAI client for an endpoint. Its HTTP client keeps up to
+    `pool_size` keep-alive connections, so calls after the first skip the
+    TCP and TLS handshakes. Clients are thread-safe and shared between the
+    Socket.IO handler threads; pool settings apply when a client is created.
+    """
+    key = (base_url or OPENAI_BASE_URL, api_key or OPENAI_API_KEY)
+    client = _clients.get(key)
+    if client is not None: return client
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size, keepalive_expiry=LLM_KEEPALIVE)
+            client = openai.OpenAI(api_key=key[1], base_url=key[0], max_retries=LLM_MAX_RETRIES,
+                                   timeout=openai.Timeout(timeout, connect=connect_timeout),
+                                   http_client=openai.DefaultHttpxClient(limits=limits))
+            _clients[key] = client
+            logging.info(f"LLM: Created client for {key[0] or 'api.openai.com'} with {pool_size} pooled connections.")
+    return client
+
+@atexit.register
+def close_clients():
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+class ProviderError(Exception):
+    """A backend answered, but with an error instead of a completion."""
+
+
+class Provider:
+    """
+    Base class: a named backend serving the models matching `models`. It
+    tracks an exponentially weighted moving average of its latency (time to
+    first token; the whole reply for blocking calls) and a failure cooldown.
+    """
+    kind = None
+
+    def __init__(self, name, base_url=None, models=(), api_key=None, timeout=LLM_TIMEOUT, cooldown_s=LLM_PROVIDER_COOLDOWN):
+        self.name, self.base_url, self.models, self.api_key = name, base_url, list(models), api_key
+        self.timeout, self.cooldown_s = timeout, cooldown_s
+        self.lock = threading.Lock()
+        self.latency_ms = None
+        self.failures = 0
+        self.down_until = 0.0
+        self.counters = {"calls": 0, "errors": 0}
+        self.last_error = None
+
+    def serves(self, model):
+        return any(fnmatch.fnmatchcase(model, pattern) for pattern in self.models)
+
+    def available(self):
+        return True
+
+    def healthy(self):
+        return time.monotonic() >= self.down_until
+
+    def succeeded(self, latency_ms):
+        with self.lock:
+            self.counters["calls"] += 1
+            self.latency_ms = latency_ms if self.latency_ms is None else 0.8 * self.latency_ms + 0.2 * latency_ms
+            self.failures, self.down_until = 0, 0.0
+
+    def failed(self, error):
+        with self.lock:
+            self.counters["calls"] += 1
+            self.counters["errors"] += 1
+            self.failures += 1
+            self.down_until = time.monotonic() + self.cooldown_s * 2 ** min(self.failures - 1, 5)
+            self.last_error = str(error)[:300]
+
+    def complete(self, messages, model, params):
+        """The reply text of a blocking completion."""
+        raise NotImplementedError
+
+    def stream(self, messages, model, params):
+        """Yields the reply as text deltas."""
+        raise NotImplementedError
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, kind=self.kind, base_url=self.base_url, models=self.models, available=self.available(),
+                        healthy=self.healthy(), latency_ms=round(self.latency_ms, 1) if self.latency_ms is not None else None,
+                        cooldown_s=round(max(self.down_until - time.monotonic(), 0.0), 1), last_error=self.last_error)
+
+
+class OpenAIProvider(Provider):
+    """Any OpenAI-compatible chat completions endpoint, through the pooled clients of get_client."""
+    kind = "openai"
+
+    def available(self):
+        # A provider with its own key (e.g. a local OpenAI-compatible server) doesn't need OPENAI_API_KEY.
+        return HAS_OPENAI or (HAS_OPENAI_LIBRARY and bool(self.api_key))
+
+    def _client(self):
+        return get_client(self.base_url, self.api_key, timeout=self.timeout)
+
+    def complete(self, messages, model, params):
+        completion = self._client().chat.completions.create(model=model, messages=messages, **params)
+        return completion.choices[0].message.content
+
+    def stream(self, messages, model, params):
+        for chunk in self._client().chat.completions.create(model=model, messages=messages, stream=True, **params):
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta: yield delta
+
+
+class OllamaProvider(Provider):
+    """Ollama's /api/chat over a pooled requests session; max_tokens maps to num_predict."""
+    kind = "ollama"
+
+    def __init__(self, name, base_url=None, models=(), **options):
+        super().__init__(name, (base_url or "http://localhost:11434").rstrip("/"), models, **options)
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=LLM_POOL_SIZE))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=LLM_POOL_SIZE))
+
+    def _post(self, messages, model, params, stream):
+        body = {"model": model, "messages": messages, "stream": stream}
+        if params.get("max_tokens"): body["options"] = {"num_predict": params["max_tokens"]}
+        response = self.session.post(f"{self.base_url}/api/chat", json=body, stream=stream, timeout=(LLM_CONNECT_TIMEOUT, self.timeout))
+        if not response.ok:
+            raise ProviderError(f"Ollama error {response.status_code}: {response.text[:200]}")
+        return response
+
+    def complete(self, messages, model, params):
+        return self._post(messages, model, params, False).json()["message"]["content"]
+
+    def stream(self, messages, model, params):
+        with self._post(messages, model, params, True) as response:
+            for line in response.iter_lines():
+                if not line: continue
+                chunk = json.loads(line)
+                if chunk.get("error"): raise ProviderError(f"Ollama error: {chunk['error']}")
+                delta = (chunk.get("message") or {}).get("content")
+                if delta: yield delta
+
+
+class MockProvider(OllamaProvider):
+    """mock_llm_server.py started in-process on first use, spoken to through its Ollama API."""
+    kind = "mock"
+
+    def __init__(self, name, base_url=None, models=("mock*",), latency_ms=0.0, token_ms=0.0, **options):
+        super().__init__(name, base_url or "http://mock", models, **options)
+        self.latency_ms_setting, self.token_ms = latency_ms, token_ms
+        self.server = None
+
+    def _post(self, messages, model, params, stream):
+        if self.server is None:
+            from .mock_llm_server import MockLLMServer
+            with self.lock:
+                if self.server is None:
+                    self.server = MockLLMServer(latency_ms=self.latency_ms_setting, token_ms=self.token_ms).start()
+                    self.base_url = self.server.url
+        return super()._post(messages, model, params, stream)
+
+
+PROVIDER_KINDS = {"openai": OpenAIProvider, "ollama": OllamaProvider, "mock": MockProvider}
+
+
+def build_provider(name, spec):
+    spec = dict(spec)
+    kind = spec.pop("kind", name)
+    if kind not in PROVIDER_KINDS:
+        raise ValueError(f"Unknown LLM provider kind '{kind}' for '{name}', expected one of {sorted(PROVIDER_KINDS)}.")
+    return PROVIDER_KINDS[kind](name, **spec)
+
+
+def prompt_tokens(messages):
+    return sum(count_tokens(m.get("content") or "") for m in messages if isinstance(m.get("content"), str))
+
+
+class Router:
+    """Orders the routes for a call (see the module docstring) and runs them until one answers."""
+
+    def __init__(self, providers, default=None, fallback=(), small_model=None, small_prompt_tokens=0):
+        self.providers, self.default = providers, default
+        self.fallback, self.small_model, self.small_prompt_tokens = list(fallback), small_model, small_prompt_tokens
+        self.lock = threading.Lock()
+        self.counters = {"calls": 0, "small_routes": 0, "fallbacks": 0, "exhausted": 0}
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def _resolve(self, spec):
+        """(provider, model) for "provider/model" or "provider:model"; None when the prefix is not a provider."""
+        for separator in ("/", ":"):
+            name, _, model = spec.partition(separator)
+            if model and name in self.providers: return self.providers[name], model
+        return None
+
+    def route(self, model, messages):
+        """Available (provider, model) routes to try in order; providers cooling down after a failure go last."""
+        explicit = self._resolve(model)
+        routes = [explicit] if explicit else []
+        if not explicit:
+            serving = [p for p in self.providers.values() if p.serves(model)]
+            if not serving and self.default in self.providers: serving = [self.providers[self.default]]
+            # Unmeasured providers sort first, so each gets measured once.
+            routes = [(p, model) for p in sorted(serving, key=lambda p: p.latency_ms or 0.0)]
+            small = self._resolve(self.small_model) if self.small_model else None
+            if small and routes and prompt_tokens(messages) <= self.small_prompt_tokens:
+                fastest = routes[0][0].latency_ms
+                if small[0].latency_ms is None or fastest is None or small[0].latency_ms <= fastest:
+                    routes.insert(0, small)
+                    self._count("small_routes")
+        routes += [r for r in map(self._resolve, self.fallback) if r]
+        seen, ordered = set(), []
+        for provider, name in routes:
+            if provider.available() and (provider.name, name) not in seen:
+                seen.add((provider.name, name))
+                ordered.append((provider, name))
+        ordered.sort(key=lambda r: not r[0].healthy())
+        return ordered
+
+    def _routes(self, model, messages):
+        self._count("calls")
+        routes = self.route(model, messages)
+        if not routes:
+            raise ProviderError(f"No LLM provider available for '{model}'; install openai and set OPENAI_API_KEY, or configure JEMAI_LLM_PROVIDERS.")
+        return routes
+
+    def _failed(self, provider, model, error, routes, index):
+        provider.failed(error)
+        if index + 1 < len(routes):
+            self._count("fallbacks")
+            logging.warning(f"LLM: {provider.name} failed for {model} ({error}); falling back to {routes[index + 1][0].name}:{routes[index + 1][1]}.")
+        else:
+            self._count("exhausted")
+
+    def complete(self, messages, model, params):
+        """(reply text, "provider:model" that produced it); raises the last error when every route fails."""
+        routes, error = self._routes(model, messages), None
+        for index, (provider, name) in enumerate(routes):
+            started = time.perf_counter()
+            try:
+                text = provider.complete(messages, name, params)
+            except Exception as e:
+                self._failed(provider, name, e, routes, index)
+                error = e
+                continue
+            provider.succeeded((time.perf_counter() - started) * 1000)
+            return text, f"{provider.name}:{name}"
+        raise error
+
+    def stream(self, messages, model, params):
+        """Yields text deltas; falls back only until the first delta has gone out."""
+        routes, error = self._routes(model, messages), None
+        for index, (provider, name) in enumerate(routes):
+            started, first = time.perf_counter(), False
+            try:
+                for delta in provider.stream(messages, name, params):
+                    if not first:
+                        first = True
+                        provider.succeeded((time.perf_counter() - started) * 1000)
+                    yield delta
+            except Exception as e:
+                if first:
+                    provider.failed(e)
+                    raise
+                self._failed(provider, name, e, routes, index)
+                error = e
+                continue
+            if not first: provider.succeeded((time.perf_counter() - started) * 1000)
+            return
+        raise error
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        return dict(counters, default=self.default, fallback=self.fallback, small_model=self.small_model,
+                    small_prompt_tokens=self.small_prompt_tokens, providers={name: p.stats() for name, p in self.providers.items()})
+
+
+def build_providers(specs):
+    """Providers for the configured specs; a bad spec is logged and left out rather than stopping the app."""
+    providers = {}
+    for name, spec in specs.items():
+        try:
+            providers[name] = build_provider(name, spec)
+        except (TypeError, ValueError, AttributeError) as e:
+            logging.warning(f"LLM: Ignoring provider '{name}': {e}")
+    return providers
+
+
+ROUTER = Router(build_providers(LLM_PROVIDERS), default=LLM_DEFAULT_PROVIDER,
+                fallback=LLM_FALLBACK, small_model=LLM_SMALL_MODEL, small_prompt_tokens=LLM_SMALL_PROMPT_TOKENS)
@@ -0,0 +1,88 @@
+import threading
+
+# Per-chunk positions and timestamps are never filtered on by equality; indexing them would only waste memory.
+UNINDEXED_FIELDS = {"start_line", "end_line", "ingested_at", "name"}
+
+
+class MetadataIndex:
+    """
+    Posting lists (field -> value -> set of doc IDs) over document metadata,
+    so a `where` filter resolves to its candidate IDs without scanning every
+    document. Filters use the Chroma syntax subset: {field: value},
+    {field: {"$in": [...]}}, {field: {"$ne": value}}, {"$and": [...]},
+    {"$or": [...]}; several keys in one dict are ANDed.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = {}
+        self.doc_fields = {}
+
+    def __len__(self):
+        return len(self.doc_fields)
+
+    def add(self, doc_id, metadata):
+        with self.lock:
+            if doc_id in self.doc_fields: self._remove(doc_id)
+            fields = {}
+            for field, value in (metadata or {}).items():
+                if field in UNINDEXED_FIELDS or not isinstance(value, (str, int, float, bool)): continue
+                self.postings.setdefault(field, {}).setdefault(value, set()).add(doc_id)
+                fields[field] = value
+            self.doc_fields[doc_id] = fields
+
+    def _remove(self, doc_id):
+        for field, value in self.doc_fields.pop(doc_id, {}).items():
+            docs = self.postings[field][value]
+            docs.discard(doc_id)
+            if not docs: del self.postings[field][value]
+
+    def remove(self, doc_id):
+        with self.lock:
+            self._remove(doc_id)
+
+    def clear(self):
+        with self.lock:
+            self.postings, self.doc_fields = {}, {}
+
+    def values(self, field):
+        """Distinct values of `field` with their document counts."""
+        with self.lock:
+            return {value: len(docs) for value, docs in self.postings.get(field, {}).items()}
+
+    def match(self, where):
+        """Returns the set of doc IDs matching `where` (all IDs when `where` is empty)."""
+        with self.lock:
+            return self._match(where)
+
+    def _match(self, where):
+        if not where: return set(self.doc_fields)
+        result = None
+        for key, condition in where.items():
+            if key == "$and":
+                ids = set.intersection(*(self._match(c) for c in condition)) if condition else set(self.doc_fields)
+            elif key == "$or":
+                ids = set().union(*(self._match(c) for c in condition))
+            else:
+                ids = self._match_field(key, condition)
+            result = ids if result is None else result & ids
+        return result
+
+    def _match_field(self, field, condition):
+        if field in UNINDEXED_FIELDS:
+            raise ValueError(f"Metadata field '{field}' is not indexed for filtering.")
+        values = self.postings.get(field, {})
+        if not isinstance(condition, dict):
+            return set(values.get(condition, ()))
+        (op, operand), = condition.items()
+        if op == "$eq": return set(values.get(operand, ()))
+        if op == "$in": return set().union(*(values.get(v, set()) for v in operand))
+        if op == "$ne": return set(self.doc_fields) - values.get(operand, set())
+        if op == "$nin": return set(self.doc_fields) - set().union(*(values.get(v, set()) for v in operand))
+        raise ValueError(f"Unsupported metadata filter operator '{op}'.")
+
+
+def to_chroma_where(where):
+    """Chroma requires exactly one top-level key; several keys are wrapped in an explicit $and."""
+    if not where or len(where) == 1: return where or None
+    return {"$and": [{key: value} for key, value in where.items()]}
@@ -0,0 +1,166 @@
+"""
+Local mock of an OpenAI-compatible chat completions server, and of
+Ollama's /api/chat, for benchmarks, offline runs and provider tests:
+
+    python -m jemai_app.core.mock_llm_server --port 8190 --latency-ms 50
+    OPENAI_BASE_URL=http://127.0.0.1:8190/v1 OPENAI_API_KEY=mock python run.py
+
+Replies are deterministic ("Mock reply to: <last user message>") after
+`latency_ms`, plus `token_ms` per word to imitate generation; with
+"stream": true the words arrive as server-sent event chunks (OpenAI) or
+JSON lines (Ollama). Setting `fail_status` makes every completion fail
+with that HTTP status, to exercise fallbacks. It speaks HTTP/1.1 with
+keep-alive, so connection reuse shows up as it would against a real
+endpoint.
+"""
+import re
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def mock_reply(messages):
+    last = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+    return f"Mock reply to: {last[:200]}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, delayed ACKs add ~40 ms to every reply.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream(self, server, request, content):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        base = {"id": f"chatcmpl-mock-{server.requests}", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request.get("model", "mock")}
+        for piece in re.findall(r"\S+\s*", content):
+            if server.token_ms: time.sleep(server.token_ms / 1000)
+            chunk = dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": piece}, "finish_reason": None}])
+            self._send_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        chunk = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        self._send_chunk(f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self._send_chunk(b"")
+
+    def _stream_ollama(self, server, request, content):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        model = request.get("model", "mock")
+        for piece in re.findall(r"\S+\s*", content):
+            if server.token_ms: time.sleep(server.token_ms / 1000)
+            chunk = {"model": model, "message": {"role": "assistant", "content": piece}, "done": False}
+            self._send_chunk((json.dumps(chunk) + "\n").encode("utf-8"))
+        self._send_chunk((json.dumps({"model": model, "message": {"role": "assistant", "content": ""}, "done": True}) + "\n").encode("utf-8"))
+        self._send_chunk(b"")
+
+    def _ollama_chat(self, server, request, content):
+        if request.get("stream", True): return self._stream_ollama(server, request, content)
+        if server.token_ms: time.sleep(server.token_ms * len(content.split()) / 1000)
+        self._send_json(200, {"model": request.get("model", "mock"), "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                              "message": {"role": "assistant", "content": content}, "done": True})
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "jemai"}]})
+        elif self.path.rstrip("/") == "/api/tags":
+            self._send_json(200, {"models": [{"name": "mock", "model": "mock"}]})
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_POST(self):
+        server = self.server.mock
+        try:
+            request = self._read_json()
+        except ValueError:
+            return self._send_json(400, {"error": {"message": "Invalid JSON body."}})
+        server.count()
+        ollama = self.path.rstrip("/") == "/api/chat"
+        if not (ollama or self.path.rstrip("/").endswith("/chat/completions")):
+            return self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+        if server.latency_ms: time.sleep(server.latency_ms / 1000)
+        if server.fail_status:
+            return self._send_json(server.fail_status, {"error": {"message": f"Mock failure {server.fail_status}."}})
+        content = mock_reply(request.get("messages") or [])
+        if ollama: return self._ollama_chat(server, request, content)
+        if request.get("stream"): return self._stream(server, request, content)
+        if server.token_ms: time.sleep(server.token_ms * len(content.split()) / 1000)
+        prompt_tokens = sum(len(str(m.get("content") or "").split()) for m in request.get("messages") or [])
+        completion_tokens = len(content.split())
+        self._send_json(200, {
+            "id": f"chatcmpl-mock-{server.requests}", "object": "chat.completion", "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+
+class MockLLMServer:
+    """Runs the mock in a daemon thread; `base_url` is ready for openai.OpenAI(base_url=...), `url` for Ollama clients."""
+
+    def __init__(self, host="127.0.0.1", port=0, latency_ms=0.0, token_ms=0.0, fail_status=None):
+        self.latency_ms, self.token_ms, self.fail_status = latency_ms, token_ms, fail_status
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self.url = f"http://{host}:{self.httpd.server_address[1]}"
+        self.base_url = f"{self.url}/v1"
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.thread = None
+
+    def count(self):
+        with self.lock:
+            self.requests += 1
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name="MockLLMServer")
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a mock OpenAI-compatible chat completions API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8190)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay before each reply")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="generation delay per word")
+    parser.add_argument("--fail-status", type=int, help="answer every completion with this HTTP error status")
+    args = parser.parse_args(argv)
+    server = MockLLMServer(args.host, args.port, args.latency_ms, args.token_ms, args.fail_status)
+    print(f"[mock_llm_server] Serving {server.base_url} (Ollama API at {server.url})", flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import os
+import time
+import numpy as np
+
+# Popcount of every byte value, for Hamming distances on packed sign bits.
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _top_k(scores, k):
+    k = min(k, scores.shape[0])
+    if k <= 0: return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class Quantizer:
+    """
+    Compressed copy of a store's vectors used for a cheap first-pass scan.
+    Follows the owning store's row layout like IVFIndex (`add` / `move` /
+    `truncate`); `search` scores every row on the codes, then re-scores the
+    best `k * rerank` candidates exactly against the float matrix, which
+    therefore only has those rows paged in.
+    """
+    mode = None
+    bytes_per_dim = 4.0
+
+    def __init__(self, dim):
+        self.dim = dim
+        self.codes = np.empty((0, self.code_width()), dtype=self.code_dtype)
+        self.version = None
+
+    def code_width(self):
+        return self.dim
+
+    def encode(self, vectors):
+        raise NotImplementedError
+
+    def fits(self, vectors):
+        """Whether `vectors` encode without loss beyond the mode's own; when not, the owner re-encodes every row."""
+        return True
+
+    def fit(self, vectors):
+        """Derives encoding parameters from `vectors` (all rows, or their per-dimension extremes)."""
+
+    def scores(self, query, block=65536):
+        raise NotImplementedError
+
+    def add(self, vectors):
+        if len(vectors): self.codes = np.concatenate([self.codes, self.encode(np.asarray(vectors, dtype=np.float32))])
+
+    def move(self, src, dst):
+        self.codes[dst] = self.codes[src]
+
+    def truncate(self, count):
+        self.codes = self.codes[:count]
+
+    def search(self, matrix, query, k, rerank=4):
+        candidates = _top_k(self.scores(query), k * max(rerank, 1))
+        if not candidates.size: return candidates, np.empty(0, dtype=np.float32)
+        candidates.sort()
+        exact = matrix[candidates] @ query
+        top = _top_k(exact, k)
+        return candidates[top], exact[top]
+
+    def memory_report(self):
+        rows = self.codes.shape[0]
+        return {"mode": self.mode, "rows": rows, "code_bytes": int(self.codes.nbytes), "float32_bytes": rows * self.dim * 4,
+                "ratio": round(4.0 / self.bytes_per_dim, 1)}
+
+    def evaluate(self, matrix, queries, k=10, reranks=(1, 2, 4, 8, 16)):
+        """Recall@k against exact float search, and latency, for each re-rank factor."""
+        matrix = np.asarray(matrix)
+        truth = [set(_top_k(matrix @ q, k).tolist()) for q in queries]
+        report = {"k": k, "queries": len(queries), "memory": self.memory_report(), "settings": []}
+        for rerank in reranks:
+            hits, elapsed = 0, 0.0
+            for q, expected in zip(queries, truth):
+                t0 = time.perf_counter()
+                rows, _ = self.search(matrix, q, k, rerank)
+                elapsed += (time.perf_counter() - t0) * 1000
+                hits += len(expected & set(rows.tolist()))
+            report["settings"].append({"rerank": rerank, "recall": round(hits / max(sum(len(t) for t in truth), 1), 4),
+                                       "ms": round(elapsed / max(len(queries), 1), 3)})
+        return report
+
+    def save(self, path, version=None):
+        """Writes the codes; `version` (the owner's, if given) comes back from load() as the `version` attribute."""
+        tmp_path = path + ".tmp.npz"
+        extra = {} if version is None else {"version": np.int64(version)}
+        np.savez(tmp_path, codes=self.codes, **extra, **self._state())
+        os.replace(tmp_path, path)
+
+    def _state(self):
+        return {}
+
+    def _restore(self, data):
+        pass
+
+    @classmethod
+    def load(cls, path, dim):
+        data = np.load(path)
+        quantizer = cls(dim)
+        quantizer.codes = data["codes"]
+        quantizer.version = int(data["version"]) if "version" in data.files else None
+        quantizer._restore(data)
+        return quantizer
+
+
+class Int8Quantizer(Quantizer):
+    """
+    Scalar quantization: one signed byte per dimension with a per-dimension
+    scale (4x smaller than float32). The scale covers the largest value
+    seen per dimension plus HEADROOM; a batch beyond it fails fits(), and
+    the store re-derives the scale from all its rows instead of clipping.
+    """
+    mode = "int8"
+    bytes_per_dim = 1.0
+    code_dtype = np.int8
+    HEADROOM = 1.5
+
+    def __init__(self, dim):
+        super().__init__(dim)
+        self.scale = None
+
+    def fit(self, vectors):
+        self.scale = np.maximum(np.abs(vectors).max(axis=0) * self.HEADROOM, 1e-6).astype(np.float32) / 127.0
+
+    def fits(self, vectors):
+        return self.scale is None or bool((np.abs(vectors) <= self.scale * 127.0).all())
+
+    def encode(self, vectors):
+        if self.scale is None: self.fit(vectors)
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    def scores(self, query, block=65536):
+        weighted = (query * self.scale).astype(np.float32)
+        out = np.empty(self.codes.shape[0], dtype=np.float32)
+        for start in range(0, out.shape[0], block):
+            out[start:start + block] = self.codes[start:start + block].astype(np.float32) @ weighted
+        return out
+
+    def _state(self):
+        return {"scale": self.scale if self.scale is not None else np.empty(0, np.float32), "headroom": np.float32(self.HEADROOM)}
+
+    def _restore(self, data):
+        # Older codes used the first batch's range and clipped everything after it.
+        if "headroom" not in data.files: raise ValueError("int8 codes were encoded with a first-batch scale")
+        self.scale = data["scale"] if data["scale"].size else None
+
+
+class BinaryQuantizer(Quantizer):
+    """Sign-bit quantization: one bit per dimension, compared by Hamming distance (32x smaller than float32)."""
+    mode = "binary"
+    bytes_per_dim = 0.125
+    code_dtype = np.uint8
+
+    def code_width(self):
+        return (self.dim + 7) // 8
+
+    def encode(self, vectors):
+        return np.packbits(vectors > 0, axis=1)
+
+    def scores(self, query, block=65536):
+        packed = np.packbits(query > 0)
+        out = np.empty(self.codes.shape[0], dtype=np.float32)
+        for start in range(0, out.shape[0], block):
+            distance = _POPCOUNT[np.bitwise_xor(self.codes[start:start + block], packed)].sum(axis=1, dtype=np.int32)
+            out[start:start + block] = -distance
+        return out
+
+
+QUANTIZERS = {"int8": Int8Quantizer, "binary": BinaryQuantizer}
@@ -1,47 +1,645 @@
+import os
+import re
 import time
+import json
+import atexit
+import hashlib
 import logging
-from ..config import CHROMA_PATH
+import importlib.util
+import threading
+import unicodedata
+from contextlib import nullcontext
+import numpy as np
+from ..config import (CHROMA_PATH, CHROMA_COLLECTION, RAG_STORE_PATH, RAG_GENERATIONS_PATH, RAG_BACKEND, RAG_BATCH_SIZE, RAG_EMBEDDER,
+                      RAG_QUERY_CACHE_SIZE, RAG_RESULT_CACHE_SIZE, RAG_HYBRID, RAG_RRF_K, RAG_KEYWORD_SHORTCUT_RATIO,
+                      RAG_ANN, RAG_ANN_NLIST, RAG_ANN_NPROBE, RAG_ANN_MIN_ROWS, RAG_QUANTIZATION, RAG_RERANK_FACTOR, RAG_SHARDS, RAG_SHARD_MIN_ROWS,
+                      RAG_CONTEXT_TOKENS, RAG_CONTEXT_CANDIDATES, RAG_CONTEXT_MIN_SCORE, RAG_MMR_LAMBDA, RAG_DEDUP, RAG_DEDUP_THRESHOLD, RAG_DEDUP_NAMESPACES)
+from .embedders import get_embedder, BatchingEmbedder
+from .caching import LRUCache
+from .keyword_index import BM25Index, query_identifiers, reciprocal_rank_fusion
+from .context_packer import pack_context
+from .chunking import count_tokens
+from .metadata_index import MetadataIndex, to_chroma_where
+from .dedup import DedupIndex, SkippedDuplicates
+from .compaction import AccessTracker, vacuum_sqlite
+from .rag_server import served
 
-# Check for ChromaDB library during import
-try:
+# The RAG is initialized lazily: nothing is imported or loaded until the first
+# call to ensure_rag() (or a background warm-up via start_warmup()), so
+# importing this module never blocks the web server on the embedding model.
+RAG_COLLECTION = None
+EMBEDDER = None
+HAS_CHROMADB = False
+_init_lock = threading.Lock()
+_status = {"state": "cold", "backend": None, "embedder": RAG_EMBEDDER, "generation": None, "load_ms": None, "error": None}
+# Which index generation is active: backend, generation number, embedder and its collection name or store path.
+GENERATION = None
+# (max_batch, max_wait_ms) in the RAG server process, whose connections' embedding calls are coalesced (see rag_server.py).
+EMBED_BATCHING = None
+
+# Query embeddings depend only on the embedder; search results also depend on
+# the collection contents, so their keys include a version that every write bumps.
+QUERY_EMBED_CACHE = LRUCache(RAG_QUERY_CACHE_SIZE, name="query_embeddings")
+RESULT_CACHE = LRUCache(RAG_RESULT_CACHE_SIZE, name="search_results")
+_version_lock = threading.Lock()
+_collection_version = 0
+
+# Keyword and metadata indexes kept in step with the vector store; rebuilt from stored documents on startup.
+KEYWORD_INDEX = BM25Index()
+METADATA_INDEX = MetadataIndex()
+# MinHash signatures for near-duplicate detection, persisted next to the store and reconciled with it on startup.
+DEDUP_INDEX = DedupIndex(threshold=RAG_DEDUP_THRESHOLD)
+# Near-duplicates skip mode left out, restored by rag_delete when the document they duplicate is deleted.
+SKIPPED_DUPLICATES = SkippedDuplicates()
+# Retrieval counts per document, consulted by the compactor when a namespace is over quota.
+ACCESS_STATS = AccessTracker()
+# Serializes writes to the collection and its indexes, so a vacuum never races an add or delete.
+_write_lock = threading.RLock()
+
+NAMESPACES = ("code", "web", "chat", "imports")
+LANGUAGES = {".py": "python", ".js": "javascript", ".html": "html", ".css": "css", ".md": "markdown"}
+WEB_HINT_RE = re.compile(r"https?://|\b(web ?page|website|article|url|link|docs?|documentation)\b", re.IGNORECASE)
+CODE_HINT_RE = re.compile(r"\b(code|function|class|method|module|file|bug|error|traceback|exception|import|def|endpoint|route)\b", re.IGNORECASE)
+
+
+def _open_chroma(name=CHROMA_COLLECTION):
     import chromadb
-    from chromadb.utils import embedding_functions
-    
-    chroma_client = chromadb.PersistentClient(path=CHROMA_PATH)
-    embed_func = embedding_functions.SentenceTransformerEmbeddingFunction(model_name="all-MiniLM-L6-v2")
-    RAG_COLLECTION = chroma_client.get_or_create_collection(name="jemai_rag_memory", embedding_function=embed_func)
-    HAS_CHROMADB = True
-    logging.info("ChromaDB RAG system initialized.")
-except ImportError:
-    HAS_CHROMADB = False
-    RAG_COLLECTION = None
-    logging.warning("chromadb or sentence-transformers not found. RAG system disabled.")
-except Exception as e:
-    HAS_CHROMADB = False
-    RAG_COLLECTION = None
-    logging.error(f"ChromaDB initialization failed: {e}")
-
-
-def rag_add_text(text, doc_id=None):
-    if not HAS_CHROMADB or not text.strip(): return False
-    if not doc_id: doc_id = f"doc_{int(time.time())}_{hash(text)}"
+    client = chromadb.PersistentClient(path=CHROMA_PATH)
+    # Embeddings are always computed by EMBEDDER and passed in explicitly.
+    return client.get_or_create_collection(name=name, embedding_function=None)
+
+def _open_numpy(path=RAG_STORE_PATH):
+    from .vector_store import NumpyVectorStore
+    return NumpyVectorStore(path, ann=RAG_ANN, ann_nlist=RAG_ANN_NLIST, ann_nprobe=RAG_ANN_NPROBE, ann_min_rows=RAG_ANN_MIN_ROWS,
+                            quantization=RAG_QUANTIZATION, rerank=RAG_RERANK_FACTOR, shards=RAG_SHARDS, shard_min_rows=RAG_SHARD_MIN_ROWS)
+
+def _deferred_writes(collection):
+    """Lets the NumPy store persist its sidecar and indexes once for a bulk operation instead of after every batch."""
+    return nullcontext() if HAS_CHROMADB else collection.batch()
+
+def load_generations():
+    """The active index generation per backend (see reindex.py); empty until the first re-index."""
     try:
-        RAG_COLLECTION.add(documents=[text], ids=[doc_id])
-        logging.info(f"RAG: Added document '{doc_id}'")
-        return True
+        with open(RAG_GENERATIONS_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
     except Exception as e:
-        logging.error(f"RAG: Failed to add document: {e}")
+        logging.warning(f"RAG: Could not read {RAG_GENERATIONS_PATH}, using the default index: {e}")
+        return {}
+
+def _save_generations(generations):
+    tmp_path = RAG_GENERATIONS_PATH + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(generations, f, indent=1)
+    os.replace(tmp_path, RAG_GENERATIONS_PATH)
+
+@served(default=False)
+def ensure_rag(wait=True):
+    """
+    Initializes the embedder and vector store on first use. Returns True when
+    the RAG is ready. With `wait=False` it never blocks: if initialization is
+    not finished it starts a background warm-up (if needed) and returns False.
+    """
+    global RAG_COLLECTION, EMBEDDER, HAS_CHROMADB, GENERATION
+    if _status["state"] == "ready": return True
+    if not wait:
+        if _status["state"] == "cold": start_warmup()
         return False
+    with _init_lock:
+        if _status["state"] in ("ready", "failed"): return _status["state"] == "ready"
+        _status["state"] = "loading"
+        started = time.perf_counter()
+        generations = load_generations()
+
+        collection = None
+        if RAG_BACKEND in ("auto", "chroma"):
+            try:
+                generation = generations.get("chroma") or {"generation": 0, "embedder": RAG_EMBEDDER, "collection": CHROMA_COLLECTION}
+                collection = _open_chroma(generation["collection"])
+                HAS_CHROMADB = True
+                logging.info("ChromaDB RAG system initialized.")
+            except ImportError:
+                logging.warning("chromadb not found.")
+            except Exception as e:
+                logging.error(f"ChromaDB initialization failed: {e}")
+        # Fall back to the built-in NumPy store so retrieval keeps working without Chroma.
+        if collection is None and RAG_BACKEND in ("auto", "numpy"):
+            try:
+                generation = generations.get("numpy") or {"generation": 0, "embedder": RAG_EMBEDDER, "path": RAG_STORE_PATH}
+                collection = _open_numpy(generation["path"])
+                logging.info("RAG: Using built-in NumPy vector store.")
+            except Exception as e:
+                logging.error(f"RAG: NumPy vector store initialization failed: {e}")
+        if collection is None:
+            _status.update(state="failed", error="No vector store backend could be initialized.")
+            return False
+
+        # Stored vectors are only comparable with the embedder that made them, so the generation's embedder wins.
+        if generation["embedder"] != RAG_EMBEDDER:
+            logging.warning(f"RAG: The index was built with '{generation['embedder']}' but JEMAI_RAG_EMBEDDER is "
+                            f"'{RAG_EMBEDDER}'; using the former until a re-index (POST /api/rag/reindex) switches to the latter.")
+        try:
+            embedder = get_embedder(generation["embedder"])
+            embedder.load()
+        except Exception as e:
+            logging.error(f"RAG: Failed to load embedder '{generation['embedder']}': {e}")
+            _status.update(state="failed", error=str(e))
+            return False
+
+        GENERATION = dict(generation, backend="chroma" if HAS_CHROMADB else "numpy")
+        ACCESS_STATS.load(os.path.join(_data_path(), "access_stats.json"))
+        if RAG_DEDUP != "off":
+            DEDUP_INDEX.load(os.path.join(_data_path(), "dedup_signatures.npz"))
+            SKIPPED_DUPLICATES.load(os.path.join(_data_path(), "dedup_skipped.json"))
+        _rebuild_indexes(collection)
+        EMBEDDER, RAG_COLLECTION = _batching(embedder), collection
+        _status.update(state="ready", backend=GENERATION["backend"], embedder=embedder.name, generation=GENERATION["generation"],
+                       load_ms=round((time.perf_counter() - started) * 1000, 1), error=None)
+        logging.info(f"RAG: Ready ({_status['backend']} / {embedder.name}, generation {GENERATION['generation']}) in {_status['load_ms']} ms.")
+        return True
+
+def _batching(embedder):
+    if EMBED_BATCHING is None or isinstance(embedder, BatchingEmbedder): return embedder
+    return BatchingEmbedder(embedder, *EMBED_BATCHING)
+
+def _data_path():
+    """Directory of the active backend; before the RAG has loaded, that of the backend ensure_rag would try first."""
+    if GENERATION is not None: return CHROMA_PATH if HAS_CHROMADB else GENERATION["path"]
+    if RAG_BACKEND == "chroma" or (RAG_BACKEND == "auto" and importlib.util.find_spec("chromadb")): return CHROMA_PATH
+    return (load_generations().get("numpy") or {}).get("path", RAG_STORE_PATH)
+
+def _rebuild_indexes(collection):
+    """Builds fresh keyword and metadata indexes from `collection` and swaps them in, so readers never see a half-built index."""
+    global KEYWORD_INDEX, METADATA_INDEX
+    started = time.perf_counter()
+    keyword_index, metadata_index = BM25Index(), MetadataIndex()
+    existing = collection.get(include=["documents", "metadatas"])
+    metadatas = existing.get("metadatas") or [None] * len(existing["ids"])
+    for doc_id, document, metadata in zip(existing["ids"], existing["documents"], metadatas):
+        if document: keyword_index.add(doc_id, document)
+        metadata_index.add(doc_id, metadata)
+    KEYWORD_INDEX, METADATA_INDEX = keyword_index, metadata_index
+    ACCESS_STATS.retain(set(existing["ids"]))
+    logging.info(f"RAG: Keyword and metadata indexes rebuilt with {len(KEYWORD_INDEX)} documents in {(time.perf_counter() - started) * 1000:.1f} ms.")
+    if RAG_DEDUP != "off":
+        started = time.perf_counter()
+        DEDUP_INDEX.retain(set(existing["ids"]))
+        signed = 0
+        for doc_id, document, metadata in zip(existing["ids"], existing["documents"], metadatas):
+            namespace = (metadata or {}).get("namespace")
+            if doc_id in DEDUP_INDEX.signatures or not document or namespace not in RAG_DEDUP_NAMESPACES: continue
+            signature = DEDUP_INDEX.signature(document)
+            if signature is not None:
+                DEDUP_INDEX.add(doc_id, signature, namespace)
+                signed += 1
+        DEDUP_INDEX.save(force=True)
+        logging.info(f"RAG: Near-duplicate index has {len(DEDUP_INDEX)} signatures ({signed} computed) in {(time.perf_counter() - started) * 1000:.1f} ms.")
+
+def activate_generation(collection, embedder, generation):
+    """
+    Makes a fully built collection (and the embedder that filled it) the
+    active index in one step: indexes are rebuilt from it, caches are
+    invalidated and the choice is persisted for the next start. Callers
+    hold _write_lock so no write lands in the old collection meanwhile.
+    """
+    global RAG_COLLECTION, EMBEDDER, GENERATION
+    with _write_lock:
+        generations = load_generations()
+        generations[generation["backend"]] = {key: value for key, value in generation.items() if key != "backend"}
+        _save_generations(generations)
+        GENERATION = generation
+        ACCESS_STATS.path = os.path.join(_data_path(), "access_stats.json")
+        ACCESS_STATS.save()
+        # Signatures depend only on the texts; _rebuild_indexes drops the ones for documents the new collection lacks.
+        DEDUP_INDEX.path = os.path.join(_data_path(), "dedup_signatures.npz")
+        SKIPPED_DUPLICATES.path, SKIPPED_DUPLICATES.dirty = os.path.join(_data_path(), "dedup_skipped.json"), True
+        SKIPPED_DUPLICATES.save()
+        _rebuild_indexes(collection)
+        RAG_COLLECTION, EMBEDDER = collection, _batching(embedder)
+        QUERY_EMBED_CACHE.clear()
+        _bump_version()
+        _status.update(embedder=embedder.name, generation=generation["generation"])
+    logging.info(f"RAG: Generation {generation['generation']} ({embedder.name}) is now active.")
+
+@atexit.register
+def _save_indexes():
+    DEDUP_INDEX.save(force=True)
+    SKIPPED_DUPLICATES.save()
+    ACCESS_STATS.save()
+
+@served(default=None)
+def start_warmup():
+    """Initializes the RAG in a daemon thread. A failed initialization is retried."""
+    if _status["state"] in ("ready", "loading"): return
+    if _status["state"] == "failed": _status["state"] = "cold"
+    threading.Thread(target=ensure_rag, daemon=True, name="RAGWarmup").start()
+
+@served()
+def rag_ann_report(k=10, queries=100):
+    """Recall@k / latency per nprobe for the NumPy store's IVF index, or None when no ANN index is active."""
+    if not ensure_rag() or HAS_CHROMADB: return None
+    return RAG_COLLECTION.ann_report(k=k, queries=queries)
+
+@served()
+def rag_quant_report(k=10, queries=100):
+    """Memory saving and recall loss of the NumPy store's quantized first pass, or None when quantization is off."""
+    if not ensure_rag() or HAS_CHROMADB: return None
+    return RAG_COLLECTION.quant_report(k=k, queries=queries)
+
+@served(default={"state": "unreachable", "error": "RAG server unreachable."})
+def rag_status():
+    status = dict(_status)
+    if status["state"] == "ready":
+        status["documents"] = RAG_COLLECTION.count()
+        status["namespaces"] = METADATA_INDEX.values("namespace")
+    return status
+
+
+def normalize_text(text):
+    """Canonical form used for content hashing: NFC, LF line endings, no trailing whitespace."""
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(line.rstrip() for line in text.strip().split("\n"))
+
+def content_id(text, prefix="doc"):
+    """Stable ID derived from the document content, identical across processes."""
+    digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+    return f"{prefix}_{digest[:32]}"
+
+def _existing_ids(ids):
+    found = set()
+    for start in range(0, len(ids), RAG_BATCH_SIZE):
+        batch = ids[start:start + RAG_BATCH_SIZE]
+        found.update(RAG_COLLECTION.get(ids=batch, include=[])["ids"])
+    return found
+
+@served(default=False)
+def rag_available():
+    return ensure_rag()
+
+def _bump_version():
+    global _collection_version
+    with _version_lock:
+        _collection_version += 1
+
+def collection_version():
+    return _collection_version
+
+def _embed_query(query):
+    key = (EMBEDDER.name, query)
+    vector = QUERY_EMBED_CACHE.get(key)
+    if vector is None:
+        started = time.perf_counter()
+        vector = EMBEDDER.embed([query])[0]
+        QUERY_EMBED_CACHE.put(key, vector, cost_ms=(time.perf_counter() - started) * 1000)
+    return vector
+
+@served()
+def rag_embed(texts):
+    """Embeddings of `texts` with the active embedder as lists, so other processes can share the server's model."""
+    if not ensure_rag(): return None
+    return EMBEDDER.embed(list(texts)).tolist()
+
+@served(default=None)
+def rag_query_embedding(query):
+    """
+    {"embedder", "vector"} for a query, through the query embedding cache.
+    Never waits for the RAG to load: None (and a background warm-up) until it is ready.
+    """
+    if not ensure_rag(wait=False): return None
+    return {"embedder": EMBEDDER.name, "vector": _embed_query(query).tolist()}
+
+@served()
+def rag_dedup_stats():
+    return dict(DEDUP_INDEX.stats(), mode=RAG_DEDUP, namespaces=RAG_DEDUP_NAMESPACES, skipped_kept=len(SKIPPED_DUPLICATES))
+
+@served()
+def rag_cache_stats():
+    return {"version": _collection_version, "query_embeddings": QUERY_EMBED_CACHE.stats(), "search_results": RESULT_CACHE.stats()}
+
+@served()
+def rag_data_path(load=True):
+    """
+    Directory of the active backend; per-store state such as the ingest
+    manifest lives here. With `load` false the RAG is not initialized for it.
+    """
+    if load: ensure_rag()
+    return _data_path()
+
+@served(default=None)
+def rag_stored_paths(paths):
+    """The subset of `paths` that still have documents stored under that `path` metadata; None if the RAG is unavailable."""
+    if not ensure_rag(): return None
+    return [path for path in paths if METADATA_INDEX.match({"path": path})]
+
+def document_metadata(namespace, source, path=None, extra=None):
+    """Standard metadata stored on every document; None values are dropped since Chroma rejects them."""
+    if namespace not in NAMESPACES:
+        raise ValueError(f"Unknown RAG namespace '{namespace}', expected one of {NAMESPACES}.")
+    metadata = {"namespace": namespace, "source": source, "ingested_at": int(time.time())}
+    if path:
+        metadata["path"] = path
+        language = LANGUAGES.get(os.path.splitext(path)[1].lower())
+        if language: metadata["language"] = language
+    metadata.update(extra or {})
+    return {key: value for key, value in metadata.items() if value is not None}
+
+@served(timeout=None)
+def rag_add_texts(docs, batch_size=None, namespace="imports", source="manual"):
+    """
+    Adds many documents at once. `docs` is a list of strings or dicts with
+    'text' and optional 'id' / 'metadata'. Every document is stored with the
+    standard metadata (see document_metadata) for `namespace` and `source`,
+    merged with its own. Documents already present in the collection are
+    skipped; only new ones are embedded, `batch_size` at a time.
+    Returns a stats dict with counts and throughput.
+    """
+    stats = {"added": 0, "skipped": 0, "failed": 0, "failed_ids": [], "batches": 0, "embed_ms": [], "docs_per_s": 0.0}
+    if not rag_available(): return stats
+    batch_size = batch_size or RAG_BATCH_SIZE
+    started = time.perf_counter()
+
+    pending = {}
+    for doc in docs:
+        if isinstance(doc, str): doc = {"text": doc}
+        text = doc.get("text") or ""
+        if not text.strip():
+            stats["skipped"] += 1
+            continue
+        doc_id = doc.get("id") or content_id(text)
+        if doc_id in pending:
+            stats["skipped"] += 1
+            continue
+        metadata = doc.get("metadata") or {}
+        pending[doc_id] = (text, document_metadata(namespace, source, metadata.get("path"), metadata))
 
-def rag_search(query, n_results=3):
-    if not HAS_CHROMADB or not query.strip(): return ""
     try:
-        results = RAG_COLLECTION.query(query_texts=[query], n_results=n_results)
-        if not results or not results.get('documents') or not results['documents'][0]:
-            return ""
-        context = "\n---\n".join(results['documents'][0])
-        logging.info(f"RAG: Found context for query '{query[:30]}...'")
-        return context
+        present = _existing_ids(list(pending))
+    except Exception as e:
+        logging.error(f"RAG: Failed to look up existing documents: {e}")
+        stats["failed"] = len(pending)
+        stats["failed_ids"] = list(pending)
+        return stats
+    new_ids = [doc_id for doc_id in pending if doc_id not in present]
+    stats["skipped"] += len(pending) - len(new_ids)
+    new_ids = _drop_near_duplicates(new_ids, pending, stats)
+
+    with _deferred_writes(RAG_COLLECTION):
+        for start in range(0, len(new_ids), batch_size):
+            ids = new_ids[start:start + batch_size]
+            texts = [pending[doc_id][0] for doc_id in ids]
+            metadatas = [pending[doc_id][1] for doc_id in ids]
+            try:
+                t0 = time.perf_counter()
+                embeddings = EMBEDDER.embed(texts).tolist()
+                stats["embed_ms"].append(round((time.perf_counter() - t0) * 1000, 1))
+                with _write_lock:
+                    RAG_COLLECTION.add(documents=texts, embeddings=embeddings, ids=ids, metadatas=metadatas)
+                    for doc_id, text, metadata in zip(ids, texts, metadatas):
+                        KEYWORD_INDEX.add(doc_id, text)
+                        METADATA_INDEX.add(doc_id, metadata)
+                    _bump_version()
+                stats["added"] += len(ids)
+            except Exception as e:
+                logging.error(f"RAG: Failed to add batch of {len(ids)} documents: {e}")
+                stats["failed"] += len(ids)
+                stats["failed_ids"].extend(ids)
+                DEDUP_INDEX.remove(ids)
+                # Duplicates skipped in favour of these documents weren't stored either.
+                orphans = [doc["id"] for doc in SKIPPED_DUPLICATES.release(ids)]
+                stats["failed"] += len(orphans)
+                stats["failed_ids"].extend(orphans)
+            stats["batches"] += 1
+
+    elapsed = time.perf_counter() - started
+    stats["docs_per_s"] = round(stats["added"] / elapsed, 1) if elapsed > 0 else 0.0
+    if RAG_DEDUP != "off":
+        stats["embed_ms_saved"] = DEDUP_INDEX.record(stats["near_duplicates"], stats["collapsed"], stats["added"], sum(stats["embed_ms"]))
+        DEDUP_INDEX.save()
+        SKIPPED_DUPLICATES.save()
+    logging.info(
+        f"RAG: Bulk add: {stats['added']} added, {stats['skipped']} skipped, {stats['failed']} failed "
+        f"in {stats['batches']} batches ({stats['docs_per_s']} docs/s, embed ms per batch: {stats['embed_ms']})"
+        + (f"; {stats['near_duplicates']} near-duplicates skipped, ~{stats['embed_ms_saved']} ms embedding saved" if stats.get("near_duplicates") else "")
+    )
+    return stats
+
+def _drop_near_duplicates(new_ids, pending, stats):
+    """
+    Checks new documents against the MinHash index. With JEMAI_RAG_DEDUP=skip
+    a near-duplicate of a stored (or earlier pending) document is not
+    embedded at all, but kept in SKIPPED_DUPLICATES in case that document is
+    deleted; with "collapse" it replaces the stored document, so the newest
+    version is the one kept. Returns the IDs still to embed.
+    """
+    stats.update(near_duplicates=0, collapsed=0, duplicate_of={}, embed_ms_saved=0.0)
+    if RAG_DEDUP == "off": return new_ids
+    kept, reserved, replaced = [], set(), []
+    for doc_id in new_ids:
+        text, metadata = pending[doc_id]
+        namespace = metadata.get("namespace")
+        signature = DEDUP_INDEX.signature(text) if namespace in RAG_DEDUP_NAMESPACES else None
+        if signature is None:
+            kept.append(doc_id)
+            continue
+        match = DEDUP_INDEX.query(signature, namespace)
+        if match is not None and (RAG_DEDUP == "skip" or match[0] in reserved):
+            stats["near_duplicates"] += 1
+            stats["skipped"] += 1
+            stats["duplicate_of"][doc_id] = match[0]
+            SKIPPED_DUPLICATES.add(doc_id, match[0], text, metadata)
+            continue
+        if match is not None:
+            replaced.append(match[0])
+        DEDUP_INDEX.add(doc_id, signature, namespace)
+        reserved.add(doc_id)
+        kept.append(doc_id)
+    if replaced:
+        stats["collapsed"] = rag_delete(ids=replaced)
+    return kept
+
+@served(default=False)
+def rag_add_text(text, doc_id=None, namespace="imports", source="manual", metadata=None):
+    if not rag_available() or not text.strip(): return False
+    stats = rag_add_texts([{"text": text, "id": doc_id, "metadata": metadata}], namespace=namespace, source=source)
+    return stats["failed"] == 0
+
+def _keyword_shortcut(query, keyword_hits):
+    """True when the query names identifiers and the best keyword hit contains all of them verbatim and clearly wins."""
+    identifiers = query_identifiers(query)
+    if not identifiers or not keyword_hits: return False
+    if len(keyword_hits) > 1 and keyword_hits[0][1] < RAG_KEYWORD_SHORTCUT_RATIO * keyword_hits[1][1]: return False
+    top = RAG_COLLECTION.get(ids=[keyword_hits[0][0]], include=["documents"])["documents"]
+    return bool(top) and all(identifier in (top[0] or "") for identifier in identifiers)
+
+def _hits_for(ids, scores, keyword_scores):
+    found = RAG_COLLECTION.get(ids=list(ids), include=["documents", "metadatas"])
+    metadatas = found.get("metadatas") or [None] * len(found["ids"])
+    by_id = {doc_id: (doc, meta) for doc_id, doc, meta in zip(found["ids"], found["documents"], metadatas)}
+    return [{"id": doc_id, "document": by_id[doc_id][0], "metadata": by_id[doc_id][1],
+             "score": scores.get(doc_id), "keyword_score": keyword_scores.get(doc_id)}
+            for doc_id in ids if doc_id in by_id]
+
+def route_query(query, origin="chat"):
+    """
+    Picks the namespaces worth searching for a query: VS Code requests are
+    about code; chat queries mentioning web pages go to web content, ones
+    naming identifiers or code terms go to code. Returns a `where` filter,
+    or None to search everything.
+    """
+    if origin == "vscode":
+        namespaces = ["code", "imports"]
+    elif WEB_HINT_RE.search(query):
+        namespaces = ["web", "imports"]
+    elif query_identifiers(query) or CODE_HINT_RE.search(query):
+        namespaces = ["code", "imports", "chat"]
+    else:
+        return None
+    return {"namespace": {"$in": namespaces}}
+
+@served(default=[])
+def rag_query(query, n_results=3, where=None):
+    """
+    Retrieves the best `n_results` documents as a list of hits (id, document,
+    metadata, score, keyword_score). `score` is always the cosine similarity
+    to the query, or None when no embedding was compared; the unbounded BM25
+    score goes in `keyword_score`. With JEMAI_RAG_HYBRID, vector and BM25
+    keyword rankings are combined with reciprocal rank fusion; queries naming
+    identifiers that the top keyword hit clearly matches skip the embedding
+    call entirely.
+    `where` (Chroma filter syntax) restricts candidates through the metadata
+    index before anything is scored.
+    """
+    # Searching must not stall a chat turn while the model is still loading.
+    if not query.strip() or not ensure_rag(wait=False): return []
+    key = (query, n_results, json.dumps(where, sort_keys=True) if where else None, _collection_version)
+    hits = RESULT_CACHE.get(key)
+    if hits is not None:
+        ACCESS_STATS.record(hit["id"] for hit in hits)
+        return hits
+    try:
+        started = time.perf_counter()
+        candidates = METADATA_INDEX.match(where) if where else None
+        if candidates is not None and not candidates:
+            return []
+        pool = max(n_results * 4, 20) if RAG_HYBRID else n_results
+        keyword_hits = KEYWORD_INDEX.search(query, k=pool, candidates=candidates) if RAG_HYBRID else []
+        if keyword_hits and _keyword_shortcut(query, keyword_hits):
+            # No embedding was computed, so these hits have no cosine score; BM25 scores are not comparable to one.
+            hits = _hits_for([doc_id for doc_id, _ in keyword_hits[:n_results]], {}, dict(keyword_hits))
+            logging.info(f"RAG: Keyword shortcut for query '{query[:30]}...'")
+        else:
+            filters = {"where": to_chroma_where(where)} if where else {}
+            results = RAG_COLLECTION.query(query_embeddings=[_embed_query(query).tolist()], n_results=min(pool, len(candidates)) if candidates else pool, **filters)
+            vector_ids = results["ids"][0] if results and results.get("ids") else []
+            if keyword_hits:
+                fused = reciprocal_rank_fusion([vector_ids, [doc_id for doc_id, _ in keyword_hits]], k=RAG_RRF_K)[:n_results]
+                hits = _hits_for(fused, {doc_id: 1.0 - d for doc_id, d in zip(vector_ids, results["distances"][0])}, dict(keyword_hits))
+            else:
+                metadatas = (results.get("metadatas") or [None])[0] or [None] * len(vector_ids)
+                hits = [{"id": doc_id, "document": doc, "metadata": meta, "score": 1.0 - dist, "keyword_score": None}
+                        for doc_id, doc, meta, dist in zip(vector_ids, results["documents"][0], metadatas, results["distances"][0])][:n_results]
+        RESULT_CACHE.put(key, hits, cost_ms=(time.perf_counter() - started) * 1000)
+        ACCESS_STATS.record(hit["id"] for hit in hits)
+        if hits: logging.info(f"RAG: Found {len(hits)} results for query '{query[:30]}...'")
+        return hits
     except Exception as e:
         logging.error(f"RAG: Search failed: {e}")
-        return ""
+        return []
+
+@served(default="")
+def rag_search(query, n_results=3, where=None):
+    hits = rag_query(query, n_results, where)
+    return "\n---\n".join(hit["document"] for hit in hits if hit["document"])
+
+@served(default={"context": "", "citations": [], "tokens": 0})
+def rag_context(query, token_budget=None, n_candidates=None, where=None):
+    """
+    Retrieves candidates for `query` and packs them into a prompt context of
+    at most `token_budget` tokens: candidates below JEMAI_RAG_CONTEXT_MIN_SCORE
+    are dropped, the rest are picked by maximal marginal relevance (so
+    near-duplicates are skipped) and trimmed to their most relevant lines.
+    Returns {'context', 'citations', 'tokens'}.
+    """
+    empty = {"context": "", "citations": [], "tokens": 0}
+    hits = rag_query(query, n_candidates or RAG_CONTEXT_CANDIDATES, where)
+    if not hits: return empty
+    try:
+        stored = RAG_COLLECTION.get(ids=[hit["id"] for hit in hits], include=["embeddings"])
+        vectors = dict(zip(stored["ids"], stored["embeddings"]))
+        missing = [hit for hit in hits if hit["id"] not in vectors]
+        if missing:
+            vectors.update(zip([hit["id"] for hit in missing], EMBEDDER.embed([hit["document"] or "" for hit in missing])))
+        hit_vectors = np.array([vectors[hit["id"]] for hit in hits], dtype=np.float32)
+        context, citations = pack_context(query, hits, _embed_query(query), hit_vectors,
+                                          token_budget or RAG_CONTEXT_TOKENS, lambda_=RAG_MMR_LAMBDA, min_score=RAG_CONTEXT_MIN_SCORE)
+    except Exception as e:
+        logging.error(f"RAG: Context packing failed: {e}")
+        return empty
+    tokens = count_tokens(context)
+    logging.info(f"RAG: Packed {len(citations)} of {len(hits)} candidates into {tokens} tokens for query '{query[:30]}...'")
+    return {"context": context, "citations": citations, "tokens": tokens}
+
+@served(default=0)
+def rag_delete(ids=None, where=None, restore=True):
+    """
+    Deletes documents by ID and/or `where` filter; returns how many were
+    stored. Skipped near-duplicates of the deleted documents are stored in
+    their place, or forgotten with them when `restore` is false (eviction);
+    skipped ones matching the IDs or filter are always forgotten.
+    """
+    if not rag_available() or not (ids or where): return 0
+    with _deferred_writes(RAG_COLLECTION):
+        try:
+            with _write_lock:
+                ids = list(ids or [])
+                SKIPPED_DUPLICATES.drop(ids + (sorted(SKIPPED_DUPLICATES.match(where)) if where and len(SKIPPED_DUPLICATES) else []))
+                if where:
+                    ids += sorted(METADATA_INDEX.match(where))
+                if not ids:
+                    SKIPPED_DUPLICATES.save()
+                    return 0
+                RAG_COLLECTION.delete(ids=ids)
+                for doc_id in ids:
+                    KEYWORD_INDEX.remove(doc_id)
+                    METADATA_INDEX.remove(doc_id)
+                DEDUP_INDEX.remove(ids)
+                released = SKIPPED_DUPLICATES.release(ids)
+                _bump_version()
+            DEDUP_INDEX.save()
+            SKIPPED_DUPLICATES.save()
+            logging.info(f"RAG: Deleted {len(ids)} documents.")
+        except Exception as e:
+            logging.error(f"RAG: Failed to delete documents: {e}")
+            return 0
+        if released and restore: _restore_duplicates(released)
+    return len(ids)
+
+def _restore_duplicates(docs):
+    """Stores skipped near-duplicates whose original was deleted; one of them may become the original of the others."""
+    by_origin = {}
+    for doc in docs:
+        by_origin.setdefault((doc["metadata"].get("namespace", "imports"), doc["metadata"].get("source", "manual")), []).append(doc)
+    restored = 0
+    for (namespace, source), group in by_origin.items():
+        restored += rag_add_texts(group, namespace=namespace, source=source)["added"]
+    logging.info(f"RAG: Restored {restored} of {len(docs)} near-duplicates of deleted documents.")
+
+@served(timeout=None, default=None)
+def rag_vacuum():
+    """Reclaims storage left by deletes and rebuilds the in-memory indexes; returns disk bytes before/after."""
+    if not rag_available(): return None
+    with _write_lock:
+        if HAS_CHROMADB:
+            try:
+                before, after = vacuum_sqlite(os.path.join(CHROMA_PATH, "chroma.sqlite3"))
+                result = {"bytes_before": before, "bytes_after": after}
+            except Exception as e:
+                logging.warning(f"RAG: Could not vacuum the Chroma database: {e}")
+                result = {"error": str(e)}
+        else:
+            result = RAG_COLLECTION.vacuum()
+        _rebuild_indexes(RAG_COLLECTION)
+        _bump_version()
+    logging.info(f"RAG: Vacuum complete: {result}")
+    return result
@@ -0,0 +1,309 @@
+"""
+RAG benchmark and retrieval-quality suite.
+
+Builds a corpus (synthetic at a given size, or this repository chunked the
+way ingest_codebase does) with labeled queries, then for every backend
+setting measures ingest throughput, query latency percentiles, memory and
+disk footprint, recall@k against the labels and overlap@k against exact
+search. Everything runs offline with the deterministic hashing embedder
+and results are written as JSON so runs can be compared over time:
+
+    python -m jemai_app.core.rag_bench --sizes 1000 10000 100000
+    python -m jemai_app.core.rag_bench --corpus repo --settings exact int8
+    python -m jemai_app.core.rag_bench --sizes 1000000 --shards 1 2 4 8
+
+`--shards` adds a throughput sweep of the scatter-gather shard workers
+(shards.py) against the in-process exact scan on the same matrix.
+"""
+import os
+import gc
+import sys
+import json
+import time
+import shutil
+import random
+import argparse
+import platform
+import datetime
+import tempfile
+import subprocess
+import numpy as np
+from ..config import JEMAI_HUB
+from .embedders import HashingEmbedder
+from .chunking import chunk_document
+from .vector_store import NumpyVectorStore
+from .shards import ShardPool, HAS_THREADPOOLCTL
+
+try:
+    import psutil
+    HAS_PSUTIL = True
+except ImportError:
+    HAS_PSUTIL = False
+
+RESULTS_DIR = os.path.join(JEMAI_HUB, "rag_bench_results")
+
+# Store settings benchmarked by default; each maps to NumpyVectorStore keyword arguments.
+SETTINGS = {
+    "exact": {},
+    "ivf": {"ann": "ivf", "ann_min_rows": 1, "ann_nprobe": 8},
+    "ivf-nprobe2": {"ann": "ivf", "ann_min_rows": 1, "ann_nprobe": 2},
+    "int8": {"quantization": "int8", "rerank": 4},
+    "binary": {"quantization": "binary", "rerank": 8},
+    "shards2": {"shards": 2, "shard_min_rows": 1},
+    "shards4": {"shards": 4, "shard_min_rows": 1},
+}
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "ta", "vo", "zi", "pe", "do", "su", "ga", "he", "ji", "bu", "fa", "xo", "wy"]
+
+
+def _words(rng, count):
+    words = set()
+    while len(words) < count:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+def synthetic_corpus(size, n_queries=200, seed=0):
+    """
+    Code-like documents built from topic vocabularies. Each labeled query
+    is made of identifiers and words taken from one target document, which
+    is the single relevant answer.
+    """
+    rng = random.Random(seed)
+    vocabulary = _words(rng, 6000)
+    topics = [rng.sample(vocabulary, 40) for _ in range(max(size // 50, 20))]
+    docs = []
+    for i in range(size):
+        topic = topics[rng.randrange(len(topics))]
+        identifiers = [f"{rng.choice(topic)}_{rng.choice(topic)}" for _ in range(4)] + [f"{rng.choice(vocabulary)}_{rng.choice(vocabulary)}"]
+        words = rng.sample(topic, 12) + rng.sample(vocabulary, 8)
+        lines = [f"def {identifiers[0]}({identifiers[1]}, {identifiers[2]}):"]
+        lines += [f"    # {' '.join(words[j:j + 5])}" for j in range(0, len(words), 5)]
+        lines += [f"    return {identifiers[3]}({identifiers[4]})"]
+        docs.append({"id": f"syn_{i}", "text": "\n".join(lines), "metadata": {"namespace": "code", "source": "synthetic"}, "terms": identifiers + words})
+    queries = []
+    for _ in range(n_queries):
+        target = docs[rng.randrange(size)]
+        picked = [target["terms"][0], target["terms"][4]] + rng.sample(target["terms"][5:], 3)
+        queries.append({"query": " ".join(picked), "relevant": [target["id"]]})
+    for doc in docs: del doc["terms"]
+    return docs, queries
+
+def repo_corpus(root=JEMAI_HUB, n_queries=200, seed=0):
+    """This repository's Python files, chunked like ingest_codebase; each query is a function name and its relevant chunks define it."""
+    docs, by_name = [], {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in ("__pycache__", ".git", "venv", "chroma_db", "rag_store", "versions", "node_modules")]
+        for filename in filenames:
+            if not filename.endswith(".py"): continue
+            path = os.path.join(dirpath, filename)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    source = f.read()
+            except Exception:
+                continue
+            rel = os.path.relpath(path, root).replace(os.sep, "/")
+            for chunk in chunk_document(source, rel):
+                meta = chunk["metadata"]
+                doc_id = f"codebase_{rel}#{meta['start_line']}-{meta['end_line']}"
+                docs.append({"id": doc_id, "text": chunk["text"], "metadata": {"namespace": "code", "source": "codebase", "path": rel}})
+                if meta["kind"] == "function" and len(meta["name"]) > 4:
+                    by_name.setdefault(meta["name"].split(".")[-1], []).append(doc_id)
+    rng = random.Random(seed)
+    names = sorted(by_name)
+    queries = [{"query": name, "relevant": by_name[name]} for name in rng.sample(names, min(n_queries, len(names)))]
+    return docs, queries
+
+def percentiles(samples):
+    if not samples: return {}
+    values = np.array(samples)
+    return {"p50": round(float(np.percentile(values, 50)), 3), "p95": round(float(np.percentile(values, 95)), 3),
+            "p99": round(float(np.percentile(values, 99)), 3), "mean": round(float(values.mean()), 3)}
+
+def _rss_mb():
+    return round(psutil.Process().memory_info().rss / 2**20, 1) if HAS_PSUTIL else None
+
+def _dir_bytes(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+
+def embed_corpus(embedder, docs, queries, batch_size):
+    started = time.perf_counter()
+    doc_vectors = np.concatenate([embedder.embed([d["text"] for d in docs[i:i + batch_size]]) for i in range(0, len(docs), batch_size)])
+    embed_s = time.perf_counter() - started
+    query_ms, query_vectors = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        query_vectors.append(embedder.embed([q["query"]])[0])
+        query_ms.append((time.perf_counter() - t0) * 1000)
+    return doc_vectors, np.array(query_vectors), {"docs_per_s": round(len(docs) / embed_s, 1), "query_embed_ms": percentiles(query_ms)}
+
+def bench_store(name, open_store, docs, doc_vectors, queries, query_vectors, k, batch_size, exact_results=None):
+    """Ingests the corpus into a fresh store and times every query; returns (result dict, per-query ID lists)."""
+    gc.collect()
+    rss_before = _rss_mb()
+    workdir = tempfile.mkdtemp(prefix="rag_bench_")
+    try:
+        store = open_store(workdir)
+        started = time.perf_counter()
+        for i in range(0, len(docs), batch_size):
+            batch = docs[i:i + batch_size]
+            store.add(ids=[d["id"] for d in batch], embeddings=doc_vectors[i:i + batch_size],
+                      documents=[d["text"] for d in batch], metadatas=[d["metadata"] for d in batch])
+        ingest_s = time.perf_counter() - started
+
+        # Start-up is not query latency: let shard workers come up and pages get mapped before timing.
+        if getattr(store, "shard_pool", None) is not None: store.shard_pool.ready.wait(30)
+        store.query(query_embeddings=[query_vectors[0].tolist()], n_results=k)
+        latencies, found = [], []
+        for vector in query_vectors:
+            t0 = time.perf_counter()
+            result = store.query(query_embeddings=[vector.tolist()], n_results=k)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            found.append(result["ids"][0])
+
+        label_hits = sum(1 for q, ids in zip(queries, found) if set(q["relevant"]) & set(ids))
+        result = {
+            "setting": name,
+            "ingest_docs_per_s": round(len(docs) / ingest_s, 1),
+            "ingest_s": round(ingest_s, 3),
+            "query_ms": percentiles(latencies),
+            "recall_at_k": round(label_hits / max(len(queries), 1), 4),
+            "rss_mb_delta": None if rss_before is None else round(_rss_mb() - rss_before, 1),
+            "disk_bytes": _dir_bytes(workdir),
+        }
+        if exact_results is not None:
+            overlap = sum(len(set(a) & set(b)) for a, b in zip(found, exact_results))
+            result["overlap_with_exact"] = round(overlap / max(sum(len(b) for b in exact_results), 1), 4)
+        if hasattr(store, "close"): store.close()
+        del store
+        return result, found
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def shard_scaling(doc_vectors, query_vectors, k, shard_counts, batch=32, min_seconds=2.0):
+    """
+    Queries per second of exact top-k search over `doc_vectors`, in
+    batches of `batch` queries: in-process (BLAS limited to one thread when
+    threadpoolctl is installed) and through ShardPool for each shard count.
+    Speedup is relative to the in-process scan; efficiency is speedup per
+    shard, so near-linear scaling shows as efficiency close to 1.
+    """
+    workdir = tempfile.mkdtemp(prefix="rag_bench_shards_")
+    try:
+        path = os.path.join(workdir, "vectors.npy")
+        matrix = doc_vectors.astype(np.float32)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        np.save(path, matrix)
+        queries = query_vectors.astype(np.float32)
+        queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        batches = [queries[i:i + batch] for i in range(0, len(queries), batch)]
+
+        def measure(search):
+            search(batches[0])
+            done, started = 0, time.perf_counter()
+            while time.perf_counter() - started < min_seconds:
+                for queries_batch in batches:
+                    search(queries_batch)
+                    done += len(queries_batch)
+            return done / (time.perf_counter() - started)
+
+        def in_process(queries_batch):
+            scores = queries_batch @ matrix.T
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            return np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1), axis=1)
+
+        if HAS_THREADPOOLCTL:
+            from threadpoolctl import threadpool_limits
+            with threadpool_limits(1):
+                baseline_qps = measure(in_process)
+        else:
+            baseline_qps = measure(in_process)
+        results = [{"shards": 0, "qps": round(baseline_qps, 1), "speedup": 1.0, "efficiency": None}]
+        expected = in_process(queries)
+        for shards in shard_counts:
+            pool = ShardPool(path, shards)
+            try:
+                rows, _ = pool.search(queries, len(matrix), k, 0)
+                overlap = sum(len(set(a) & set(b)) for a, b in zip(rows.tolist(), expected.tolist())) / expected.size
+                qps = measure(lambda queries_batch: pool.search(queries_batch, len(matrix), k, 0))
+            finally:
+                pool.close()
+            results.append({"shards": shards, "qps": round(qps, 1), "speedup": round(qps / baseline_qps, 2),
+                            "efficiency": round(qps / baseline_qps / shards, 2), "overlap_with_exact": round(overlap, 4)})
+        return {"docs": len(matrix), "dim": matrix.shape[1], "k": k, "batch": batch, "cpus": os.cpu_count(),
+                "single_threaded_baseline": HAS_THREADPOOLCTL, "results": results}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def _open_chroma(workdir):
+    import chromadb
+    client = chromadb.PersistentClient(path=workdir)
+    return client.get_or_create_collection(name="bench", embedding_function=None, metadata={"hnsw:space": "cosine"})
+
+def run(sizes, corpus="synthetic", settings=None, k=10, n_queries=200, batch_size=512, include_chroma=True, seed=0, shard_counts=None):
+    settings = settings or list(SETTINGS)
+    embedder = HashingEmbedder()
+    runs = []
+    for size in (sizes if corpus == "synthetic" else [None]):
+        docs, queries = synthetic_corpus(size, n_queries, seed) if corpus == "synthetic" else repo_corpus(n_queries=n_queries, seed=seed)
+        print(f"[rag_bench] corpus={corpus} docs={len(docs)} queries={len(queries)}", flush=True)
+        doc_vectors, query_vectors, embed_stats = embed_corpus(embedder, docs, queries, batch_size)
+        entry = {"corpus": corpus, "docs": len(docs), "queries": len(queries), "k": k, "embedder": embedder.name, "embedding": embed_stats, "results": []}
+
+        exact, exact_ids = bench_store("exact", NumpyVectorStore, docs, doc_vectors, queries, query_vectors, k, batch_size)
+        if "exact" in settings: entry["results"].append(exact)
+        for name in settings:
+            if name == "exact": continue
+            kwargs = SETTINGS[name]
+            result, _ = bench_store(name, lambda path: NumpyVectorStore(path, **kwargs), docs, doc_vectors, queries, query_vectors, k, batch_size, exact_ids)
+            entry["results"].append(result)
+        if include_chroma:
+            try:
+                result, _ = bench_store("chroma", _open_chroma, docs, doc_vectors, queries, query_vectors, k, batch_size, exact_ids)
+                entry["results"].append(result)
+            except ImportError:
+                print("[rag_bench] chromadb not installed, skipping the chroma backend.", flush=True)
+        for result in entry["results"]:
+            print(f"[rag_bench]   {result['setting']:<12} ingest {result['ingest_docs_per_s']:>10} docs/s  "
+                  f"p50 {result['query_ms']['p50']:>8} ms  p99 {result['query_ms']['p99']:>8} ms  "
+                  f"recall@{k} {result['recall_at_k']:.3f}  overlap {result.get('overlap_with_exact', 1.0):.3f}", flush=True)
+        if shard_counts:
+            entry["shard_scaling"] = shard_scaling(doc_vectors, query_vectors, k, shard_counts)
+            for result in entry["shard_scaling"]["results"]:
+                print(f"[rag_bench]   {'shards=' + str(result['shards']) if result['shards'] else 'in-process':<12} "
+                      f"{result['qps']:>10} queries/s  speedup {result['speedup']:>5}  efficiency {result['efficiency']}", flush=True)
+        runs.append(entry)
+    return runs
+
+def _environment():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=JEMAI_HUB, encoding="utf-8", stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        commit = None
+    return {"python": sys.version.split()[0], "numpy": np.__version__, "platform": platform.platform(),
+            "cpus": os.cpu_count(), "commit": commit, "timestamp": datetime.datetime.now().isoformat(timespec="seconds")}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark RAG ingestion and retrieval.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="synthetic corpus sizes (chunks)")
+    parser.add_argument("--corpus", choices=["synthetic", "repo"], default="synthetic")
+    parser.add_argument("--settings", nargs="+", choices=list(SETTINGS), default=list(SETTINGS))
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--no-chroma", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shards", type=int, nargs="+", help="also measure query throughput with these shard worker counts")
+    parser.add_argument("--out", help="output JSON path (default: rag_bench_results/<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    report = {"environment": _environment(), "runs": run(args.sizes, args.corpus, args.settings, args.k, args.queries,
+                                                          args.batch_size, not args.no_chroma, args.seed, args.shards)}
+    out = args.out or os.path.join(RESULTS_DIR, f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{args.corpus}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[rag_bench] Results written to {out}")
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+Standalone RAG process.
+
+    python -m jemai_app.core.rag_server serve [--address PATH|HOST:PORT]
+    python -m jemai_app.core.rag_server stats
+
+`serve` loads the embedder and the vector store once and serves the RAG
+API over a Unix domain socket (TCP on localhost on Windows). Processes
+started with JEMAI_RAG_SERVER set to that address forward the calls
+marked @served (rag_add_text(s), rag_query, rag_search, rag_context,
+rag_delete, status and maintenance) instead of loading a model and
+opening the store themselves; the signatures stay the same. Embedding
+work from concurrent connections is coalesced by a BatchingEmbedder.
+
+A frame is a 4-byte big-endian payload length, one codec byte (b"m"
+msgpack, b"j" JSON) and the payload; replies use the request's codec.
+Requests are {"id", "op", "args", "kwargs"}, replies {"id", "ok",
+"result"} or {"id", "ok": false, "error"}.
+"""
+import os
+import sys
+import copy
+import json
+import time
+import socket
+import signal
+import struct
+import logging
+import argparse
+import functools
+import threading
+import numpy as np
+from ..config import RAG_SERVER, RAG_SERVER_ADDRESS, RAG_SERVER_TIMEOUT, RAG_SERVER_BATCH, RAG_SERVER_BATCH_WAIT_MS
+
+try:
+    import msgpack
+    HAS_MSGPACK = True
+except ImportError:
+    HAS_MSGPACK = False
+
+HEADER = struct.Struct(">IB")
+CODEC_JSON, CODEC_MSGPACK = ord("j"), ord("m")
+MAX_FRAME = 256 * 2**20
+_RAISE = object()
+
+# True in the `serve` process: @served functions run locally there even when JEMAI_RAG_SERVER is set.
+SERVING = False
+# Operation name -> function, filled by @served.
+OPS = {}
+
+
+class RagServerError(ConnectionError):
+    """The RAG server could not be reached or a call failed there."""
+
+
+def _plain(value):
+    if isinstance(value, np.ndarray): return value.tolist()
+    if isinstance(value, np.generic): return value.item()
+    if isinstance(value, (set, frozenset, tuple)): return list(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def encode(message, codec=CODEC_JSON):
+    if codec == CODEC_MSGPACK:
+        payload = msgpack.packb(message, default=_plain, use_bin_type=True)
+    else:
+        payload = json.dumps(message, default=_plain).encode("utf-8")
+    return HEADER.pack(len(payload), codec) + payload
+
+def _recv_exact(sock, size):
+    chunks, remaining = [], size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1 << 20))
+        if not chunk: raise EOFError("connection closed")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+def read_frame(sock):
+    """The next (message, codec) on `sock`."""
+    size, codec = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    if size > MAX_FRAME: raise ValueError(f"Frame of {size} bytes exceeds the {MAX_FRAME} byte limit.")
+    payload = _recv_exact(sock, size)
+    if codec == CODEC_MSGPACK:
+        if not HAS_MSGPACK: raise ValueError("Received a msgpack frame but msgpack is not installed.")
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False), codec
+    return json.loads(payload), codec
+
+def parse_address(address):
+    """(family, address) for a socket path or a host:port."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and os.sep not in host:
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    if not hasattr(socket, "AF_UNIX"):
+        raise RagServerError(f"Unix domain sockets are not available here; use host:port instead of '{address}'.")
+    return socket.AF_UNIX, address
+
+
+class RagClient:
+    """Pooled connections to the RAG server, shared by all threads of a process."""
+
+    def __init__(self, address=RAG_SERVER_ADDRESS, timeout=RAG_SERVER_TIMEOUT, codec=None):
+        self.address, self.timeout = address, timeout
+        self.codec = codec or (CODEC_MSGPACK if HAS_MSGPACK else CODEC_JSON)
+        self.lock = threading.Lock()
+        self.idle = []
+        self.next_id = 0
+
+    def _connect(self):
+        family, target = parse_address(self.address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET: sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            sock.connect(target)
+        except OSError as e:
+            sock.close()
+            raise RagServerError(f"RAG server at {self.address} is unreachable: {e}") from e
+        return sock
+
+    def call(self, op, args=(), kwargs=None, timeout=_RAISE):
+        """Runs `op` on the server and returns its result; `timeout` None waits as long as the operation takes."""
+        with self.lock:
+            sock = self.idle.pop() if self.idle else None
+            self.next_id += 1
+            request = {"id": self.next_id, "op": op, "args": list(args), "kwargs": kwargs or {}}
+        # A pooled connection may have been closed by a server restart; that is retried once on a fresh one.
+        for reused in ((True, False) if sock is not None else (False,)):
+            if not reused: sock = self._connect()
+            try:
+                sock.settimeout(self.timeout if timeout is _RAISE else timeout)
+                sock.sendall(encode(request, self.codec))
+                reply, _ = read_frame(sock)
+                break
+            except (EOFError, ConnectionError) as e:
+                sock.close()
+                if not reused: raise RagServerError(f"RAG server call '{op}' failed: {e}") from e
+            except (OSError, ValueError) as e:
+                sock.close()
+                raise RagServerError(f"RAG server call '{op}' failed: {e}") from e
+        with self.lock:
+            self.idle.append(sock)
+        if not reply.get("ok"): raise RagServerError(f"RAG server call '{op}' failed: {reply.get('error')}")
+        return reply.get("result")
+
+    def close(self):
+        with self.lock:
+            for sock in self.idle: sock.close()
+            self.idle = []
+
+
+CLIENT = RagClient()
+
+def forwarding():
+    """True when this process is a client of a RAG server rather than running the RAG itself."""
+    return bool(RAG_SERVER) and not SERVING
+
+def served(timeout=_RAISE, default=_RAISE):
+    """
+    Registers the function as a server operation and makes client
+    processes forward calls to it. Callable keyword arguments (progress
+    callbacks) are not sent. With `default`, an unreachable server is
+    logged and `default` returned, like a RAG that failed to load locally.
+    """
+    def decorate(func):
+        OPS[func.__name__] = func
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not forwarding(): return func(*args, **kwargs)
+            kwargs = {key: value for key, value in kwargs.items() if not callable(value)}
+            try:
+                return CLIENT.call(func.__name__, args, kwargs, timeout=timeout)
+            except RagServerError as e:
+                if default is _RAISE: raise
+                logging.error(f"RAG SERVER: {e}")
+                return copy.deepcopy(default)
+        return wrapper
+    return decorate
+
+
+class RagServer:
+    """Accepts connections and runs each connection's requests in its own thread."""
+
+    def __init__(self, address=RAG_SERVER_ADDRESS):
+        self.address = address
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.connections = 0
+        self.op_stats = {}
+        self.sock = None
+
+    def _record(self, op, elapsed_ms, failed):
+        with self.lock:
+            entry = self.op_stats.setdefault(op, {"calls": 0, "errors": 0, "total_ms": 0.0})
+            entry["calls"] += 1
+            entry["errors"] += failed
+            entry["total_ms"] += elapsed_ms
+
+    def stats(self):
+        from . import rag
+        with self.lock:
+            ops = {op: dict(entry, mean_ms=round(entry["total_ms"] / entry["calls"], 3), total_ms=round(entry["total_ms"], 1))
+                   for op, entry in self.op_stats.items()}
+            connections = self.connections
+        embedder = rag.EMBEDDER
+        return {"address": self.address, "pid": os.getpid(), "uptime_s": round(time.time() - self.started, 1),
+                "open_connections": connections, "ops": ops,
+                "embedding_batches": embedder.stats() if hasattr(embedder, "stats") else None}
+
+    def _dispatch(self, request):
+        op = request.get("op")
+        func = OPS.get(op)
+        if func is None:
+            return {"id": request.get("id"), "ok": False, "error": f"Unknown operation '{op}'."}
+        started = time.perf_counter()
+        try:
+            result = func(*request.get("args", ()), **request.get("kwargs", {}))
+            reply = {"id": request.get("id"), "ok": True, "result": result}
+        except Exception as e:
+            logging.error(f"RAG SERVER: '{op}' failed: {e}")
+            reply = {"id": request.get("id"), "ok": False, "error": f"{type(e).__name__}: {e}"}
+        self._record(op, (time.perf_counter() - started) * 1000, not reply["ok"])
+        return reply
+
+    def _handle(self, conn):
+        with self.lock:
+            self.connections += 1
+        try:
+            with conn:
+                while True:
+                    try:
+                        request, codec = read_frame(conn)
+                    except (EOFError, OSError):
+                        return
+                    except ValueError as e:
+                        logging.warning(f"RAG SERVER: Dropping a connection after a bad frame: {e}")
+                        return
+                    reply = self._dispatch(request)
+                    try:
+                        frame = encode(reply, codec)
+                    except (TypeError, ValueError) as e:
+                        frame = encode({"id": reply["id"], "ok": False, "error": f"Unserializable result: {e}"}, codec)
+                    try:
+                        conn.sendall(frame)
+                    except OSError:
+                        return
+        finally:
+            with self.lock:
+                self.connections -= 1
+
+    def _bind(self):
+        family, target = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(target):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(target)
+                raise RuntimeError(f"A RAG server is already listening on {target}.")
+            except OSError:
+                # Left behind by a server that did not shut down cleanly.
+                os.remove(target)
+            finally:
+                probe.close()
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET: sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(target)
+        if family == socket.AF_UNIX: os.chmod(target, 0o600)
+        sock.listen(64)
+        return sock
+
+    def serve_forever(self):
+        self.sock = self._bind()
+        logging.info(f"RAG SERVER: Listening on {self.address} ({'msgpack and JSON' if HAS_MSGPACK else 'JSON'} frames).")
+        try:
+            while True:
+                conn, _ = self.sock.accept()
+                threading.Thread(target=self._handle, args=(conn,), daemon=True, name="RAGServerConnection").start()
+        finally:
+            self.close()
+
+    def close(self):
+        if self.sock is None: return
+        self.sock.close()
+        self.sock = None
+        family, target = parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(target): os.remove(target)
+
+
+def serve(address=RAG_SERVER_ADDRESS, batch=RAG_SERVER_BATCH, batch_wait_ms=RAG_SERVER_BATCH_WAIT_MS):
+    """Runs the RAG in this process and serves it on `address` until interrupted."""
+    global SERVING
+    SERVING = True
+    # Importing these registers their @served operations.
+    from . import rag, reindex
+    from .compaction import COMPACTOR, start_compactor
+    rag.EMBED_BATCHING = (batch, batch_wait_ms)
+    server = RagServer(address)
+    OPS.update(compact=COMPACTOR.compact, server_stats=server.stats)
+    if not rag.ensure_rag():
+        logging.error(f"RAG SERVER: The RAG failed to initialize: {rag.rag_status().get('error')}")
+        return 1
+    # Clients skip their own compactor; the process that owns the store runs it.
+    start_compactor()
+    # SIGTERM unwinds like Ctrl+C, so the socket file is removed.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("RAG SERVER: Shutting down.")
+    return 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the RAG as a standalone server process.")
+    parser.add_argument("command", choices=["serve", "stats"])
+    parser.add_argument("--address", default=RAG_SERVER_ADDRESS, help="socket path or host:port")
+    parser.add_argument("--batch", type=int, default=RAG_SERVER_BATCH, help="texts per coalesced embedding call")
+    parser.add_argument("--batch-wait-ms", type=float, default=RAG_SERVER_BATCH_WAIT_MS)
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        return serve(args.address, args.batch, args.batch_wait_ms)
+    print(json.dumps(RagClient(args.address).call("server_stats"), indent=2))
+    return 0
+
+if __name__ == "__main__":
+    # Run the package's copy of this module: its SERVING flag and OPS are the ones the rest of the RAG sees.
+    from jemai_app.core import rag_server
+    sys.exit(rag_server.main())
@@ -0,0 +1,189 @@
+"""
+Blue/green re-indexing of the RAG.
+
+A re-index builds the next index generation (a new Chroma collection, or
+a new NumPy store directory under RAG_STORE_PATH) from the texts already
+stored in the active one, embedding them with the target embedder while
+queries keep being served from the active generation. Embedding is
+throttled to JEMAI_RAG_REINDEX_CPU_SHARE of the time. Writes that land
+in the active index meanwhile are replayed before the swap, the last
+replay under the RAG write lock, so the swap loses nothing. The old
+generation is deleted shortly after the swap. With `rechunk` the code
+namespace is rebuilt from the files on disk with the current chunking
+settings instead of being copied.
+"""
+import os
+import time
+import shutil
+import logging
+import threading
+from ..config import (CHROMA_PATH, CHROMA_COLLECTION, RAG_STORE_PATH, RAG_BATCH_SIZE, RAG_EMBEDDER, RAG_REINDEX_CPU_SHARE,
+                      RAG_CHUNK_TOKENS, RAG_CHUNK_OVERLAP)
+from .embedders import get_embedder
+from .rag_server import served
+from . import rag
+
+# Files that make up a NumPy store; generation 0 lives directly in RAG_STORE_PATH, so only these are removed there.
+STORE_FILES = ("vectors.npy", "index.json", "documents.jsonl", "ivf.npz", "quant.npz", "dedup_signatures.npz", "dedup_skipped.json", "access_stats.json")
+# Per-store state that stays valid across generations and moves along with a NumPy store.
+CARRIED_FILES = ("codebase_manifest.json", "crawl_cache.json")
+# Queries that picked up the old collection just before the swap get this long to finish.
+RETIRE_DELAY_S = 60
+
+
+def _throttle(busy_s, cpu_share):
+    if 0 < cpu_share < 1: time.sleep(busy_s * (1 - cpu_share) / cpu_share)
+
+def _versions(collection, skip_code):
+    """doc_id -> ingested_at for every stored document, used to find writes made during the rebuild."""
+    stored = collection.get(include=["metadatas"])
+    metadatas = stored.get("metadatas") or [None] * len(stored["ids"])
+    return {doc_id: (metadata or {}).get("ingested_at") for doc_id, metadata in zip(stored["ids"], metadatas)
+            if not (skip_code and (metadata or {}).get("namespace") == "code")}
+
+def _copy(source, target, embedder, ids, cpu_share):
+    started = time.perf_counter()
+    stored = source.get(ids=ids, include=["documents", "metadatas"])
+    if stored["ids"]:
+        texts = [document or "" for document in stored["documents"]]
+        target.add(ids=stored["ids"], embeddings=embedder.embed(texts).tolist(), documents=texts, metadatas=stored["metadatas"])
+    _throttle(time.perf_counter() - started, cpu_share)
+    return len(stored["ids"])
+
+def _catch_up(source, target, embedder, versions, skip_code, cpu_share):
+    """Replays adds, changes and deletes made to `source` since `versions` was taken; returns the number of documents touched."""
+    current = _versions(source, skip_code)
+    changed = [doc_id for doc_id, version in current.items() if doc_id not in versions or versions[doc_id] != version]
+    removed = [doc_id for doc_id in versions if doc_id not in current]
+    stale = removed + [doc_id for doc_id in changed if doc_id in versions]
+    with rag._deferred_writes(target):
+        if stale: target.delete(ids=stale)
+        for start in range(0, len(changed), RAG_BATCH_SIZE):
+            _copy(source, target, embedder, changed[start:start + RAG_BATCH_SIZE], cpu_share)
+    versions.clear()
+    versions.update(current)
+    return len(changed) + len(removed)
+
+def _open_target(generation):
+    if generation["backend"] == "chroma":
+        _drop(generation)
+        return rag._open_chroma(generation["collection"])
+    shutil.rmtree(generation["path"], ignore_errors=True)
+    return rag._open_numpy(generation["path"])
+
+def _drop(generation):
+    """Deletes a generation's storage. Generation 0 of the NumPy store shares its directory with later ones."""
+    try:
+        if generation["backend"] == "chroma":
+            import chromadb
+            client = chromadb.PersistentClient(path=CHROMA_PATH)
+            if generation["collection"] in [c if isinstance(c, str) else c.name for c in client.list_collections()]:
+                client.delete_collection(generation["collection"])
+        elif os.path.normpath(generation["path"]) == os.path.normpath(RAG_STORE_PATH):
+            for name in STORE_FILES + CARRIED_FILES:
+                path = os.path.join(RAG_STORE_PATH, name)
+                if os.path.exists(path): os.remove(path)
+        else:
+            shutil.rmtree(generation["path"], ignore_errors=True)
+    except Exception as e:
+        logging.warning(f"RAG REINDEX: Could not remove generation {generation['generation']}: {e}")
+
+def _retire(generation, collection):
+    if hasattr(collection, "close"): collection.close()
+    _drop(generation)
+
+@served(timeout=None)
+def reindex(embedder_name=None, rechunk=False, cpu_share=RAG_REINDEX_CPU_SHARE, progress=None, should_cancel=None):
+    """
+    Builds the next generation with `embedder_name` (default: the configured
+    JEMAI_RAG_EMBEDDER) and swaps it in. `progress(processed, total, phase)`
+    and `should_cancel()` follow the ingestion job protocol; a cancelled
+    re-index discards the partial generation.
+    """
+    from .self_modification import codebase_snapshot, save_manifest
+    progress = progress or (lambda processed, total, phase: None)
+    should_cancel = should_cancel or (lambda: False)
+    if not rag.ensure_rag():
+        return {"error": "RAG system unavailable."}
+    started = time.perf_counter()
+    active, source = dict(rag.GENERATION), rag.RAG_COLLECTION
+    embedder_name = embedder_name or RAG_EMBEDDER
+    embedder = rag.EMBEDDER if embedder_name == rag.EMBEDDER.name else get_embedder(embedder_name)
+    embedder.load()
+
+    number = active["generation"] + 1
+    generation = {"backend": active["backend"], "generation": number, "embedder": embedder.name,
+                  "chunk_tokens": RAG_CHUNK_TOKENS, "chunk_overlap": RAG_CHUNK_OVERLAP, "created_at": int(time.time())}
+    if generation["backend"] == "chroma":
+        generation["collection"] = f"{CHROMA_COLLECTION}_g{number}"
+    else:
+        generation["path"] = os.path.join(RAG_STORE_PATH, f"generation_{number}")
+    logging.info(f"RAG REINDEX: Building generation {number} with '{embedder.name}' (from generation {active['generation']}"
+                 f" with '{active['embedder']}'{', re-chunking code' if rechunk else ''}).")
+    target = _open_target(generation)
+    report = {"from": active, "to": generation, "copied": 0, "rechunked": 0, "caught_up": 0, "cancelled": False}
+
+    versions = _versions(source, rechunk)
+    ids = list(versions)
+    code_docs, manifest = codebase_snapshot() if rechunk else ([], None)
+    total = len(ids) + len(code_docs)
+    with rag._deferred_writes(target):
+        for start in range(0, len(ids), RAG_BATCH_SIZE):
+            if should_cancel(): break
+            report["copied"] += _copy(source, target, embedder, ids[start:start + RAG_BATCH_SIZE], cpu_share)
+            progress(report["copied"], total, "embedding")
+        for start in range(0, len(code_docs), RAG_BATCH_SIZE):
+            if should_cancel(): break
+            t0 = time.perf_counter()
+            batch = code_docs[start:start + RAG_BATCH_SIZE]
+            target.add(ids=[doc["id"] for doc in batch], embeddings=embedder.embed([doc["text"] for doc in batch]).tolist(),
+                       documents=[doc["text"] for doc in batch],
+                       metadatas=[rag.document_metadata("code", "codebase", doc["metadata"].get("path"), doc["metadata"]) for doc in batch])
+            report["rechunked"] += len(batch)
+            _throttle(time.perf_counter() - t0, cpu_share)
+            progress(report["copied"] + report["rechunked"], total, "embedding")
+
+    if should_cancel():
+        _drop(generation)
+        report["cancelled"] = True
+        logging.info(f"RAG REINDEX: Generation {number} cancelled and discarded.")
+        return dict(report, elapsed_ms=round((time.perf_counter() - started) * 1000, 1))
+
+    progress(total, total, "catching up")
+    report["caught_up"] += _catch_up(source, target, embedder, versions, rechunk, cpu_share)
+    with rag._write_lock:
+        # Writers wait only for this last, small replay and the swap itself.
+        report["caught_up"] += _catch_up(source, target, embedder, versions, rechunk, 1.0)
+        data_path = CHROMA_PATH if generation["backend"] == "chroma" else generation["path"]
+        if generation["backend"] == "numpy":
+            for name in CARRIED_FILES:
+                if rechunk and name == "codebase_manifest.json": continue
+                if os.path.exists(os.path.join(active["path"], name)):
+                    shutil.copy2(os.path.join(active["path"], name), os.path.join(data_path, name))
+        if rechunk:
+            save_manifest(manifest, data_path)
+        rag.activate_generation(target, embedder, generation)
+    retire = threading.Timer(RETIRE_DELAY_S, _retire, args=(active, source))
+    retire.daemon = True
+    retire.start()
+
+    report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    logging.info(f"RAG REINDEX: Generation {number} active: {report['copied']} copied, {report['rechunked']} re-chunked, "
+                 f"{report['caught_up']} caught up in {report['elapsed_ms']} ms.")
+    return report
+
+def submit_reindex(embedder_name=None, rechunk=False, cpu_share=RAG_REINDEX_CPU_SHARE):
+    """Starts a re-index as an ingestion job; returns (job, created)."""
+    from .ingest_jobs import INGEST_JOBS
+    return INGEST_JOBS.submit(
+        "reindex", lambda job: reindex(embedder_name, rechunk, cpu_share, progress=job.progress, should_cancel=job.cancel_requested),
+        description=f"Re-index with {embedder_name or RAG_EMBEDDER}" + (" (re-chunking code)" if rechunk else ""))
+
+@served()
+def reindex_status():
+    """The active generation, the configured embedder and the latest re-index job with its progress and ETA."""
+    from .ingest_jobs import INGEST_JOBS
+    job = INGEST_JOBS.latest("reindex")
+    return {"active": rag.GENERATION, "configured_embedder": RAG_EMBEDDER,
+            "needs_reindex": rag.GENERATION is not None and rag.GENERATION["embedder"] != RAG_EMBEDDER,
+            "job": job.to_dict() if job else None}
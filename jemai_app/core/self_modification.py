@@ -1,29 +1,176 @@
 ﻿import os
+import json
+import time
+import hashlib
 import logging
-from .rag import rag_add_text
-from ..config import JEMAI_HUB
+from .rag import rag_add_texts, rag_delete, rag_available, rag_data_path
+from .chunking import chunk_document
+from ..config import JEMAI_HUB, RAG_BATCH_SIZE
 
-IGNORE_PATTERNS = ['__pycache__', '.git', 'venv', 'chroma_db', 'versions']
+IGNORE_PATTERNS = ['__pycache__', '.git', 'venv', 'chroma_db', 'rag_store', 'versions']
 
-def ingest_codebase():
-    logging.info("SELF-AWARENESS: Starting codebase ingestion into RAG.")
-    ingested_count = 0
+INGEST_EXTENSIONS = ('.py', '.html', '.js', '.css', '.md')
+# Bumped whenever the stored chunk layout or metadata changes, to force a full re-ingest.
+MANIFEST_FORMAT = 2
+MANIFEST_FILENAME = "codebase_manifest.json"
+
+def _manifest_path():
+    # Kept alongside the active store so a backend switch triggers a full re-ingest. A sync has loaded the RAG
+    # already, and a dry run must not wait for the embedding model just to find the manifest.
+    return os.path.join(rag_data_path(load=False), MANIFEST_FILENAME)
+
+def _load_manifest():
+    try:
+        with open(_manifest_path(), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logging.warning(f"SELF-AWARENESS: Could not read ingest manifest, starting fresh: {e}")
+        return {}
+    if data.get("format") == MANIFEST_FORMAT:
+        return data["files"]
+    # Older manifest: keep the chunk IDs so they get deleted, but force every file to be re-ingested.
+    files = data.get("files", data)
+    return {path: dict(entry, size=None, sha256=None) for path, entry in files.items()}
+
+def _iter_codebase_files():
     for root, dirs, files in os.walk(JEMAI_HUB):
         dirs[:] = [d for d in dirs if d not in IGNORE_PATTERNS]
         for file in files:
-            if file.endswith(('.py', '.html', '.js', '.css', '.md')):
+            if file.endswith(INGEST_EXTENSIONS):
                 file_path = os.path.join(root, file)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    relative_path = os.path.relpath(file_path, JEMAI_HUB)
-                    doc_id = f"codebase_{relative_path}"
-                    rag_add_text(f"--- FILE: {relative_path} ---\n\n{content}", doc_id=doc_id)
-                    ingested_count += 1
-                except Exception as e:
-                    logging.warning(f"Could not ingest file {file_path}: {e}")
-    logging.info(f"SELF-AWARENESS: Ingestion complete. Added {ingested_count} files to knowledge base.")
-    return ingested_count
+                yield os.path.relpath(file_path, JEMAI_HUB).replace(os.sep, '/'), file_path
+
+def _file_documents(relative_path, content):
+    docs, chunk_ids = [], set()
+    for chunk in chunk_document(content, relative_path):
+        meta = chunk["metadata"]
+        chunk_id = f"codebase_{relative_path}#{meta['start_line']}-{meta['end_line']}"
+        if chunk_id in chunk_ids: continue
+        chunk_ids.add(chunk_id)
+        docs.append({"text": chunk["text"], "id": chunk_id, "metadata": meta})
+    return docs
+
+def codebase_snapshot():
+    """
+    Chunks every codebase file with the current chunking settings, for a
+    full rebuild into a new index. Returns (docs, manifest); the manifest
+    is saved with save_manifest once that index becomes active.
+    """
+    docs, manifest = [], {}
+    for relative_path, file_path in _iter_codebase_files():
+        try:
+            st = os.stat(file_path)
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except Exception as e:
+            logging.warning(f"Could not ingest file {file_path}: {e}")
+            continue
+        file_docs = _file_documents(relative_path, content)
+        docs.extend(file_docs)
+        manifest[relative_path] = {"size": st.st_size, "mtime": st.st_mtime, "sha256": hashlib.sha256(content.encode('utf-8')).hexdigest(),
+                                   "chunk_ids": [doc["id"] for doc in file_docs]}
+    return docs, manifest
+
+def save_manifest(manifest, data_path=None):
+    """Writes the ingest manifest, by default next to the active store."""
+    path = os.path.join(data_path, MANIFEST_FILENAME) if data_path else _manifest_path()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"format": MANIFEST_FORMAT, "files": manifest}, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def ingest_codebase(dry_run=False, progress=None, should_cancel=None):
+    """
+    Incrementally syncs the codebase into the RAG using a manifest of
+    path -> size, mtime, content hash and chunk IDs. Unchanged files are
+    skipped on size/mtime alone, changed files are re-embedded and chunks of
+    deleted files are removed. With `dry_run` nothing is read into or removed
+    from the RAG; the report lists what would be done.
+
+    `progress(processed, total, phase)` is called as files are scanned and
+    embedded; when `should_cancel()` returns True the sync stops between
+    batches, keeping what was already embedded so the next run resumes.
+    """
+    if not dry_run and not rag_available():
+        logging.warning("SELF-AWARENESS: RAG is unavailable, skipping codebase sync.")
+        return {"error": "RAG system unavailable.", "dry_run": dry_run}
+    progress = progress or (lambda processed, total, phase: None)
+    should_cancel = should_cancel or (lambda: False)
+    started = time.perf_counter()
+    logging.info(f"SELF-AWARENESS: Starting codebase sync into RAG{' (dry run)' if dry_run else ''}.")
+    manifest = _load_manifest()
+    new_manifest = {}
+    report = {"added": [], "changed": [], "removed": [], "unchanged": 0, "failed": [], "dry_run": dry_run, "cancelled": False}
+    pending, stale_ids = [], []
+
+    files = list(_iter_codebase_files())
+    for scanned, (relative_path, file_path) in enumerate(files, start=1):
+        progress(scanned, len(files), "scanning")
+        entry = manifest.get(relative_path)
+        try:
+            st = os.stat(file_path)
+            if entry and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+                new_manifest[relative_path] = entry
+                report["unchanged"] += 1
+                continue
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except Exception as e:
+            logging.warning(f"Could not ingest file {file_path}: {e}")
+            report["failed"].append(relative_path)
+            if entry: new_manifest[relative_path] = entry
+            continue
+
+        digest = hashlib.sha256(content.encode('utf-8')).hexdigest()
+        if entry and entry["sha256"] == digest:
+            new_manifest[relative_path] = dict(entry, size=st.st_size, mtime=st.st_mtime)
+            report["unchanged"] += 1
+            continue
+
+        docs = _file_documents(relative_path, content)
+        chunk_ids = [doc["id"] for doc in docs]
+        report["changed" if entry else "added"].append(relative_path)
+        # Files ingested before chunking was introduced were stored whole under the bare path ID.
+        stale_ids.extend(entry["chunk_ids"] if entry else [f"codebase_{relative_path}"])
+        new_manifest[relative_path] = {"size": st.st_size, "mtime": st.st_mtime, "sha256": digest, "chunk_ids": chunk_ids}
+        pending.append((relative_path, docs))
+
+    for relative_path, entry in manifest.items():
+        if relative_path not in new_manifest:
+            report["removed"].append(relative_path)
+            stale_ids.extend(entry["chunk_ids"])
+
+    if not dry_run:
+        rag_delete(stale_ids)
+        done = 0
+        while done < len(pending):
+            if should_cancel():
+                # Unfinished files stay out of the manifest; their old chunks are gone, so the next run adds them.
+                for relative_path, _ in pending[done:]:
+                    new_manifest.pop(relative_path, None)
+                report["cancelled"] = True
+                break
+            group, group_docs = [], []
+            while done < len(pending) and (not group_docs or len(group_docs) < RAG_BATCH_SIZE):
+                group.append(pending[done][0])
+                group_docs.extend(pending[done][1])
+                done += 1
+            stats = rag_add_texts(group_docs, namespace="code", source="codebase")
+            # Leave failed files out of the manifest so the next run retries them.
+            for doc_id in stats["failed_ids"]:
+                new_manifest.pop(doc_id[len("codebase_"):].rsplit("#", 1)[0], None)
+            progress(done, len(pending), "embedding")
+        save_manifest(new_manifest)
+
+    report["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    logging.info(
+        f"SELF-AWARENESS: Sync {'cancelled' if report['cancelled'] else 'complete'}{' (dry run)' if dry_run else ''}. "
+        f"{len(report['added'])} added, {len(report['changed'])} changed, {len(report['removed'])} removed, "
+        f"{report['unchanged']} unchanged in {report['elapsed_ms']} ms."
+    )
+    return report
 
 def write_file_content(relative_path, content):
     if ".." in relative_path:
@@ -0,0 +1,73 @@
+"""
+Shard worker process for shards.py. ShardPool runs this file by path rather
+than as part of the package, so a worker imports numpy (and threadpoolctl
+when installed) and nothing else: not the web app, the LLM providers or the
+models. It connects back to the pool's listener, then answers search and
+release requests until told to stop.
+"""
+import os
+import sys
+
+if __name__ == "__main__":
+    # sys.path[0] is this package directory; its modules must not shadow the standard library.
+    sys.path[:] = [p for p in sys.path if os.path.abspath(p or os.curdir) != os.path.dirname(os.path.abspath(__file__))]
+
+import numpy as np
+from multiprocessing.connection import Client
+
+try:
+    from threadpoolctl import threadpool_limits
+    HAS_THREADPOOLCTL = True
+except ImportError:
+    HAS_THREADPOOLCTL = False
+
+
+def top_k(scores, k):
+    """Row-wise top-k of a (queries, rows) score matrix; returns (indexes, scores), best first."""
+    k = min(k, scores.shape[1])
+    if k <= 0: return np.empty((scores.shape[0], 0), dtype=np.int64), scores[:, :0]
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+def serve(conn, path, index, shards):
+    """
+    Maps the store's vectors.npy read-only (the pages are shared with the
+    parent and the other workers through the OS page cache) and scans rows
+    [count * index / shards, count * (index + 1) / shards).
+    """
+    if HAS_THREADPOOLCTL: threadpool_limits(1)
+    matrix, version = None, None
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None: return
+        if message[0] == "release":
+            matrix = None
+            conn.send(("ok",))
+            continue
+        _, queries, count, k, file_version = message
+        try:
+            if matrix is None or version != file_version:
+                matrix, version = np.load(path, mmap_mode="r"), file_version
+            lo, hi = count * index // shards, count * (index + 1) // shards
+            rows, scores = top_k(queries @ matrix[lo:hi].T, k)
+            conn.send(("ok", rows + lo, scores))
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+def main(argv):
+    address, index, shards, path = argv[0], int(argv[1]), int(argv[2]), argv[3]
+    authkey = bytes.fromhex(sys.stdin.readline().strip())
+    try:
+        conn = Client(address, authkey=authkey)
+    except OSError:
+        return  # the pool was closed before this worker got to connect
+    conn.send(index)
+    serve(conn, path, index, shards)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,108 @@
+import os
+import sys
+import atexit
+import time
+import logging
+import threading
+import subprocess
+from multiprocessing.connection import Listener
+import numpy as np
+from .shard_worker import top_k as _top_k, HAS_THREADPOOLCTL
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shard_worker.py")
+# How long a search waits for workers that are still starting before it gives up.
+READY_TIMEOUT = 30
+
+
+class ShardPool:
+    """
+    Scatter-gather exact search over N worker processes (shard_worker.py).
+    Every query batch goes to all workers, each returns the top-k of its
+    row range, and the partial results are merged here. Workers re-map the
+    vectors file when `file_version` changes; `release` makes them drop
+    their mapping before the owner replaces the file (required on Windows).
+
+    Workers are started in the background: `ready` is set once all of them
+    have connected, and owners scan in-process until then rather than make
+    a query wait for process start-up. One scatter batch runs at a time, so
+    the pool cuts the latency of a large scan and the cost per query of a
+    batch, but concurrent callers still queue for it.
+    """
+
+    def __init__(self, path, shards):
+        self.path, self.shards = path, shards
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.workers = []
+        authkey = os.urandom(32)
+        self.listener = Listener(authkey=authkey)
+        self.processes = []
+        for index in range(shards):
+            process = subprocess.Popen([sys.executable, WORKER_SCRIPT, str(self.listener.address), str(index), str(shards), path],
+                                       stdin=subprocess.PIPE, creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0))
+            process.stdin.write((authkey.hex() + "\n").encode("ascii"))
+            process.stdin.close()
+            self.processes.append(process)
+        threading.Thread(target=self._accept, daemon=True, name="RAGShardAccept").start()
+        atexit.register(self.close)
+
+    def _accept(self):
+        started = time.perf_counter()
+        connections = {}
+        try:
+            while len(connections) < self.shards:
+                conn = self.listener.accept()
+                connections[conn.recv()] = conn
+        except (OSError, EOFError) as e:
+            if self.processes: logging.error(f"RAG: Shard workers for {self.path} failed to connect: {e}")
+            return
+        with self.lock:
+            if not self.processes: return
+            self.workers = [connections[index] for index in range(self.shards)]
+            self.ready.set()
+        logging.info(f"RAG: {self.shards} search shard workers for {self.path} ready in {(time.perf_counter() - started) * 1000:.0f} ms.")
+
+    def _gather(self):
+        replies = [conn.recv() for conn in self.workers]
+        errors = [reply[1] for reply in replies if reply[0] == "error"]
+        if errors: raise RuntimeError(f"Shard search failed: {errors[0]}")
+        return replies
+
+    def search(self, queries, count, k, file_version):
+        """Top-k rows and scores over the first `count` rows for each query in `queries` (already normalized)."""
+        if not self.ready.wait(READY_TIMEOUT): raise RuntimeError("Shard workers did not start")
+        queries = np.ascontiguousarray(queries, dtype=np.float32)
+        with self.lock:
+            for conn in self.workers:
+                conn.send(("search", queries, count, k, file_version))
+            replies = self._gather()
+        rows = np.concatenate([reply[1] for reply in replies], axis=1)
+        scores = np.concatenate([reply[2] for reply in replies], axis=1)
+        top, top_scores = _top_k(scores, k)
+        return np.take_along_axis(rows, top, axis=1), top_scores
+
+    def release(self):
+        with self.lock:
+            # Workers map the file on their first search, which waits for all of them to connect.
+            if not self.workers: return
+            for conn in self.workers:
+                conn.send(("release",))
+            self._gather()
+
+    def close(self):
+        with self.lock:
+            self.ready.clear()
+            processes, self.processes = self.processes, []
+            for conn in self.workers:
+                try:
+                    conn.send(None)
+                    conn.close()
+                except Exception:
+                    pass
+            self.workers = []
+        self.listener.close()
+        for process in processes:
+            try:
+                process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                process.terminate()
@@ -0,0 +1,457 @@
+import os
+import json
+import logging
+import threading
+from contextlib import contextmanager
+import numpy as np
+from .ann_index import IVFIndex
+from .quantization import QUANTIZERS
+from .metadata_index import MetadataIndex
+from .shards import ShardPool
+
+INITIAL_CAPACITY = 1024
+
+
+def _normalize(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1: matrix = matrix[None, :]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class NumpyVectorStore:
+    """
+    Dependency-free vector store with the subset of the Chroma collection API
+    used by rag.py (add / get / query / delete / count).
+
+    Embeddings are L2-normalized float32 rows of a memory-mapped `vectors.npy`
+    (grown by doubling), so only the pages touched by a query are resident.
+    Documents and metadata are appended to `documents.jsonl` and read back
+    on demand; the `index.json` sidecar holds the IDs and each row's offset
+    in that log. Deletes move the last row into the freed slot to keep the
+    matrix dense. `where` filters are resolved through an in-memory
+    MetadataIndex before scoring.
+
+    The sidecar and the index files below are rewritten after every add or
+    delete, or once at the end of a `batch()` block. Each carries the
+    store's version, so index files left behind by a crash are rebuilt.
+    A delete records its row moves in the sidecar before making them, and
+    an interrupted one is finished on the next open.
+
+    With `ann="ivf"`, stores of at least `ann_min_rows` rows answer
+    unfiltered queries through an IVF index (persisted as `ivf.npz`) instead
+    of an exact scan; the index is retrained when the store has grown 4x.
+
+    With `quantization` set to "int8" or "binary", other unfiltered queries
+    scan compressed codes (persisted as `quant.npz`) and re-score the best
+    `k * rerank` candidates against the float matrix.
+
+    With `shards` > 1, remaining unfiltered exact scans of stores with at
+    least `shard_min_rows` rows are split across that many worker processes
+    that map vectors.npy themselves (see shards.py). The workers are started
+    as soon as the store reaches that size, and scans stay in-process until
+    they are ready.
+    """
+
+    def __init__(self, path, ann="none", ann_nlist=0, ann_nprobe=8, ann_min_rows=5000, quantization="none", rerank=4,
+                 shards=0, shard_min_rows=50000):
+        self.path = path
+        self.vectors_path = os.path.join(path, "vectors.npy")
+        self.sidecar_path = os.path.join(path, "index.json")
+        self.docs_path = os.path.join(path, "documents.jsonl")
+        self.ann_path = os.path.join(path, "ivf.npz")
+        self.ann_kind, self.ann_nlist, self.ann_nprobe, self.ann_min_rows = ann, ann_nlist, ann_nprobe, ann_min_rows
+        self.ann = None
+        self.quant_path = os.path.join(path, "quant.npz")
+        self.quant_mode, self.rerank, self.quant = quantization, rerank, None
+        self.shards, self.shard_min_rows, self.shard_pool = shards, shard_min_rows, None
+        # Bumped whenever vectors.npy is replaced, so shard workers know to re-map it.
+        self.file_version = 0
+        self.lock = threading.RLock()
+        # Open batch() blocks, and whether the files on disk are behind the in-memory state.
+        self.deferred, self.dirty = 0, False
+        # Bumped by every add and delete; saved with the sidecar and the index files.
+        self.version = 0
+        os.makedirs(path, exist_ok=True)
+        self.ids, self.offsets = [], []
+        self.dim, self.vectors = None, None
+        sidecar = {}
+        if os.path.exists(self.sidecar_path):
+            with open(self.sidecar_path, 'r', encoding='utf-8') as f:
+                sidecar = json.load(f)
+            self.dim, self.ids, self.version = sidecar["dim"], sidecar["ids"], sidecar.get("version", 0)
+            if self.dim is not None:
+                self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+                if self.vectors.shape[0] < len(self.ids) or self.vectors.shape[1] != self.dim:
+                    raise ValueError(f"{self.vectors_path} has {self.vectors.shape[0]} rows of {self.vectors.shape[1]} "
+                                     f"but {self.sidecar_path} lists {len(self.ids)} of {self.dim}")
+            if sidecar.get("moves"):
+                # A delete stopped between recording its row moves and making them; the moved-from rows are still intact.
+                for source, target in sidecar["moves"]:
+                    self.vectors[target] = self.vectors[source]
+                self.vectors.flush()
+                self.dirty = True
+        if sidecar.get("compacting") and os.path.exists(self.docs_path + ".tmp"):
+            os.replace(self.docs_path + ".tmp", self.docs_path)
+        if sidecar.get("docs_bytes", 0) > (os.path.getsize(self.docs_path) if os.path.exists(self.docs_path) else 0):
+            raise ValueError(f"{self.docs_path} is shorter than {self.sidecar_path} expects")
+        # Records appended after the last sidecar write belong to no row.
+        with open(self.docs_path, "ab") as f:
+            f.truncate(sidecar.get("docs_bytes", 0))
+        if "documents" in sidecar:
+            # Older stores kept every document in the sidecar itself.
+            self.offsets = self._append_records(self.ids, sidecar["documents"], sidecar["metadatas"])
+            self.dirty = True
+        else:
+            self.offsets = sidecar.get("offsets", [])
+        self.positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self.meta_index = MetadataIndex()
+        for doc_id, _, metadata in self._records(range(len(self.ids))):
+            self.meta_index.add(doc_id, metadata)
+        if self.ann_kind == "ivf" and os.path.exists(self.ann_path):
+            try:
+                self.ann = IVFIndex.load(self.ann_path)
+                self.ann.nprobe = ann_nprobe
+                if len(self.ann.assign) != len(self.ids) or self.ann.version != self.version: self.ann = None
+            except Exception as e:
+                logging.warning(f"RAG: Could not load IVF index, it will be rebuilt: {e}")
+                self.ann = None
+        self._maintain_ann()
+        if self.dim is not None: self._open_quantizer()
+        self.flush()
+        self._start_shards()
+        logging.info(f"RAG: NumPy vector store opened at {path} with {len(self.ids)} documents.")
+
+    def count(self):
+        return len(self.ids)
+
+    def _append_records(self, ids, documents, metadatas):
+        """Appends one JSON line per document to documents.jsonl; returns their byte offsets."""
+        offsets, lines = [], []
+        with open(self.docs_path, "ab") as f:
+            position = f.seek(0, os.SEEK_END)
+            for record in zip(ids, documents, metadatas):
+                line = json.dumps(record).encode("utf-8") + b"\n"
+                offsets.append(position)
+                lines.append(line)
+                position += len(line)
+            f.write(b"".join(lines))
+        return offsets
+
+    def _records(self, rows):
+        """Yields (id, document, metadata) for each row from documents.jsonl."""
+        with open(self.docs_path, "rb") as f:
+            for row in rows:
+                f.seek(self.offsets[row])
+                yield json.loads(f.readline())
+
+    def _save_sidecar(self, **extra):
+        tmp_path = self.sidecar_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict({"dim": self.dim, "ids": self.ids, "offsets": self.offsets, "docs_bytes": os.path.getsize(self.docs_path),
+                            "version": self.version}, **extra), f)
+        os.replace(tmp_path, self.sidecar_path)
+
+    def flush(self):
+        """Writes the sidecar, IVF index and quantized codes if they are behind the in-memory state."""
+        with self.lock:
+            if not self.dirty: return
+            if self.ann is not None: self.ann.save(self.ann_path, self.version)
+            if self.quant is not None: self.quant.save(self.quant_path, self.version)
+            self._save_sidecar()
+            self.dirty = False
+
+    def _changed(self):
+        self.dirty = True
+        if not self.deferred: self.flush()
+
+    @contextmanager
+    def batch(self):
+        """Defers the sidecar and index writes of the adds and deletes in the block to its end."""
+        with self.lock:
+            self.deferred += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.deferred -= 1
+                if not self.deferred: self.flush()
+
+    def _maintain_ann(self):
+        """(Re)trains the IVF index once the store is large enough, or has outgrown the last training."""
+        if self.ann_kind != "ivf": return
+        count = len(self.ids)
+        if count < max(self.ann_min_rows, 1):
+            self.ann = None
+            return
+        if self.ann is None or count >= 4 * self.ann.trained_rows:
+            self.ann = IVFIndex(self.ann_nlist, self.ann_nprobe)
+            self.ann.train(self.vectors[:count])
+            self.dirty = True
+
+    def _open_quantizer(self):
+        if self.quant_mode not in QUANTIZERS: return
+        cls = QUANTIZERS[self.quant_mode]
+        if os.path.exists(self.quant_path):
+            try:
+                self.quant = cls.load(self.quant_path, self.dim)
+                if self.quant.codes.shape[0] == len(self.ids) and self.quant.version == self.version: return
+            except Exception as e:
+                logging.warning(f"RAG: Could not load {self.quant_mode} codes, they will be rebuilt: {e}")
+        self._rebuild_quantizer()
+        self.dirty = True
+
+    def _rebuild_quantizer(self, block=65536):
+        """Encodes every stored row afresh, with parameters fitted to all of them."""
+        count = len(self.ids)
+        self.quant = QUANTIZERS[self.quant_mode](self.dim)
+        if not count: return
+        peak = np.zeros(self.dim, dtype=np.float32)
+        for start in range(0, count, block):
+            peak = np.maximum(peak, np.abs(self.vectors[start:min(start + block, count)]).max(axis=0))
+        self.quant.fit(peak[None, :])
+        for start in range(0, count, block):
+            self.quant.add(self.vectors[start:min(start + block, count)])
+
+    def quant_report(self, k=10, queries=100, seed=0):
+        """Memory saving and recall@k of the quantized first pass against exact search, per re-rank factor."""
+        with self.lock:
+            if self.quant is None or not self.ids: return None
+            count = len(self.ids)
+            rng = np.random.default_rng(seed)
+            sample = np.asarray(self.vectors[np.sort(rng.choice(count, size=min(queries, count), replace=False))])
+            return self.quant.evaluate(self.vectors[:count], sample, k=k)
+
+    def ann_report(self, k=10, queries=100, seed=0):
+        """Recall@k of the IVF index against exact search for a range of nprobe values, using stored vectors as queries."""
+        with self.lock:
+            if self.ann is None: return None
+            count = len(self.ids)
+            rng = np.random.default_rng(seed)
+            sample = np.asarray(self.vectors[np.sort(rng.choice(count, size=min(queries, count), replace=False))])
+            return self.ann.evaluate(self.vectors[:count], sample, k=k)
+
+    def disk_bytes(self):
+        return sum(os.path.getsize(os.path.join(self.path, name)) for name in os.listdir(self.path)
+                   if os.path.isfile(os.path.join(self.path, name)))
+
+    def vacuum(self):
+        """
+        Reclaims space after deletes: shrinks vectors.npy to the live rows,
+        drops deleted records from documents.jsonl, retrains the IVF index
+        and re-encodes the quantized codes from scratch, and rewrites the
+        sidecar. Returns disk bytes before/after.
+        """
+        with self.lock:
+            before = self.disk_bytes()
+            count = len(self.ids)
+            if self.vectors is not None and self.vectors.shape[0] > max(INITIAL_CAPACITY, count):
+                tmp_path = self.vectors_path + ".tmp.npy"
+                shrunk = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(max(INITIAL_CAPACITY, count), self.dim))
+                shrunk[:count] = self.vectors[:count]
+                shrunk.flush()
+                del shrunk
+                self.vectors = None
+                if self.shard_pool is not None: self.shard_pool.release()
+                self.file_version += 1
+                os.replace(tmp_path, self.vectors_path)
+                self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+            self._compact_records()
+            if self.ann is not None:
+                self.ann = None
+                self._maintain_ann()
+            if self.quant is not None:
+                self.quant = None
+                os.remove(self.quant_path)
+                self._open_quantizer()
+            self.dirty = True
+            self.flush()
+            return {"bytes_before": before, "bytes_after": self.disk_bytes()}
+
+    def _compact_records(self):
+        """
+        Rewrites documents.jsonl with only the live rows, in row order. The
+        sidecar marks the swap as pending until it is done, so a crash in
+        between is finished on the next open.
+        """
+        tmp_path = self.docs_path + ".tmp"
+        with open(self.docs_path, "rb") as source, open(tmp_path, "wb") as f:
+            offsets = []
+            for offset in self.offsets:
+                source.seek(offset)
+                offsets.append(f.tell())
+                f.write(source.readline())
+        old_offsets, self.offsets = self.offsets, offsets
+        try:
+            self._save_sidecar(docs_bytes=os.path.getsize(tmp_path), compacting=True)
+        except Exception:
+            self.offsets = old_offsets
+            raise
+        os.replace(tmp_path, self.docs_path)
+        self._save_sidecar()
+
+    def _reserve(self, rows):
+        needed = len(self.ids) + rows
+        capacity = 0 if self.vectors is None else self.vectors.shape[0]
+        if needed <= capacity: return
+        new_capacity = max(INITIAL_CAPACITY, capacity)
+        while new_capacity < needed: new_capacity *= 2
+        tmp_path = self.vectors_path + ".tmp.npy"
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(new_capacity, self.dim))
+        if self.vectors is not None:
+            grown[:len(self.ids)] = self.vectors[:len(self.ids)]
+        grown.flush()
+        # The old mappings (ours and the shard workers') must be closed before the file can be replaced on Windows.
+        del grown
+        self.vectors = None
+        if self.shard_pool is not None: self.shard_pool.release()
+        self.file_version += 1
+        os.replace(tmp_path, self.vectors_path)
+        self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+
+    def add(self, ids, embeddings, documents=None, metadatas=None):
+        matrix = _normalize(embeddings)
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+        with self.lock:
+            if self.dim is None:
+                self.dim = matrix.shape[1]
+                self._open_quantizer()
+            if matrix.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {matrix.shape[1]} does not match store dimension {self.dim}")
+            keep = [i for i, doc_id in enumerate(ids) if doc_id not in self.positions]
+            if not keep: return
+            self.version += 1
+            self._reserve(len(keep))
+            start = len(self.ids)
+            self.vectors[start:start + len(keep)] = matrix[keep]
+            self.vectors.flush()
+            self.offsets.extend(self._append_records([ids[i] for i in keep], [documents[i] for i in keep], [metadatas[i] for i in keep]))
+            for offset, i in enumerate(keep):
+                self.positions[ids[i]] = start + offset
+                self.ids.append(ids[i])
+                self.meta_index.add(ids[i], metadatas[i])
+            if self.ann is not None: self.ann.add(matrix[keep])
+            self._maintain_ann()
+            self._start_shards()
+            if self.quant is not None:
+                if self.quant.fits(matrix[keep]):
+                    self.quant.add(matrix[keep])
+                else:
+                    self._rebuild_quantizer()
+                    logging.info(f"RAG: Re-encoded {len(self.ids)} {self.quant_mode} codes for a wider value range.")
+            self._changed()
+
+    def _rows(self, ids=None, where=None):
+        if where:
+            matching = self.meta_index.match(where)
+            ids = sorted(matching, key=self.positions.get) if ids is None else [doc_id for doc_id in ids if doc_id in matching]
+        if ids is None: return list(range(len(self.ids)))
+        return [self.positions[doc_id] for doc_id in ids if doc_id in self.positions]
+
+    def get(self, ids=None, where=None, include=("documents", "metadatas")):
+        with self.lock:
+            rows = self._rows(ids, where)
+            result = {"ids": [self.ids[row] for row in rows]}
+            if "documents" in include or "metadatas" in include:
+                records = list(self._records(rows))
+                if "documents" in include: result["documents"] = [document for _, document, _ in records]
+                if "metadatas" in include: result["metadatas"] = [metadata for _, _, metadata in records]
+            if "embeddings" in include: result["embeddings"] = np.array(self.vectors[rows]) if rows else np.empty((0, self.dim or 0), np.float32)
+            return result
+
+    def query(self, query_embeddings, n_results=10, where=None, include=("documents", "metadatas", "distances")):
+        queries = _normalize(query_embeddings)
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        with self.lock:
+            count = len(self.ids)
+            if not count:
+                for key in result: result[key] = [[] for _ in queries]
+                return result
+            if self.ann is not None and not where:
+                for query in queries:
+                    rows, top_scores = self.ann.search(self.vectors[:count], query, n_results)
+                    self._append_result(result, rows, top_scores)
+                return result
+            if self.quant is not None and not where:
+                for query in queries:
+                    rows, top_scores = self.quant.search(self.vectors[:count], query, n_results, self.rerank)
+                    self._append_result(result, rows, top_scores)
+                return result
+            if not where and self._use_shards(count):
+                try:
+                    rows, top_scores = self.shard_pool.search(queries, count, n_results, self.file_version)
+                    for query_rows, query_scores in zip(rows, top_scores):
+                        self._append_result(result, query_rows, query_scores)
+                    return result
+                except (OSError, EOFError, RuntimeError) as e:
+                    logging.error(f"RAG: Shard search failed ({e}); scanning in-process from now on.")
+                    self.close()
+                    self.shards = 0
+            candidates = None if not where else np.array(self._rows(where=where), dtype=np.int64)
+            matrix = self.vectors[:count] if candidates is None else self.vectors[candidates]
+            scores = queries @ matrix.T
+            k = min(n_results, scores.shape[1])
+            for row_scores in scores:
+                if k == 0:
+                    rows, top_scores = np.empty(0, dtype=np.int64), row_scores[:0]
+                else:
+                    top = np.argpartition(-row_scores, k - 1)[:k]
+                    top = top[np.argsort(-row_scores[top])]
+                    rows = top if candidates is None else candidates[top]
+                    top_scores = row_scores[top]
+                self._append_result(result, rows, top_scores)
+        return result
+
+    def _start_shards(self):
+        if self.shards < 2 or self.shard_pool is not None or len(self.ids) < max(self.shard_min_rows, 1): return
+        self.vectors.flush()
+        self.shard_pool = ShardPool(self.vectors_path, self.shards)
+
+    def _use_shards(self, count):
+        if self.shards < 2 or count < max(self.shard_min_rows, 1): return False
+        self._start_shards()
+        return self.shard_pool.ready.is_set()
+
+    def close(self):
+        if self.shard_pool is not None:
+            self.shard_pool.close()
+            self.shard_pool = None
+
+    def _append_result(self, result, rows, scores):
+        records = list(self._records(rows))
+        result["ids"].append([self.ids[row] for row in rows])
+        result["documents"].append([document for _, document, _ in records])
+        result["metadatas"].append([metadata for _, _, metadata in records])
+        result["distances"].append((1.0 - scores).tolist())
+
+    def delete(self, ids=None, where=None):
+        with self.lock:
+            rows = sorted(self._rows(ids, where), reverse=True)
+            if not rows: return
+            moves = []
+            for row in rows:
+                last = len(self.ids) - 1
+                del self.positions[self.ids[row]]
+                self.meta_index.remove(self.ids[row])
+                if row != last:
+                    moves.append((last, row))
+                    if self.ann is not None: self.ann.move(last, row)
+                    if self.quant is not None: self.quant.move(last, row)
+                    self.ids[row], self.offsets[row] = self.ids[last], self.offsets[last]
+                    self.positions[self.ids[row]] = row
+                self.ids.pop()
+                self.offsets.pop()
+            self.version += 1
+            # vectors.npy is only rewritten once the sidecar describes the result and the moves to redo after a crash.
+            self._save_sidecar(moves=moves)
+            for source, target in moves:
+                self.vectors[target] = self.vectors[source]
+            self.vectors.flush()
+            if self.ann is not None: self.ann.truncate(len(self.ids))
+            self._maintain_ann()
+            if self.quant is not None: self.quant.truncate(len(self.ids))
+            # Later adds reuse the moved-from rows, so the moves must not be redone after that.
+            if moves and self.deferred: self._save_sidecar()
+            self._changed()
@@ -1,4 +1,6 @@
 ﻿import os
+import re
+import queue
 import logging
 import threading
 import time
@@ -65,3 +67,72 @@ def speak(text):
             engine.runAndWait()
         except Exception as e:
             logging.error(f"pyttsx3 fallback failed: {e}")
+
+
+# A sentence ends at ., ! or ? (optionally closed by a quote or bracket) followed by whitespace, or at a blank line.
+SENTENCE_END_RE = re.compile(r"[.!?]+[\"')\]]*\s+|\n\s*\n")
+CODE_FENCE = "```"
+
+class SentenceSpeaker:
+    """
+    Speaks a streamed reply as it arrives: `feed` text deltas and every
+    complete sentence is queued to one speaking thread, so speech starts
+    with the first sentence instead of the whole reply. Fenced code blocks
+    and replies that start as a JSON tool call are not spoken. `close`
+    speaks what is left; `discard` drops it.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.in_code = False
+        self.skip = False
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def _say(self, text):
+        text = text.strip()
+        if not text: return
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True, name="SentenceSpeaker")
+            self.thread.start()
+        self.queue.put(text)
+
+    def _run(self):
+        while True:
+            sentence = self.queue.get()
+            if sentence is None: return
+            speak(sentence)
+
+    def feed(self, delta):
+        if self.skip: return
+        self.buffer += delta
+        if not self.buffer.strip(): return
+        if self.buffer.lstrip().startswith("{"):
+            self.skip = True
+            return
+        while True:
+            fence = self.buffer.find(CODE_FENCE)
+            if self.in_code:
+                if fence < 0: return
+                self.buffer, self.in_code = self.buffer[fence + len(CODE_FENCE):], False
+                continue
+            text = self.buffer if fence < 0 else self.buffer[:fence]
+            ends = [match.end() for match in SENTENCE_END_RE.finditer(text)]
+            start = 0
+            for end in ends:
+                self._say(text[start:end])
+                start = end
+            if fence < 0:
+                self.buffer = self.buffer[start:]
+                return
+            # Text cut off by a code block is spoken as it stands.
+            self._say(text[start:])
+            self.buffer, self.in_code = self.buffer[fence + len(CODE_FENCE):], True
+
+    def close(self):
+        if not (self.skip or self.in_code): self._say(self.buffer)
+        self.discard()
+
+    def discard(self):
+        self.buffer = ""
+        if self.thread is not None: self.queue.put(None)
@@ -1,23 +1,22 @@
 ﻿import os
+import json
+import hashlib
 import logging
 from flask import jsonify, render_template, request
 from .. import app, socketio
-from ..config import JEMAI_HUB, VERSIONS_DIR, SYSTEM_PROMPT
+from ..config import JEMAI_HUB, VERSIONS_DIR, SYSTEM_PROMPT, RAG_CRAWL_MAX_PAGES, RAG_REINDEX_CPU_SHARE
 from ..core.tools import PLUGIN_FUNCS
-from ..core.rag import rag_search, rag_add_text
-from ..core.ai import call_llm
+from ..core.rag import rag_context, route_query, rag_available, rag_status, start_warmup, rag_cache_stats, rag_ann_report, rag_quant_report, rag_dedup_stats
+from ..core.ai import call_llm, LLM_TIMINGS, RESPONSE_CACHE, SEMANTIC_CACHE
+from ..core.llm_providers import ROUTER
 from ..core.voice import speak, voice_muted
 from ..core.self_modification import ingest_codebase
+from ..core.ingest_jobs import INGEST_JOBS
+from ..core.crawler import Crawler, HAS_AIOHTTP
+from ..core.compaction import COMPACTOR, rag_stats
+from ..core.reindex import submit_reindex, reindex_status
 import threading
 
-# Check for web ingestion tools
-try:
-    import requests
-    from bs4 import BeautifulSoup
-    HAS_WEB_TOOLS = True
-except ImportError:
-    HAS_WEB_TOOLS = False
-
 @app.route("/")
 def route_main():
     return render_template('index.html')
@@ -58,47 +57,67 @@ def api_version(fname):
 
 @app.route("/api/rag/add_url", methods=['POST'])
 def api_rag_add_url():
-    if not HAS_WEB_TOOLS:
-        return jsonify({"success": False, "message": "requests or beautifulsoup4 not installed."}), 500
+    if not HAS_AIOHTTP:
+        return jsonify({"success": False, "message": "aiohttp not installed."}), 500
     
     url = request.json.get('url')
     if not url:
         return jsonify({"success": False, "message": "URL is required."}), 400
+    if not rag_available():
+        return jsonify({"success": False, "message": "RAG system unavailable."}), 503
 
     try:
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.content, 'html.parser')
-        for script_or_style in soup(["script", "style"]):
-            script_or_style.decompose()
-        
-        text = soup.get_text(separator='\n', strip=True)
-        
-        if rag_add_text(text, doc_id=f"url_{url}"):
-            return jsonify({"success": True, "message": f"Successfully ingested content from {url}"})
-        else:
-            return jsonify({"success": False, "message": "Failed to add extracted text to RAG."}), 500
+        report = Crawler().crawl([url])
+        if report["failed"] or report["skipped"]:
+            problem = (report["failed"] or report["skipped"])[0]
+            return jsonify({"success": False, "message": problem["error"]}), 500
+        if report["pages"]:
+            return jsonify({"success": True, "message": f"Successfully ingested {report['chunks_added']} chunks from {url}"})
+        return jsonify({"success": True, "message": f"{url} is unchanged since it was last ingested."})
 
     except Exception as e:
         logging.error(f"RAG Ingest URL failed for {url}: {e}")
         return jsonify({"success": False, "message": str(e)}), 500
 
+@app.route("/api/rag/crawl", methods=['POST'])
+def api_rag_crawl():
+    """Crawls a list of URLs, or a seed URL plus link depth, into the RAG as a background job."""
+    if not HAS_AIOHTTP:
+        return jsonify({"success": False, "message": "aiohttp not installed."}), 500
+    data = request.get_json(silent=True) or {}
+    urls = data.get("urls") or ([data["url"]] if data.get("url") else [])
+    if not urls:
+        return jsonify({"success": False, "message": "'urls' or 'url' is required."}), 400
+    depth, same_host = int(data.get("depth", 0)), bool(data.get("same_host", True))
+    max_pages = int(data.get("max_pages", RAG_CRAWL_MAX_PAGES))
+    if not rag_available():
+        return jsonify({"success": False, "message": "RAG system unavailable."}), 503
+    try:
+        crawler = Crawler(max_pages=max_pages)
+        source = "crawl:" + hashlib.sha256(json.dumps([sorted(urls), depth, same_host]).encode("utf-8")).hexdigest()[:16]
+        job, created = INGEST_JOBS.submit(
+            source, lambda job: crawler.crawl(urls, depth, same_host, progress=job.progress, should_cancel=job.cancel_requested),
+            description=f"Crawl of {urls[0]}" + (f" and {len(urls) - 1} more" if len(urls) > 1 else "") + (f" (depth {depth})" if depth else ""))
+        return jsonify({"success": True, "job": job.to_dict()}), 202 if created else 200
+    except Exception as e:
+        logging.error(f"Failed to start crawl: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
 @app.route("/api/vscode_chat", methods=['POST'])
 def api_vscode_chat():
     data = request.json
     prompt = data.get("prompt", "")
     code = data.get("code", "")
 
-    context = rag_search(prompt)
+    packed = rag_context(prompt, where=route_query(prompt, origin="vscode"))
+    context = packed["context"]
     user_content = f"CONTEXT:\n{context}\n\nCODE:\n```\n{code}\n```\n\nREQUEST: {prompt}" if context else f"CODE:\n```\n{code}\n```\n\nREQUEST: {prompt}"
 
     messages = [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": user_content}]
-    response_text = call_llm(messages)
+    response_text = call_llm(messages, cache=data.get("cache", True))
     if not voice_muted.is_set():
         threading.Thread(target=speak, args=(response_text,)).start()
-    return jsonify({"resp": response_text})
+    return jsonify({"resp": response_text, "sources": packed["citations"]})
 
 @app.route("/api/voice/status")
 def api_voice_status():
@@ -121,11 +140,126 @@ def api_voice_toggle():
 
 @app.route("/api/rag/ingest_codebase", methods=['POST'])
 def api_ingest_codebase():
-    """Triggers the ingestion of the entire project codebase into the RAG."""
+    """Starts an incremental codebase ingestion job, or returns the one already running."""
+    if (request.get_json(silent=True) or {}).get("dry_run"):
+        return jsonify({"success": True, "report": ingest_codebase(dry_run=True)})
     try:
-        # Run in a background thread to not block the server
-        threading.Thread(target=ingest_codebase).start()
-        return jsonify({"success": True, "message": "Codebase ingestion started in the background."})
+        job, created = INGEST_JOBS.submit(
+            "codebase", lambda job: ingest_codebase(progress=job.progress, should_cancel=job.cancel_requested),
+            description="Codebase ingestion")
+        message = "Codebase ingestion started in the background." if created else "Codebase ingestion is already in progress."
+        return jsonify({"success": True, "message": message, "job": job.to_dict()}), 202 if created else 200
     except Exception as e:
         logging.error(f"Failed to start codebase ingestion: {e}")
         return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route("/api/rag/jobs")
+def api_rag_jobs():
+    """Lists recent ingestion jobs, newest first."""
+    return jsonify(INGEST_JOBS.list())
+
+@app.route("/api/rag/jobs/<job_id>")
+def api_rag_job(job_id):
+    job = INGEST_JOBS.get(job_id)
+    if job is None: return jsonify({"success": False, "message": "Job not found."}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/api/rag/jobs/<job_id>/cancel", methods=['POST'])
+def api_rag_job_cancel(job_id):
+    job = INGEST_JOBS.cancel(job_id)
+    if job is None: return jsonify({"success": False, "message": "Job not found."}), 404
+    return jsonify({"success": True, "job": job.to_dict()})
+
+@app.route("/api/rag/status")
+def api_rag_status():
+    """Reports RAG readiness: cold, loading, ready or failed."""
+    return jsonify(rag_status())
+
+@app.route("/api/rag/warmup", methods=['POST'])
+def api_rag_warmup():
+    """Starts (or retries) RAG initialization in the background."""
+    start_warmup()
+    return jsonify(rag_status())
+
+@app.route("/api/rag/cache")
+def api_rag_cache():
+    """Hit/miss counts and time saved by the query embedding and search result caches."""
+    return jsonify(rag_cache_stats())
+
+@app.route("/api/rag/ann_recall")
+def api_rag_ann_recall():
+    """Measures ANN recall@k against exact search for several nprobe settings."""
+    report = rag_ann_report(k=request.args.get("k", 10, type=int), queries=request.args.get("queries", 100, type=int))
+    if report is None:
+        return jsonify({"success": False, "message": "No ANN index is active (requires JEMAI_RAG_ANN=ivf and the NumPy backend)."}), 404
+    return jsonify({"success": True, "report": report})
+
+@app.route("/api/rag/quant_recall")
+def api_rag_quant_recall():
+    """Reports the memory saving and recall@k of quantized search for several re-rank factors."""
+    report = rag_quant_report(k=request.args.get("k", 10, type=int), queries=request.args.get("queries", 100, type=int))
+    if report is None:
+        return jsonify({"success": False, "message": "Quantization is off (set JEMAI_RAG_QUANTIZATION=int8|binary with the NumPy backend)."}), 404
+    return jsonify({"success": True, "report": report})
+
+@app.route("/api/rag/dedup")
+def api_rag_dedup():
+    """Near-duplicate detection counters: documents checked and skipped, and the embedding time saved."""
+    return jsonify(rag_dedup_stats())
+
+@app.route("/api/rag/stats")
+def api_rag_stats():
+    """Store sizes per namespace, cache and dedup hit rates, retention policies and the last compaction report."""
+    return jsonify(rag_stats())
+
+@app.route("/api/rag/compact", methods=['POST'])
+def api_rag_compact():
+    """Starts a compaction pass now; with dry_run the report lists what would be evicted."""
+    dry_run = bool((request.get_json(silent=True) or {}).get("dry_run"))
+    job, created = COMPACTOR.submit(dry_run=dry_run)
+    return jsonify({"success": True, "job": job.to_dict()}), 202 if created else 200
+
+@app.route("/api/rag/reindex", methods=['GET', 'POST'])
+def api_rag_reindex():
+    """POST builds a new index generation in the background and swaps it in; GET shows the active generation and re-index progress/ETA."""
+    if request.method == 'GET':
+        return jsonify(reindex_status())
+    data = request.get_json(silent=True) or {}
+    try:
+        job, created = submit_reindex(data.get("embedder"), bool(data.get("rechunk")), float(data.get("cpu_share", RAG_REINDEX_CPU_SHARE)))
+        return jsonify({"success": True, "job": job.to_dict()}), 202 if created else 200
+    except Exception as e:
+        logging.error(f"Failed to start re-index: {e}")
+        return jsonify({"success": False, "message": str(e)}), 500
+
+@app.route("/api/llm/timings")
+def api_llm_timings():
+    """Time to first token and total latency per call mode (blocking vs streaming) over the recent calls."""
+    return jsonify(LLM_TIMINGS.stats())
+
+@app.route("/api/llm/cache", methods=['GET', 'DELETE'])
+def api_llm_cache():
+    """GET shows response cache hits, misses, evictions and size; DELETE empties it."""
+    if request.method == 'DELETE':
+        return jsonify({"success": True, "removed": RESPONSE_CACHE.clear()})
+    return jsonify(RESPONSE_CACHE.stats())
+
+@app.route("/api/llm/semantic_cache", methods=['GET', 'DELETE'])
+def api_llm_semantic_cache():
+    """GET shows semantic cache hit rate, false hits and the latest audited hits; DELETE empties it."""
+    if request.method == 'DELETE':
+        return jsonify({"success": True, "removed": SEMANTIC_CACHE.clear()})
+    return jsonify({"stats": SEMANTIC_CACHE.stats(), "recent_hits": SEMANTIC_CACHE.recent_hits(int(request.args.get("limit", 50)))})
+
+@app.route("/api/llm/semantic_cache/false_hit", methods=['POST'])
+def api_llm_semantic_false_hit():
+    """Reports an audited hit that answered a different question; its cached entry is dropped."""
+    data = request.json or {}
+    if not SEMANTIC_CACHE.report_false_hit(data.get("audit_id"), data.get("note")):
+        return jsonify({"success": False, "message": "Unknown audit id."}), 404
+    return jsonify({"success": True})
+
+@app.route("/api/llm/providers")
+def api_llm_providers():
+    """LLM providers with their health, measured latency and errors, plus routing and fallback counts."""
+    return jsonify(ROUTER.stats())
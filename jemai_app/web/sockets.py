@@ -3,30 +3,31 @@ import threading
 import time
 import os
 import json
+import uuid
 from .. import socketio
-from ..config import SYSTEM_PROMPT, JEMAI_HUB
-from ..core.rag import rag_search
-from ..core.ai import call_llm
+from ..config import SYSTEM_PROMPT, JEMAI_HUB, LLM_STREAM, RAG_CHAT_MEMORY
+from ..core.rag import rag_context, route_query, rag_add_text
+from ..core.ai import call_llm, stream_llm
 from ..core.tools import run_command
-from ..core.voice import speak
+from ..core.voice import speak, SentenceSpeaker
 from ..core.self_modification import write_file_content
 
-@socketio.on('chat_message')
-def handle_chat_message(data):
-    messages = data.get("messages", [])
-    model = data.get("model", "gpt-4o")
-    if not messages: return
-
-    last_user_message = messages[-1]['content']
-    context = rag_search(last_user_message)
-    if context:
-        messages[-1]['content'] = f"CONTEXT:\n{context}\n\nQUERY: {last_user_message}"
-
-    if messages[0]['role'] != 'system':
-        messages.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
-
-    response_text = call_llm(messages, model=model)
+def remember_exchange(question, answer, remember=True):
+    """
+    Stores a finished chat turn in the RAG 'chat' namespace so later
+    questions can recall it; only with JEMAI_RAG_CHAT_MEMORY on and when the
+    client has not opted out.
+    """
+    if not (RAG_CHAT_MEMORY and remember and answer): return
+    text = f"USER: {question}\n\nJEMAI: {answer}"
+    threading.Thread(target=rag_add_text, args=(text,), kwargs={"namespace": "chat", "source": "chat"}, daemon=True).start()
 
+def run_tool_call(messages, response_text):
+    """
+    Runs the tool a reply asks for: a write_file JSON call or a ```shell
+    block. Returns (follow-up messages carrying the result, whether the
+    final answer is spoken), or (None, True) when the reply is the answer.
+    """
     try:
         tool_match = json.loads(response_text)
         if tool_match.get("tool_to_use") == "write_file":
@@ -35,29 +36,85 @@ def handle_chat_message(data):
             content = params.get("content")
             if path and content is not None:
                 success, result_msg = write_file_content(path, content)
-                messages.append({"role": "assistant", "content": response_text})
-                messages.append({"role": "user", "content": f"I executed the `write_file` tool. Result: {result_msg}"})
-                final_response = call_llm(messages, model=model)
-                socketio.emit('chat_response', {'resp': final_response})
-                return
-    except (json.JSONDecodeError, TypeError):
+                return messages + [
+                    {"role": "assistant", "content": response_text},
+                    {"role": "user", "content": f"I executed the `write_file` tool. Result: {result_msg}"}
+                ], False
+    except (json.JSONDecodeError, TypeError, AttributeError):
         pass
 
     shell_match = re.search(r"```shell\n([\s\S]*?)\n```", response_text)
     if shell_match:
         command_to_run = shell_match.group(1).strip()
         command_output = run_command(command_to_run)
-        
-        follow_up_messages = messages + [
+        return messages + [
             {"role": "assistant", "content": response_text},
             {"role": "user", "content": f"I executed that command. Here is the output:\n\n```\n{command_output}\n```\n\nPlease analyze this output and provide the final answer."}
-        ]
-        
-        final_response = call_llm(follow_up_messages, model=model)
-        socketio.emit('chat_response', {'resp': final_response})
-        threading.Thread(target=speak, args=(final_response,)).start()
-    else:
-        socketio.emit('chat_response', {'resp': response_text})
+        ], True
+    return None, True
+
+def stream_reply(messages, model, speaker=None, cache=True, question=None):
+    """Streams one completion as chat_response_delta events; returns (response id, full text, time to first token in ms)."""
+    response_id = uuid.uuid4().hex[:12]
+    parts, started, ttft_ms = [], time.perf_counter(), None
+    for delta in stream_llm(messages, model=model, cache=cache, question=question):
+        if ttft_ms is None: ttft_ms = round((time.perf_counter() - started) * 1000, 1)
+        parts.append(delta)
+        socketio.emit('chat_response_delta', {'id': response_id, 'delta': delta})
+        if speaker: speaker.feed(delta)
+    return response_id, "".join(parts), ttft_ms
+
+def stream_chat(messages, model, sources, question, cache=True, remember=True):
+    """
+    Streaming counterpart of the blocking flow: each completion goes out as
+    chat_response_delta events and ends with chat_response_done ('final'
+    is false for a reply that triggered a tool). Speech starts with the
+    first complete sentence.
+    """
+    started = time.perf_counter()
+    speaker = SentenceSpeaker()
+    response_id, response_text, ttft_ms = stream_reply(messages, model, speaker, cache, question)
+    follow_up, speak_answer = run_tool_call(messages, response_text)
+    if follow_up is not None:
+        speaker.discard()
+        socketio.emit('chat_response_done', {'id': response_id, 'resp': response_text, 'final': False, 'ttft_ms': ttft_ms})
+        speaker = SentenceSpeaker() if speak_answer else None
+        response_id, response_text, ttft_ms = stream_reply(follow_up, model, speaker, cache)
+    if speaker: speaker.close()
+    socketio.emit('chat_response_done', {'id': response_id, 'resp': response_text, 'sources': sources, 'final': True, 'ttft_ms': ttft_ms,
+                                         'total_ms': round((time.perf_counter() - started) * 1000, 1)})
+    remember_exchange(question, response_text, remember)
+
+@socketio.on('chat_message')
+def handle_chat_message(data):
+    messages = data.get("messages", [])
+    model = data.get("model", "gpt-4o")
+    # Clients send "cache": false when a fresh answer is wanted for a repeated question.
+    cache = data.get("cache", True)
+    # "remember": false keeps the turn out of chat memory; a client opting out of the cache is taken to mean it too.
+    remember = data.get("remember", cache)
+    if not messages: return
+
+    last_user_message = messages[-1]['content']
+    packed = rag_context(last_user_message, where=route_query(last_user_message))
+    sources = packed["citations"]
+    if packed["context"]:
+        messages[-1]['content'] = f"CONTEXT:\n{packed['context']}\n\nQUERY: {last_user_message}"
+
+    if messages[0]['role'] != 'system':
+        messages.insert(0, {"role": "system", "content": SYSTEM_PROMPT})
+
+    # Clients that render chat_response_delta / chat_response_done ask for a stream.
+    if data.get("stream", LLM_STREAM):
+        return stream_chat(messages, model, sources, last_user_message, cache, remember)
+
+    response_text = call_llm(messages, model=model, cache=cache, question=last_user_message)
+    follow_up, speak_answer = run_tool_call(messages, response_text)
+    if follow_up is not None:
+        response_text = call_llm(follow_up, model=model, cache=cache)
+    socketio.emit('chat_response', {'resp': response_text, 'sources': sources})
+    remember_exchange(last_user_message, response_text, remember)
+    if speak_answer:
         threading.Thread(target=speak, args=(response_text,)).start()
 
 @socketio.on('request_log_stream')
@@ -97,7 +154,7 @@ def handle_director_message(data):
     ]
     
     # Use a specific model for this complex task
-    response_text = call_llm(messages, model="gpt-4o")
+    response_text = call_llm(messages, model="gpt-4o", cache=data.get("cache", True), question=directive)
     
     # The response from JEMAI will be handled by the main chat logic,
     # so we just emit it back as a standard chat response for the user to see.
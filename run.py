@@ -1,7 +1,9 @@
 import threading
 import logging
 from jemai_app import app, socketio
-from jemai_app.config import JEMAI_PORT, FLASK_DEBUG
+from jemai_app.config import JEMAI_PORT, FLASK_DEBUG, RAG_WARMUP
+from jemai_app.core.rag import start_warmup
+from jemai_app.core.compaction import start_compactor
 from jemai_app.core.main import main_loop
 from jemai_app.core.back_of_house import back_of_house_loop
 from jemai_app.desktop.clipboard import clipboard_watcher
@@ -24,6 +26,12 @@ if __name__ == '__main__':
     threading.Thread(target=main_loop, daemon=True, name="MainLoop").start()
     threading.Thread(target=back_of_house_loop, daemon=True, name="BackOfHouseLoop").start()
     
+    # Load the embedding model in the background; the server does not wait for it.
+    if RAG_WARMUP:
+        start_warmup()
+    # Enforce RAG retention policies periodically (JEMAI_RAG_COMPACT_INTERVAL).
+    start_compactor()
+    
     # Start desktop integration loops
     threading.Thread(target=clipboard_watcher, daemon=True, name="ClipboardWatcher").start()
     
@@ -0,0 +1,20 @@
+import os
+import importlib
+
+os.environ.setdefault("JEMAI_RAG_BACKEND", "numpy")
+os.environ.setdefault("JEMAI_RAG_EMBEDDER", "hashing")
+os.environ.setdefault("JEMAI_RAG_DEDUP", "skip")
+
+import pytest
+from jemai_app.core import rag as rag_module
+
+
+@pytest.fixture
+def rag(tmp_path, monkeypatch):
+    """A freshly loaded RAG module whose NumPy store lives under `tmp_path`."""
+    module = importlib.reload(rag_module)
+    monkeypatch.setattr(module, "RAG_STORE_PATH", str(tmp_path / "rag_store"))
+    monkeypatch.setattr(module, "RAG_GENERATIONS_PATH", str(tmp_path / "rag_generations.json"))
+    assert module.ensure_rag()
+    yield module
+    if module.RAG_COLLECTION is not None and hasattr(module.RAG_COLLECTION, "close"): module.RAG_COLLECTION.close()
@@ -0,0 +1,18 @@
+from jemai_app.core.compaction import Compactor
+
+WORDS = " ".join(f"word{i}" for i in range(200))
+
+
+def test_quota_eviction_does_not_restore_skipped_duplicates(rag):
+    docs = [{"id": "original", "text": WORDS + " end", "metadata": {"ingested_at": 1}}]
+    docs += [{"id": f"copy{i}", "text": WORDS + f" variant{i}"} for i in range(3)]
+    docs += [{"id": f"other{i}", "text": f"an unrelated page number {i} about something else"} for i in range(2)]
+    stats = rag.rag_add_texts(docs, namespace="web", source="crawler")
+    assert stats["added"] == 3 and stats["near_duplicates"] == 3
+
+    report = Compactor(policies={"web": {"max_docs": 2, "evict": "age"}}, interval=0).compact()
+
+    assert report["evicted"] == 1
+    stored = rag.RAG_COLLECTION.get(where={"namespace": "web"}, include=[])["ids"]
+    assert sorted(stored) == ["other0", "other1"]
+    assert len(rag.SKIPPED_DUPLICATES) == 0
@@ -0,0 +1,20 @@
+import numpy as np
+from jemai_app.core.context_packer import pack_context
+
+
+def _hit(doc_id, text):
+    return {"id": doc_id, "document": text, "metadata": {}, "score": None}
+
+
+def test_candidates_below_the_relevance_floor_are_not_packed():
+    query_vector = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    hits = [_hit("match", "the answer"), _hit("unrelated", "filler text"), _hit("opposite", "more filler")]
+    vectors = np.array([[0.9, 0.1, 0.0], [0.1, 0.9, 0.0], [-0.8, 0.2, 0.0]], dtype=np.float32)
+
+    context, citations = pack_context("answer", hits, query_vector, vectors, token_budget=500, min_score=0.2)
+
+    assert context == "the answer"
+    assert [c["id"] for c in citations] == ["match"] and citations[0]["score"] == 0.9
+    _, citations = pack_context("answer", hits, query_vector, vectors, token_budget=500)
+    assert len(citations) == 3
+    assert pack_context("answer", hits[1:], query_vector, vectors[1:], token_budget=500, min_score=0.2) == ("", [])
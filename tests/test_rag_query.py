@@ -0,0 +1,13 @@
+def test_keyword_shortcut_keeps_bm25_out_of_the_similarity_score(rag):
+    rag.rag_add_texts([
+        {"id": "parser", "text": "def parse_config_file(path):\n    return load(path)"},
+        {"id": "writer", "text": "def write_report(rows):\n    return render(rows)"},
+        {"id": "notes", "text": "meeting notes about the quarterly roadmap"},
+    ], namespace="code", source="test")
+
+    hits = rag.rag_query("where is parse_config_file defined?", n_results=2)
+
+    assert hits[0]["id"] == "parser"
+    assert hits[0]["score"] is None and hits[0]["keyword_score"] > 0
+    hits = rag.rag_query("quarterly roadmap meeting", n_results=3)
+    assert all(hit["score"] is None or -1.0 <= hit["score"] <= 1.0 for hit in hits)